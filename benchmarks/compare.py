@@ -0,0 +1,46 @@
+"""
+Compare two 'mplayer bench' result files and report regressions
+
+    python benchmarks/compare.py old.json new.json [--threshold 0.1]
+
+Exits with status 1 if the median of any benchmark got slower by more than
+the threshold.
+"""
+
+import argparse
+import json
+import sys
+
+# measured values, the other fields identify the benchmark
+_MEASURED = {"seconds", "iterate_seconds", "bytes_per_entry", "requests_per_second"}
+
+
+def _key(r: dict) -> tuple:
+    return tuple(sorted((k, v) for k, v in r.items() if k not in _MEASURED))
+
+
+def main():
+    p = argparse.ArgumentParser(description=__doc__)
+    p.add_argument("old")
+    p.add_argument("new")
+    p.add_argument("--threshold", type=float, default=0.1)
+    ns = p.parse_args()
+    with open(ns.old) as f:
+        old = {_key(r): r["seconds"] for r in json.load(f)["results"]}
+    with open(ns.new) as f:
+        new = {_key(r): r["seconds"] for r in json.load(f)["results"]}
+    regressed = False
+    for k in sorted(old.keys() & new.keys()):
+        o, n = old[k]["median"], new[k]["median"]
+        change = (n - o) / o if o else 0.0
+        mark = ""
+        if change > ns.threshold:
+            regressed = True
+            mark = "  REGRESSION"
+        name = " ".join(f"{a}={b}" for a, b in k)
+        print(f"{name}: {o:.6g}s -> {n:.6g}s ({change:+.1%}){mark}")
+    return 1 if regressed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,95 @@
+"""
+Time-to-play of persist() compared to the plain copy it replaced
+
+Measures the time until a playable path is available and the longest stall
+of the event loop while waiting for it, and reports how the file was pinned:
+hardlink, reflink, fd or copy.
+
+    python benchmarks/persist.py [--dir DIR] [--sizes 10M 1G 5G]
+"""
+
+import argparse
+import asyncio
+import contextlib
+import json
+import shutil
+import tempfile
+import time
+
+from pathlib import Path
+
+from mplayer.persist import pin
+
+_UNITS = {"K": 1 << 10, "M": 1 << 20, "G": 1 << 30}
+_CHUNK = 1 << 20
+
+
+@contextlib.asynccontextmanager
+async def _copy(path: Path):
+    with tempfile.TemporaryDirectory() as d:
+        dst = Path(d) / path.name
+        shutil.copy(path, dst)
+        yield dst, "copy"
+
+
+def _parse_size(s: str) -> int:
+    if s[-1].upper() in _UNITS:
+        return int(s[:-1]) * _UNITS[s[-1].upper()]
+    return int(s)
+
+
+def _mkfile(path: Path, size: int):
+    block = bytes(range(256)) * (_CHUNK // 256)
+    with open(path, "wb") as f:
+        for _ in range(size // _CHUNK):
+            f.write(block)
+        f.write(block[: size % _CHUNK])
+
+
+async def _measure(cm, path: Path) -> dict:
+    stall = 0.0
+    running = True
+
+    async def heartbeat():
+        nonlocal stall
+        prev = time.perf_counter()
+        while running:
+            await asyncio.sleep(0.001)
+            now = time.perf_counter()
+            stall = max(stall, now - prev)
+            prev = now
+
+    hb = asyncio.create_task(heartbeat())
+    await asyncio.sleep(0)
+    start = time.perf_counter()
+    async with cm(path) as (p, how):
+        ready = time.perf_counter() - start
+        with open(p, "rb") as f:
+            f.read(1)
+    running = False
+    await hb
+    return {"path": how, "time_to_play_s": ready, "max_loop_stall_s": stall}
+
+
+async def _bench(directory: Path, sizes: list[str]):
+    for s in sizes:
+        f = directory / f"bench-{s}.bin"
+        _mkfile(f, _parse_size(s))
+        try:
+            for name, cm in (("copy", _copy), ("persist", pin)):
+                res = await _measure(cm, f)
+                print(json.dumps({"size": s, "method": name, **res}))
+        finally:
+            f.unlink()
+
+
+def main():
+    p = argparse.ArgumentParser(description=__doc__)
+    p.add_argument("--dir", default=".", help="directory for the test files")
+    p.add_argument("--sizes", nargs="+", default=["10M", "1G", "5G"])
+    ns = p.parse_args()
+    asyncio.run(_bench(Path(ns.dir), ns.sizes))
+
+
+if __name__ == "__main__":
+    main()
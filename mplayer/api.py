@@ -1,57 +1,285 @@
+"""
+Control API over a unix socket
+
+Messages are JSON objects, each framed by its length as a 4 byte big endian
+integer. A request is {"id": int, "op": str, "args": {...}} and its response
+{"id": int, "result": ...} or {"id": int, "error": str}. Requests on the same
+connection are handled concurrently so responses may arrive out of order.
+
+Streaming requests such as subscribe are answered with any number of
+{"id": int, "event": {...}} messages before the final response. They end
+when the client sends {"op": "cancel", "args": {"id": int}} or disconnects.
+"""
+
 import asyncio
+import json
+import logging
 import os
-from typing import TypeAlias, TypeVar
+import struct
+from typing import Any, AsyncIterator, Dict, Set, TypeAlias, TypeVar
 from collections.abc import Awaitable, Callable
 
+from .events import MAX_QUEUE, EventBus
 
 T = TypeVar("T")
 
 OnScan: TypeAlias = Callable[[], Awaitable[None]]
+Handler: TypeAlias = Callable[..., Awaitable[Any]]
+StreamHandler: TypeAlias = Callable[..., AsyncIterator[Any]]
+
+_L = logging.getLogger(__name__)
+
+_HEADER = struct.Struct(">I")
+# Larger frames are a protocol error
+_MAX_FRAME = 16 * 1024 * 1024
+
+
+class ApiError(Exception):
+    """
+    Request failed on the server side
+    """
+
+
+async def read_frame(r: asyncio.StreamReader) -> Dict[str, Any] | None:
+    """
+    Read a message, None at the end of the stream
+    """
+    try:
+        header = await r.readexactly(_HEADER.size)
+    except asyncio.IncompleteReadError as e:
+        if e.partial:
+            raise
+        return None
+    (size,) = _HEADER.unpack(header)
+    if size > _MAX_FRAME:
+        raise ValueError(f"Frame too large: {size} bytes")
+    return json.loads(await r.readexactly(size))
+
+
+def write_frame(w: asyncio.StreamWriter, msg: Dict[str, Any]):
+    data = json.dumps(msg, separators=(",", ":")).encode()
+    w.write(_HEADER.pack(len(data)) + data)
 
 
 class Server:
+    """
+    Serves the registered routes
+
+    A route is a coroutine function called with the arguments of the request
+    as keyword arguments. Its return value, which must be JSON serializable,
+    is the result of the request.
 
-    def __init__(self, sock: os.PathLike):
+    Events published to the event bus are streamed to subscribed clients.
+    """
+
+    def __init__(self, sock: os.PathLike | str, events: EventBus | None = None):
         self._sock = sock
-        self._on_scan: OnScan | None = None
+        self._routes: Dict[str, Handler] = {}
+        self._streams: Dict[str, StreamHandler] = {}
+        self._srv: asyncio.AbstractServer | None = None
+        self.events = events if events is not None else EventBus()
+        self.route("ping", self._ping)
+        self.stream("subscribe", self._subscribe)
+
+    def route(self, op: str, handler: Handler):
+        self._routes[op] = handler
+
+    def stream(self, op: str, handler: StreamHandler):
+        """
+        Register a route whose handler returns an async iterator of events
+        """
+        self._streams[op] = handler
+
+    async def _subscribe(self, maxsize: int = MAX_QUEUE):
+        with self.events.subscribe(maxsize) as sub:
+            async for ev in sub:
+                yield ev
 
     def on_scan(self, cb: OnScan):
-        self._on_scan = cb
+        self.route("scan", cb)
+
+    async def _ping(self):
+        return None
 
     async def run(self):
-        await asyncio.start_unix_server(self._serve, self._sock)
+        """
+        Start listening, the requests are served in the background
+        """
+        self._srv = await asyncio.start_unix_server(self._serve, self._sock)
 
-    async def _serve(self, r: asyncio.StreamReader, w: asyncio.StreamWriter):
-        data = await r.read()
-        service, *args = data.split(b"\x00")
-        if service == b"ping":
-            w.write_eof()
-            await w.drain()
-            return
-        if service == b"scan":
-            assert self._on_scan is not None
-            await self._on_scan()
-            w.write_eof()
+    async def serve_forever(self):
+        if self._srv is None:
+            await self.run()
+        assert self._srv is not None
+        await self._srv.serve_forever()
+
+    def close(self):
+        if self._srv is not None:
+            self._srv.close()
+
+    async def _handle(self, w: asyncio.StreamWriter, req: Dict[str, Any]):
+        rid = req.get("id")
+        op, args = req.get("op", ""), req.get("args", {})
+        try:
+            if op in self._streams:
+                async for ev in self._streams[op](**args):
+                    if w.is_closing():
+                        return
+                    write_frame(w, {"id": rid, "event": ev})
+                    await w.drain()
+                res = {"id": rid, "result": None}
+            elif op in self._routes:
+                res = {"id": rid, "result": await self._routes[op](**args)}
+            else:
+                raise ApiError(f"Unknown operation: {op}")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            _L.debug("request %s failed", req, exc_info=True)
+            res = {"id": rid, "error": f"{type(e).__name__}: {e}"}
+        if not w.is_closing():
+            write_frame(w, res)
             await w.drain()
-            return
-        w.write_eof()
-        await w.drain()
+
+    async def _serve(self, r: asyncio.StreamReader, w: asyncio.StreamWriter):
+        tasks: Dict[Any, asyncio.Task] = {}
+        streaming: Set[asyncio.Task] = set()
+        try:
+            while (req := await read_frame(r)) is not None:
+                if req.get("op") == "cancel":
+                    t = tasks.get(req.get("args", {}).get("id"))
+                    if t is not None:
+                        t.cancel()
+                    continue
+                rid = req.get("id")
+                t = tasks[rid] = asyncio.create_task(self._handle(w, req))
+                t.add_done_callback(lambda _, rid=rid: tasks.pop(rid, None))
+                if req.get("op") in self._streams:
+                    streaming.add(t)
+                    t.add_done_callback(streaming.discard)
+        except (ValueError, ConnectionError, asyncio.IncompleteReadError) as e:
+            _L.warning("dropping client: %s", e)
+        finally:
+            for t in streaming:
+                t.cancel()
+            if tasks:
+                await asyncio.wait(list(tasks.values()))
+            w.close()
 
 
 class Client:
+    """
+    Connection to the server
 
-    def __init__(self, sock: str):
+    The connection is opened on the first request and kept open. Requests can
+    be issued concurrently and are pipelined on the connection.
+    """
+
+    def __init__(self, sock: os.PathLike | str):
         self._sock = sock
+        self._w: asyncio.StreamWriter | None = None
+        self._reader: asyncio.Task | None = None
+        self._connecting: asyncio.Lock | None = None
+        self._pending: Dict[int, asyncio.Future] = {}
+        self._events: Dict[int, asyncio.Queue] = {}
+        self._next_id = 0
 
     async def ping(self):
-        return await self._request(b"ping")
+        return await self.call("ping")
 
     async def scan(self):
-        return await self._request(b"scan")
+        return await self.call("scan")
+
+    async def call(self, op: str, **args) -> Any:
+        """
+        Make a request, raises ApiError if it fails on the server
+        """
+        rid, fut = await self._send(op, args)
+        try:
+            res = await fut
+        finally:
+            self._pending.pop(rid, None)
+        if "error" in res:
+            raise ApiError(res["error"])
+        return res.get("result")
+
+    async def subscribe(
+        self, maxsize: int = MAX_QUEUE
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Stream the events of the server until the iteration is stopped
+
+        :param maxsize: Events buffered on the server before dropping the oldest
+        """
+        events: asyncio.Queue = asyncio.Queue()
+        rid, fut = await self._send("subscribe", {"maxsize": maxsize}, events)
+        try:
+            while True:
+                get = asyncio.ensure_future(events.get())
+                await asyncio.wait([get, fut], return_when=asyncio.FIRST_COMPLETED)
+                if not get.done():
+                    get.cancel()
+                    res = fut.result()
+                    if "error" in res:
+                        raise ApiError(res["error"])
+                    return
+                yield get.result()
+        finally:
+            self._pending.pop(rid, None)
+            self._events.pop(rid, None)
+            if not fut.done() and self._w is not None:
+                write_frame(self._w, {"op": "cancel", "args": {"id": rid}})
 
-    async def _request(self, service: bytes, *args: bytes):
-        r, w = await asyncio.open_unix_connection(self._sock)
-        w.write(b"\x00".join([service, *args]))
-        w.write_eof()
+    async def _send(
+        self, op: str, args: Dict[str, Any], events: asyncio.Queue | None = None
+    ):
+        w = await self._connect()
+        rid = self._next_id
+        self._next_id += 1
+        fut = asyncio.get_running_loop().create_future()
+        self._pending[rid] = fut
+        if events is not None:
+            self._events[rid] = events
+        write_frame(w, {"id": rid, "op": op, "args": args})
         await w.drain()
-        return await r.read()
+        return rid, fut
+
+    async def _connect(self) -> asyncio.StreamWriter:
+        if self._connecting is None:
+            self._connecting = asyncio.Lock()
+        async with self._connecting:
+            if self._w is None:
+                r, self._w = await asyncio.open_unix_connection(self._sock)
+                self._reader = asyncio.create_task(self._read(r))
+            return self._w
+
+    async def _read(self, r: asyncio.StreamReader):
+        err: BaseException = ConnectionResetError("Connection closed by server")
+        try:
+            while (res := await read_frame(r)) is not None:
+                rid = res.get("id")
+                if rid is None:
+                    continue
+                if "event" in res:
+                    events = self._events.get(rid)
+                    if events is not None:
+                        events.put_nowait(res["event"])
+                    continue
+                fut = self._pending.get(rid)
+                if fut is not None and not fut.done():
+                    fut.set_result(res)
+        except (ValueError, ConnectionError, asyncio.IncompleteReadError) as e:
+            err = e
+        finally:
+            if self._w is not None:
+                self._w.close()
+            self._w = None
+            for fut in self._pending.values():
+                if not fut.done():
+                    fut.set_exception(err)
+
+    async def close(self):
+        if self._reader is not None:
+            self._reader.cancel()
+            await asyncio.wait([self._reader])
+            self._reader = None
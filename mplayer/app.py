@@ -4,11 +4,15 @@ Business logic
 
 import logging
 import asyncio
+import mimetypes
 
 from datetime import timedelta, datetime
-from typing import Iterable, AsyncGenerator, Dict
-from .vlc_player import VlcPlayer
-from .schedule import Schedule
+from pathlib import Path
+from typing import Awaitable, Iterable, AsyncGenerator, Dict, List
+from . import metrics
+from .events import EventBus
+from .player import Player
+from .schedule import Event, Schedule
 from .playlist import PlaylistSpec
 from .core import Core
 
@@ -20,14 +24,45 @@ class App:
     Top level stuff
     """
 
-    def __init__(self, core: Core):
+    def __init__(
+        self,
+        core: Core,
+        player: Player | None = None,
+        events: EventBus | None = None,
+    ):
+        """
+        :param events: Where to publish monitoring events of the core and player
+        """
         self._core = core
-        self._player = VlcPlayer()
+        if player is None:
+            from .vlc_player import VlcPlayer
+
+            player = VlcPlayer()
+        self._player = player
         self._sched_task = None
         self._sched = Schedule()
         self._plists: Dict[str, PlaylistSpec] = {}
         self._repeat = False
         self._plist_name = ""
+        self._grace = timedelta(0)
+        self._finish_images = True
+        self._cutover = asyncio.Event()
+        self._skip = asyncio.Event()
+        self._follow = False
+        self._paused = False
+        # media being played
+        self.current: Path | None = None
+        self._switch: Event | None = None
+        self._preload_task: asyncio.Task | None = None
+        # seconds from scheduled switches to the start of the new playlist
+        self.switch_latencies: List[float] = []
+        core.on_upcoming = self._on_upcoming
+        core.on_switch = self._on_switch
+        self._events = events
+        player.on_error = self._on_error
+        if events is not None:
+            core.events = events
+            player.on_playing = lambda f: events.publish("now_playing", file=str(f))
 
     async def set_repeat(self, repeat=True):
         self._repeat = repeat
@@ -41,13 +76,165 @@ class App:
     def set_fullscreen(self, val: bool):
         return self._player.set_fullscreen(val)
 
-    async def play(self):
+    async def set_follow(self, follow=True):
+        """
+        Wait for more media at the end of the playlists instead of returning
+        """
+        self._follow = follow
+
+    async def set_paused(self, paused: bool):
+        await self._player.set_paused(paused)
+        self._paused = paused
+
+    async def close(self):
+        await self._player.close()
+
+    @property
+    def paused(self) -> bool:
+        return self._paused
+
+    @property
+    def can_pause(self) -> bool:
+        return self._player.can_pause
+
+    def skip(self):
+        """
+        Stop the current media and continue with the next one
+        """
+        self._skip.set()
+
+    def restart(self):
+        """
+        Stop the current media and start again from the first one
+        """
+        self._cutover.set()
+        self._skip.set()
+
+    async def set_cutover(self, grace: timedelta, finish_images: bool = True):
+        """
+        Configure how scheduled switches interrupt the current media
+
+        :param grace: How long the current media may continue after the switch
+        :param finish_images: Let images play to their end regardless of grace
+        """
+        self._grace = grace
+        self._finish_images = finish_images
+
+    def _on_upcoming(self, ev: Event, first: Path | None):
+        if first is None:
+            return
+        if self._preload_task is not None:
+            self._preload_task.cancel()
+        self._preload_task = asyncio.create_task(self._preload(first))
+
+    async def _preload(self, file: Path):
+        try:
+            await self._player.preload(file)
+        except FileNotFoundError:
+            pass
+
+    def _on_switch(self, ev: Event):
+        self._switch = ev
+        self._cutover.set()
+
+    def _is_image(self, m: Path) -> bool:
+        typ, _ = mimetypes.guess_type(m)
+        return typ is not None and typ.startswith("image/")
+
+    async def _play(self, m: Path):
+        """
+        Play a media, cut short by a scheduled switch or skipping
+        """
+        play = asyncio.create_task(self._player.play(m))
+        cut = asyncio.create_task(self._cutover.wait())
+        skip = asyncio.create_task(self._skip.wait())
+        try:
+            await asyncio.wait([play, cut, skip], return_when=asyncio.FIRST_COMPLETED)
+            if not play.done() and not skip.done():
+                timeout = self._grace.total_seconds()
+                if self._finish_images and self._is_image(m):
+                    timeout = None
+                await asyncio.wait(
+                    [play, skip], timeout=timeout, return_when=asyncio.FIRST_COMPLETED
+                )
+        finally:
+            cut.cancel()
+            skip.cancel()
+            play.cancel()
+        try:
+            await play
+        except asyncio.CancelledError:
+            if not self._cutover.is_set() and not self._skip.is_set():
+                raise
+            _L.debug("cut %s short", m.name)
+
+    def _on_error(self, f: Path, err: str):
+        metrics.ERRORS.inc()
+        if self._events is not None:
+            self._events.publish("error", file=str(f), message=err)
+
+    def _record_switch(self, ev: Event):
+        latency = (datetime.now() - ev.when).total_seconds()
+        self.switch_latencies.append(latency)
+        metrics.SWITCH_LATENCY_SECONDS.observe(latency)
+        _L.info(
+            'started playlist "%s" %.0f ms after the scheduled switch',
+            ev.playlist,
+            latency * 1000,
+        )
+
+    async def _medias(self) -> AsyncGenerator[Path, None]:
         while True:
-            async for m in self._core.medias(wait=True):
+            follow = self._follow and not self._repeat
+            async for m in self._core.medias(wait=True, follow=follow):
+                yield m
+            if not self._repeat:
+                break
+
+    async def _stage(self, nxt: Awaitable[Path | None]):
+        m = await asyncio.shield(nxt)
+        if m is None:
+            return
+        try:
+            await self._player.stage(m)
+        except FileNotFoundError:
+            pass
+
+    async def play(self):
+        medias = self._medias()
+        # Peek the next media while the current one plays so it can be staged
+        nxt = asyncio.ensure_future(anext(medias, None))
+        try:
+            while True:
+                if self._cutover.is_set():
+                    # Continue from the start of the new playlist
+                    self._cutover.clear()
+                    nxt.cancel()
+                    await asyncio.wait([nxt])
+                    await medias.aclose()
+                    medias = self._medias()
+                    nxt = asyncio.ensure_future(anext(medias, None))
+                if (m := await nxt) is None:
+                    break
+                if self._cutover.is_set():
+                    continue
+                if self._switch is not None:
+                    self._record_switch(self._switch)
+                    self._switch = None
+                nxt = asyncio.ensure_future(anext(medias, None))
+                stage = asyncio.create_task(self._stage(nxt))
+                self._skip.clear()
+                self.current = m
+                metrics.PLAYED.inc()
                 try:
-                    await self._player.play(m)
+                    await self._play(m)
                 except FileNotFoundError:
                     _L.info("Media file disappeared. Requesting rescan")
                     self._core.request_rescan()
-            if not self._repeat:
-                break
+                finally:
+                    self.current = None
+                    stage.cancel()
+        finally:
+            nxt.cancel()
+            if self._preload_task is not None:
+                self._preload_task.cancel()
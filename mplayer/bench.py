@@ -0,0 +1,362 @@
+"""
+Benchmarks for the hot paths
+
+Synthetic media trees, playlists and schedules are generated into a temporary
+directory and the results are written as JSON so they can be compared between
+versions.
+"""
+
+import asyncio
+import json
+import logging
+import math
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from datetime import datetime, timedelta
+from importlib import metadata
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, Iterator, List, Tuple
+
+import yaml
+
+from . import api
+from .app import App
+from .core import make_core
+from .playlist import Entry, Playlist, PlaylistSpec
+from .schedule import Event, Schedule
+from .sim_player import SimPlayer
+
+_L = logging.getLogger(__name__)
+
+LAYOUTS = ("flat", "deep")
+BENCHMARKS = ("resolve", "load_ctx", "schedule", "transition", "memory", "api")
+# benchmarks that need a generated tree
+_ON_DISK = {"resolve", "load_ctx", "transition"}
+_FANOUT = 10
+_FILES_PER_DIR = 100
+
+
+def _tree_paths(root: Path, files: int, layout: str) -> Iterator[Path]:
+    for i in range(files):
+        d = root
+        if layout != "flat":
+            n = i // _FILES_PER_DIR
+            while True:
+                d = d / f"d{n % _FANOUT}"
+                n //= _FANOUT
+                if not n:
+                    break
+        yield d / f"{i}.png"
+
+
+def make_tree(root: Path, files: int, layout: str) -> List[Path]:
+    """
+    Create empty media files with distinct modification times
+
+    flat puts all files in a single directory, deep spreads them in
+    directories nested _FANOUT wide with _FILES_PER_DIR files per directory.
+    """
+    out: List[Path] = []
+    for i, p in enumerate(_tree_paths(root, files, layout)):
+        d = p.parent
+        if not out or out[-1].parent != d:
+            d.mkdir(parents=True, exist_ok=True)
+        p.touch()
+        os.utime(p, (i, i))
+        out.append(p)
+    return out
+
+
+def make_playlists(root: Path, count: int) -> List[Path]:
+    """
+    Create playlist files globbing the tree below root
+    """
+    out = []
+    for i in range(count):
+        obj = {
+            "name": f"p{i}",
+            "media": [
+                f"glob://*{i % 10}.png",
+                {"url": "glob://*.png", "filters": {"newest": 20}},
+            ],
+        }
+        p = root / f"p{i}.yaml"
+        p.write_text(yaml.safe_dump(obj))
+        out.append(p)
+    return out
+
+
+def make_schedule(count: int, playlists: int, now: datetime) -> Schedule:
+    """
+    Schedule with events every minute around now
+    """
+    start = now - timedelta(minutes=count // 2)
+    return Schedule(
+        Event(when=start + timedelta(minutes=i), playlist=f"p{i % playlists}")
+        for i in range(count)
+    )
+
+
+def _stats(samples: List[float]) -> Dict[str, float]:
+    ordered = sorted(samples)
+    return {
+        "min": ordered[0],
+        "median": statistics.median(ordered),
+        "mean": statistics.fmean(ordered),
+        "p99": ordered[math.ceil(len(ordered) * 0.99) - 1],
+        "max": ordered[-1],
+        "n": len(ordered),
+    }
+
+
+async def _time(fn: Callable[[], Awaitable[Any]], repeat: int) -> List[float]:
+    out = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        await fn()
+        out.append(time.perf_counter() - start)
+    return out
+
+
+async def bench_resolve(plists: List[Path], repeat: int) -> Dict[str, float]:
+    specs = [s for p in plists for s in PlaylistSpec.from_file(p)]
+
+    async def run():
+        for s in specs:
+            await s.resolve()
+
+    return _stats(await _time(run, repeat))
+
+
+async def bench_load_ctx(plists: List[Path], repeat: int) -> Dict[str, float]:
+    core = await make_core(plists, None)
+    try:
+        return _stats(await _time(core.rescan, repeat))
+    finally:
+        core.close()
+
+
+def bench_schedule(events: int, repeat: int) -> Dict[str, float]:
+    now = datetime.now()
+    sched = make_schedule(events, 10, now)
+    rng = random.Random(0)
+    nows = [now + timedelta(minutes=rng.uniform(-events, events)) for _ in range(1000)]
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for n in nows:
+            sched.current(now=n)
+            sched.next(now=n)
+        samples.append((time.perf_counter() - start) / len(nows))
+    return _stats(samples)
+
+
+def _measure(build: Callable[[], Any]) -> Tuple[Any, int, float]:
+    tracemalloc.start()
+    try:
+        start = time.perf_counter()
+        obj = build()
+        elapsed = time.perf_counter() - start
+        size, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return obj, size, elapsed
+
+
+def bench_memory(files: int, layout: str) -> Dict[str, Any]:
+    """
+    Memory of a resolved playlist compared to a list of Entry objects
+    """
+    paths = [str(p) for p in _tree_paths(Path("/media"), files, layout)]
+    _, listed, _ = _measure(lambda: [Entry(resource=Path(p)) for p in paths])
+    plist, compact, elapsed = _measure(lambda: Playlist.from_paths(paths))
+    start = time.perf_counter()
+    for _ in plist:
+        pass
+    iterated = time.perf_counter() - start
+    return {
+        "bytes_per_entry": {"list": listed / files, "playlist": compact / files},
+        "seconds": _stats([elapsed]),
+        "iterate_seconds": iterated,
+    }
+
+
+async def _connect_per_call(sock: Path):
+    r, w = await asyncio.open_unix_connection(sock)
+    try:
+        api.write_frame(w, {"id": 0, "op": "ping", "args": {}})
+        await w.drain()
+        await api.read_frame(r)
+    finally:
+        w.close()
+
+
+async def bench_api(requests: int, concurrency: int = 32) -> List[Dict[str, Any]]:
+    """
+    Throughput and latency of the control API
+
+    connect_per_call opens a connection per request like the earlier protocol,
+    sequential reuses a single connection and pipelined keeps concurrency
+    requests in flight on it.
+    """
+    with tempfile.TemporaryDirectory() as d:
+        sock = Path(d) / "api.sock"
+        srv = api.Server(sock)
+        await srv.run()
+        c = api.Client(sock)
+        modes: Dict[str, Tuple[Callable[[], Awaitable[Any]], int]] = {
+            "connect_per_call": (lambda: _connect_per_call(sock), 1),
+            "sequential": (c.ping, 1),
+            "pipelined": (c.ping, concurrency),
+        }
+        out = []
+        try:
+            for mode, (call, workers) in modes.items():
+                latencies: List[float] = []
+
+                async def worker(count: int):
+                    for _ in range(count):
+                        start = time.perf_counter()
+                        await call()
+                        latencies.append(time.perf_counter() - start)
+
+                start = time.perf_counter()
+                await asyncio.gather(
+                    *(worker(max(1, requests // workers)) for _ in range(workers))
+                )
+                elapsed = time.perf_counter() - start
+                out.append(
+                    {
+                        "mode": mode,
+                        "requests_per_second": len(latencies) / elapsed,
+                        "seconds": _stats(latencies),
+                    }
+                )
+        finally:
+            await c.close()
+            srv.close()
+    return out
+
+
+class _TimedPlayer(SimPlayer):
+    """
+    Records the wall time between consecutive plays
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.gaps: List[float] = []
+        self._ended: float | None = None
+
+    async def play(self, file: os.PathLike):
+        if self._ended is not None:
+            self.gaps.append(time.perf_counter() - self._ended)
+        try:
+            await super().play(file)
+        finally:
+            self._ended = time.perf_counter()
+
+
+async def bench_transition(plists: List[Path], items: int) -> Dict[str, float]:
+    core = await make_core(plists, None)
+    player = _TimedPlayer()
+    app = App(core, player)
+    await app.set_repeat(True)
+    task = asyncio.create_task(app.play())
+    try:
+        while len(player.gaps) < items:
+            await asyncio.sleep(0.01)
+    finally:
+        task.cancel()
+        core.close()
+    return _stats(player.gaps)
+
+
+def _version() -> str:
+    try:
+        return metadata.version("mplayer")
+    except metadata.PackageNotFoundError:
+        return "unknown"
+
+
+async def run(
+    *,
+    files: List[int],
+    layouts: List[str],
+    benchmarks: List[str],
+    playlists: int = 1,
+    events: int = 1000,
+    repeat: int = 3,
+    transitions: int = 1000,
+    requests: int = 1000,
+    directory: Path | None = None,
+) -> Dict[str, Any]:
+    """
+    Run the benchmarks for each tree size and layout
+    """
+    results = []
+    if "schedule" in benchmarks:
+        stats = bench_schedule(events, repeat)
+        results.append({"benchmark": "schedule", "events": events, "seconds": stats})
+    if "api" in benchmarks:
+        for res in await bench_api(requests):
+            _L.info("api %s: %.0f requests/s", res["mode"], res["requests_per_second"])
+            results.append({"benchmark": "api", "requests": requests, **res})
+    for n in files:
+        for layout in layouts:
+            if "memory" in benchmarks:
+                res = bench_memory(n, layout)
+                _L.info("memory %s/%s: %s", layout, n, res["bytes_per_entry"])
+                results.append(
+                    {"benchmark": "memory", "files": n, "layout": layout, **res}
+                )
+            if not set(benchmarks) & _ON_DISK:
+                continue
+            with tempfile.TemporaryDirectory(dir=directory) as d:
+                root = Path(d)
+                # keep the caches of the benchmark separate
+                os.environ["MPLAYER_CACHE_DIR"] = str(root / "cache")
+                _L.info("generating %s tree with %s files", layout, n)
+                make_tree(root / "media", n, layout)
+                plists = make_playlists(root / "media", playlists)
+                for b in benchmarks:
+                    if b == "resolve":
+                        stats = await bench_resolve(plists, repeat)
+                    elif b == "load_ctx":
+                        stats = await bench_load_ctx(plists, repeat)
+                    elif b == "transition":
+                        stats = await bench_transition(plists, transitions)
+                    else:
+                        continue
+                    _L.info("%s %s/%s: %s", b, layout, n, stats)
+                    results.append(
+                        {
+                            "benchmark": b,
+                            "files": n,
+                            "layout": layout,
+                            "playlists": playlists,
+                            "seconds": stats,
+                        }
+                    )
+    return {
+        "version": _version(),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "time": datetime.now().isoformat(timespec="seconds"),
+        "results": results,
+    }
+
+
+def write(results: Dict[str, Any], out: str | None):
+    data = json.dumps(results, indent=2)
+    if out is None or out == "-":
+        print(data)
+    else:
+        Path(out).write_text(data + "\n")
@@ -0,0 +1,62 @@
+"""
+On-disk cache helpers
+"""
+
+import logging
+import os
+import pickle
+import tempfile
+
+from pathlib import Path
+from typing import Any
+
+_L = logging.getLogger(__name__)
+
+
+def cache_dir() -> Path:
+    """
+    Directory for persistent caches
+
+    MPLAYER_CACHE_DIR overrides the default under XDG_CACHE_HOME.
+    """
+    d = os.environ.get("MPLAYER_CACHE_DIR")
+    if d:
+        return Path(d)
+    xdg = os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache"
+    return Path(xdg) / "mplayer"
+
+
+def write_atomic(path: Path, data: bytes):
+    """
+    Replace the file contents so readers never see a partial file
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+def load_pickle(path: Path, default: Any = None) -> Any:
+    """
+    Load a cache file, returning default if it is missing or unreadable
+    """
+    try:
+        with open(path, "rb") as f:
+            return pickle.load(f)
+    except FileNotFoundError:
+        return default
+    except Exception as e:
+        _L.warning("ignoring unreadable cache %s: %s", path, e)
+        return default
+
+
+def save_pickle(path: Path, obj: Any):
+    try:
+        write_atomic(path, pickle.dumps(obj, pickle.HIGHEST_PROTOCOL))
+    except OSError as e:
+        _L.warning("cannot write cache %s: %s", path, e)
@@ -0,0 +1,404 @@
+"""
+SQLite backed media catalog
+
+Resolved playlists are stored on disk instead of in memory so libraries
+larger than the RAM can be played. Playlists are read back through
+CatalogPlaylist views which fetch the entries on access.
+"""
+
+import asyncio
+import hashlib
+import itertools
+import logging
+import os
+import queue
+import sqlite3
+import threading
+
+from collections.abc import Sequence
+from pathlib import Path
+from typing import AsyncIterator, Dict, Iterable, Iterator, List, Tuple, overload
+
+from . import filters
+from .filters import Filter
+from .playlist import MediaEntry, MediaList
+from .statcache import StatCache
+
+_L = logging.getLogger(__name__)
+
+_END = object()
+_ABORT = object()
+
+# Rows fetched at a time when iterating a playlist
+_BATCH = 1000
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS dirs (
+    id INTEGER PRIMARY KEY, path BLOB UNIQUE NOT NULL);
+CREATE TABLE IF NOT EXISTS media (
+    id INTEGER PRIMARY KEY, dir INTEGER NOT NULL, name BLOB NOT NULL,
+    mtime_ns INTEGER, size INTEGER, UNIQUE (dir, name));
+CREATE INDEX IF NOT EXISTS media_mtime ON media (dir, mtime_ns);
+CREATE INDEX IF NOT EXISTS media_size ON media (dir, size);
+CREATE TABLE IF NOT EXISTS entries (
+    playlist TEXT, entry INTEGER, root BLOB, gen INTEGER, count INTEGER,
+    digest BLOB, PRIMARY KEY (playlist, entry));
+CREATE INDEX IF NOT EXISTS entries_root ON entries (root);
+CREATE TABLE IF NOT EXISTS members (
+    playlist TEXT, entry INTEGER, gen INTEGER, pos INTEGER, media INTEGER,
+    PRIMARY KEY (playlist, entry, gen, pos)) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS members_media ON members (media);
+"""
+
+_OPEN: Dict[str, "Catalog"] = {}
+
+
+class _Aborted(Exception):
+    pass
+
+
+def _split(path: os.PathLike) -> Tuple[bytes, bytes]:
+    d, n = os.path.split(os.fsencode(path))
+    return d, n
+
+
+def _path(d: bytes, n: bytes) -> Path:
+    return Path(os.fsdecode(d), os.fsdecode(n))
+
+
+def _open_playlist(path: str, name: str) -> "CatalogPlaylist":
+    cat = _OPEN.get(path)
+    if cat is None:
+        cat = Catalog(path)
+    return cat.playlist(name)
+
+
+class Catalog:
+    """
+    Media files and playlist membership stored in SQLite
+
+    Media rows are indexed by directory, mtime and size and playlist entries
+    by playlist and position. Each thread uses its own connection so reads
+    are not blocked by a running store.
+
+    Stores write a new generation of the entry and keep the previous one so
+    views taken before the store stay readable until they are replaced.
+    """
+
+    def __init__(self, path: os.PathLike | str):
+        self._path = os.fspath(Path(path).absolute())
+        Path(self._path).parent.mkdir(parents=True, exist_ok=True)
+        self._local = threading.local()
+        self._conns: List[sqlite3.Connection] = []
+        self._lock = threading.Lock()
+        # stores run one at a time instead of failing on a busy database
+        self._write = threading.Lock()
+        self._conn().executescript(_SCHEMA)
+        _OPEN[self._path] = self
+
+    @property
+    def path(self) -> str:
+        return self._path
+
+    def _conn(self) -> sqlite3.Connection:
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self._path, check_same_thread=False)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            db.execute(
+                "CREATE TEMP TABLE IF NOT EXISTS matched ("
+                "seq INTEGER PRIMARY KEY, media INTEGER)"
+            )
+            self._local.db = db
+            with self._lock:
+                self._conns.append(db)
+        return db
+
+    def close(self):
+        with self._lock:
+            for db in self._conns:
+                db.close()
+            self._conns = []
+        self._local = threading.local()
+        if _OPEN.get(self._path) is self:
+            del _OPEN[self._path]
+
+    def playlist(self, name: str) -> "CatalogPlaylist":
+        """
+        View of the current contents of a stored playlist
+        """
+        return CatalogPlaylist(self, name)
+
+    def store(
+        self,
+        playlist: str,
+        entry: int,
+        paths: Iterable[Path],
+        stats: StatCache,
+        chain: Sequence[Filter] = (),
+        root: Path | None = None,
+    ) -> bool:
+        """
+        Replace the media files of a playlist entry
+
+        A leading newest, oldest or largest filter runs as a query on the
+        catalog and the rest of the chain on its results.
+
+        :param paths: Unfiltered media files of the entry
+        :param chain: Filters of the entry
+        :param root: Directory the entry was resolved from
+        :return: False if the entry did not change
+        """
+        db = self._conn()
+        dirs: Dict[bytes, int] = {}
+
+        def media_id(p: Path, stat: bool = False) -> int:
+            d, n = _split(p)
+            di = dirs.get(d)
+            if di is None:
+                db.execute("INSERT OR IGNORE INTO dirs (path) VALUES (?)", (d,))
+                (di,) = db.execute(
+                    "SELECT id FROM dirs WHERE path = ?", (d,)
+                ).fetchone()
+                dirs[d] = di
+            mtime = size = None
+            if stat:
+                # only ordering by the metadata needs it
+                try:
+                    st = stats.stat(p)
+                    mtime, size = st.st_mtime_ns, st.st_size
+                except OSError:
+                    pass
+            (mi,) = db.execute(
+                "INSERT INTO media (dir, name, mtime_ns, size) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (dir, name) DO UPDATE "
+                "SET mtime_ns = coalesce(excluded.mtime_ns, mtime_ns), "
+                "size = coalesce(excluded.size, size) RETURNING id",
+                (di, n, mtime, size),
+            ).fetchone()
+            return mi
+
+        with self._write, db:
+            row = db.execute(
+                "SELECT gen, digest FROM entries WHERE playlist = ? AND entry = ?",
+                (playlist, entry),
+            ).fetchone()
+            prev_gen, prev_digest = row if row is not None else (-1, None)
+            gen = prev_gen + 1
+            top = chain[0] if chain else None
+            if isinstance(top, filters.TopK):
+                db.execute("DELETE FROM matched")
+                db.executemany(
+                    "INSERT INTO matched (media) VALUES (?)",
+                    ((media_id(p, stat=True),) for p in paths),
+                )
+                col, desc = top.order
+                rows = db.execute(
+                    "SELECT d.path, m.name FROM matched t "
+                    "JOIN media m ON m.id = t.media JOIN dirs d ON d.id = m.dir "
+                    f"ORDER BY m.{col} {'DESC' if desc else 'ASC'}, t.seq LIMIT ?",
+                    (top.count,),
+                ).fetchall()
+                paths = (_path(d, n) for d, n in rows)
+                chain = chain[1:]
+            digest = hashlib.blake2b()
+            count = 0
+
+            def members():
+                nonlocal count
+                for pos, p in enumerate(filters.chain(chain, paths, stats)):
+                    digest.update(os.fsencode(p) + b"\0")
+                    count += 1
+                    yield playlist, entry, gen, pos, media_id(p)
+
+            db.executemany("INSERT INTO members VALUES (?, ?, ?, ?, ?)", members())
+            if digest.digest() == prev_digest:
+                db.execute(
+                    "DELETE FROM members WHERE playlist = ? AND entry = ? AND gen = ?",
+                    (playlist, entry, gen),
+                )
+                return False
+            db.execute(
+                "DELETE FROM members WHERE playlist = ? AND entry = ? AND gen < ?",
+                (playlist, entry, prev_gen),
+            )
+            db.execute(
+                "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    playlist,
+                    entry,
+                    os.fsencode(root) if root is not None else None,
+                    gen,
+                    count,
+                    digest.digest(),
+                ),
+            )
+        return True
+
+    async def store_async(
+        self,
+        playlist: str,
+        entry: int,
+        paths: AsyncIterator[Path],
+        stats: StatCache,
+        chain: Sequence[Filter] = (),
+        root: Path | None = None,
+    ) -> bool:
+        """
+        Store the entry in a worker thread while paths are streamed to it
+
+        The entry is left as it was if this is cancelled.
+        """
+        q: queue.SimpleQueue = queue.SimpleQueue()
+
+        def items():
+            for p in iter(q.get, _END):
+                if p is _ABORT:
+                    raise _Aborted()
+                yield p
+
+        def run():
+            try:
+                return self.store(playlist, entry, items(), stats, chain, root)
+            except _Aborted:
+                return False
+
+        task = asyncio.ensure_future(asyncio.to_thread(run))
+        try:
+            async for p in paths:
+                q.put(p)
+        except BaseException:
+            q.put(_ABORT)
+            raise
+        finally:
+            q.put(_END)
+        return await task
+
+    def trim(self, playlist: str, entries: int):
+        """
+        Remove the entries from the given index onwards
+        """
+        db = self._conn()
+        with self._write, db:
+            db.execute(
+                "DELETE FROM members WHERE playlist = ? AND entry >= ?",
+                (playlist, entries),
+            )
+            db.execute(
+                "DELETE FROM entries WHERE playlist = ? AND entry >= ?",
+                (playlist, entries),
+            )
+
+
+class CatalogPlaylist(MediaList):
+    """
+    Read-only view of a playlist stored in a catalog
+
+    Only the sizes of the entries are kept in memory. The view keeps
+    pointing to the contents at the time it was created, see Catalog.
+    """
+
+    def __init__(self, catalog: Catalog, name: str):
+        self._cat = catalog
+        self._nm = name
+        rows = (
+            catalog._conn()
+            .execute(
+                "SELECT entry, gen, count, digest FROM entries "
+                "WHERE playlist = ? ORDER BY entry",
+                (name,),
+            )
+            .fetchall()
+        )
+        self._gens = [(e, g) for e, g, _, _ in rows]
+        self._digests = [d for _, _, _, d in rows]
+        # start position of each entry, the last item is the length
+        self._starts = list(itertools.accumulate((c for _, _, c, _ in rows), initial=0))
+
+    @property
+    def name(self):
+        return self._nm
+
+    def __len__(self) -> int:
+        return self._starts[-1]
+
+    def _locate(self, i: int) -> Tuple[int, int, int]:
+        k = next(k for k in range(len(self._gens)) if i < self._starts[k + 1])
+        e, g = self._gens[k]
+        return e, g, i - self._starts[k]
+
+    def _rows(
+        self, e: int, g: int, start: int, limit: int
+    ) -> List[Tuple[bytes, bytes]]:
+        return (
+            self._cat._conn()
+            .execute(
+                "SELECT d.path, m.name FROM members s "
+                "JOIN media m ON m.id = s.media JOIN dirs d ON d.id = m.dir "
+                "WHERE s.playlist = ? AND s.entry = ? AND s.gen = ? AND s.pos >= ? "
+                "ORDER BY s.pos LIMIT ?",
+                (self._nm, e, g, start, limit),
+            )
+            .fetchall()
+        )
+
+    @overload
+    def __getitem__(self, i: int) -> MediaEntry: ...
+
+    @overload
+    def __getitem__(self, i: slice) -> List[MediaEntry]: ...
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("playlist index out of range")
+        rows = self._rows(*self._locate(i), 1)
+        if not rows:
+            raise IndexError("playlist entry no longer in catalog")
+        return MediaEntry(_path(*rows[0]))
+
+    def resources(self) -> Iterator[Path]:
+        """
+        Iterate the media files in batches
+        """
+        for e, g in self._gens:
+            pos = 0
+            while rows := self._rows(e, g, pos, _BATCH):
+                for d, n in rows:
+                    yield _path(d, n)
+                pos += len(rows)
+
+    def positions(self, path: os.PathLike) -> List[int]:
+        d, n = _split(path)
+        rows = self._cat._conn().execute(
+            "SELECT s.entry, s.gen, s.pos FROM members s "
+            "JOIN media m ON m.id = s.media JOIN dirs d ON d.id = m.dir "
+            "WHERE d.path = ? AND m.name = ? AND s.playlist = ?",
+            (d, n, self._nm),
+        )
+        return sorted(
+            self._starts[self._gens.index((e, g))] + pos
+            for e, g, pos in rows
+            if (e, g) in self._gens
+        )
+
+    def __eq__(self, other):
+        if isinstance(other, CatalogPlaylist):
+            return self._nm == other._nm and self._digests == other._digests
+        if not isinstance(other, (Sequence, list)):
+            return NotImplemented
+        if len(self) != len(other):
+            return False
+        return all(a == b for a, b in zip(self, other))
+
+    __hash__ = None  # type: ignore
+
+    def __reduce__(self):
+        return _open_playlist, (self._cat.path, self._nm)
+
+    def __repr__(self) -> str:
+        return f"CatalogPlaylist({self._nm!r}, {len(self)} entries)"
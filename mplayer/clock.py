@@ -0,0 +1,166 @@
+"""
+Sleeping until wall clock times
+
+asyncio sleeps on the monotonic clock, which does not follow NTP steps, DST
+or manual changes of the wall clock and stops during suspend. Long sleeps
+towards a wall clock time are therefore done in bounded slices that re-check
+the wall clock, and steps of the clock end the sleep early so the caller can
+re-evaluate.
+"""
+
+import asyncio
+import ctypes
+import ctypes.util
+import errno
+import logging
+import os
+import time
+
+from datetime import datetime
+
+_L = logging.getLogger(__name__)
+
+CLOCK_REALTIME = 0
+TFD_TIMER_ABSTIME = 1
+TFD_TIMER_CANCEL_ON_SET = 2
+
+# Longest time slept without looking at the wall clock
+_SLICE = 1.0
+# Change of the wall clock relative to the monotonic clock treated as a step
+_STEP_TOLERANCE = 0.5
+# Absolute expiry of the step timer, far enough to never fire
+_NEVER = 2**40
+
+
+class _Timespec(ctypes.Structure):
+    _fields_ = [("tv_sec", ctypes.c_long), ("tv_nsec", ctypes.c_long)]
+
+
+class _Itimerspec(ctypes.Structure):
+    _fields_ = [("it_interval", _Timespec), ("it_value", _Timespec)]
+
+
+class StepTimer:
+    """
+    timerfd that becomes readable when the wall clock is stepped
+
+    Raises OSError if timerfd is not supported on the platform.
+    """
+
+    def __init__(self):
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+            self._settime = libc.timerfd_settime
+            create = libc.timerfd_create
+        except (OSError, AttributeError) as e:
+            raise OSError("timerfd not supported") from e
+        self._settime.argtypes = [
+            ctypes.c_int,
+            ctypes.c_int,
+            ctypes.POINTER(_Itimerspec),
+            ctypes.c_void_p,
+        ]
+        self._fd = create(CLOCK_REALTIME, os.O_NONBLOCK | os.O_CLOEXEC)
+        if self._fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+        self.arm()
+
+    def fileno(self) -> int:
+        return self._fd
+
+    def arm(self):
+        spec = _Itimerspec(it_value=_Timespec(_NEVER, 0))
+        flags = TFD_TIMER_ABSTIME | TFD_TIMER_CANCEL_ON_SET
+        if self._settime(self._fd, flags, ctypes.byref(spec), None) < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+
+    def stepped(self) -> bool:
+        """
+        Check and reset the step notification without blocking
+        """
+        try:
+            os.read(self._fd, 8)
+        except BlockingIOError:
+            return False
+        except OSError as e:
+            if e.errno != errno.ECANCELED:
+                raise
+            self.arm()
+            return True
+        return False
+
+    def close(self):
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+
+def _offset() -> float:
+    return time.time() - time.monotonic()
+
+
+class WallClock:
+    """
+    Sleep until wall clock times with a bounded error
+
+    Clock steps are noticed right away with timerfd where available and
+    otherwise by comparing the wall clock to the monotonic clock after each
+    slice, which also catches suspend.
+    """
+
+    def __init__(self, max_slice: float = _SLICE):
+        self._slice = max_slice
+        self._stepped = asyncio.Event()
+        self._loop = asyncio.get_running_loop()
+        self._timer: StepTimer | None = None
+        try:
+            self._timer = StepTimer()
+            self._loop.add_reader(self._timer.fileno(), self._on_timer)
+        except OSError as e:
+            _L.debug("clock steps detected by polling: %s", e)
+
+    @staticmethod
+    def now() -> datetime:
+        return datetime.now()
+
+    def close(self):
+        if self._timer is not None:
+            self._loop.remove_reader(self._timer.fileno())
+            self._timer.close()
+            self._timer = None
+
+    def _on_timer(self):
+        assert self._timer is not None
+        if self._timer.stepped():
+            self._stepped.set()
+
+    async def _wait(self, delay: float) -> bool:
+        try:
+            await asyncio.wait_for(self._stepped.wait(), delay)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+    async def sleep_until(self, when: datetime) -> bool:
+        """
+        Sleep until the given time
+
+        Naive times are local times. The comparison is done on timestamps so
+        DST changes do not matter.
+
+        :return: False if the sleep ended early because the clock was stepped
+        """
+        target = when.timestamp()
+        self._stepped.clear()
+        offset = _offset()
+        while (remaining := target - time.time()) > 0:
+            stepped = await self._wait(min(remaining, self._slice))
+            new = _offset()
+            if stepped or abs(new - offset) > _STEP_TOLERANCE:
+                _L.info("wall clock stepped by %.3f s", new - offset)
+                return False
+            # follow gradual adjustments
+            offset = new
+        return True
@@ -3,32 +3,120 @@ Program core
 """
 
 import asyncio
+import itertools
 import logging
+import time
 
 from pathlib import Path
-from typing import AsyncGenerator, Iterable
-from .ctx import Ctx
-from .playlist import PlaylistSpec, Playlist, Entry as PlaylistEntry
-from .schedule import Schedule
+from typing import AsyncGenerator, Callable, Iterable, List, Tuple
+from .cache import cache_dir
+from . import metrics, snapshot
+from .catalog import Catalog
+from .ctx import Ctx, Cursor
+from .events import EventBus
+from .index import Index
+from .inotify import Watcher
+from .playlist import (
+    Excluding,
+    MediaList,
+    Playlist,
+    PlaylistSpec,
+    SpecCache,
+    Entry as PlaylistEntry,
+)
+from .probe import Metadata, MetadataCache, Prober
+from .rescan import RescanScheduler, Settler
+from .schedule import Event, Schedule
+from .statcache import ListingCache, StatCache
 
 _L = logging.getLogger(__name__)
 
 
-async def _to_playlists(files: Iterable[Path]) -> AsyncGenerator[Playlist, None]:
-    nameless = Playlist()
+def _to_playlists(
+    files: Iterable[Path],
+    index: Index,
+    specs: SpecCache,
+    stats: StatCache,
+    concurrency: int = 4,
+    timeout: float | None = None,
+    previous: Callable[[str], MediaList | None] = lambda _: None,
+    late: Callable[[asyncio.Task], None] | None = None,
+) -> List[Tuple[str, asyncio.Future]]:
+    """
+    Start resolving the input files to playlists
+
+    Playlist specs are resolved concurrently, at most concurrency at a time.
+    A spec that fails or takes longer than timeout seconds is replaced by
+    previous(name) or an empty playlist. A spec that timed out keeps resolving
+    in the background if late is given, which receives the task. Consecutive non-playlist files are
+    grouped into playlists named "", "#2", "#3" and so on.
+
+    Returns the playlist names and results in the order of the inputs.
+    """
+    sem = asyncio.Semaphore(concurrency)
+
+    async def resolve(spec: PlaylistSpec) -> MediaList:
+        async with sem:
+            task = asyncio.ensure_future(index.add(spec, stats))
+            try:
+                return await asyncio.wait_for(asyncio.shield(task), timeout)
+            except asyncio.TimeoutError:
+                _L.warning('resolving playlist "%s" timed out', spec.name)
+                if late is not None:
+                    late(task)
+                else:
+                    task.cancel()
+            except asyncio.CancelledError:
+                task.cancel()
+                raise
+            except ValueError as e:
+                _L.warning('resolving playlist "%s" failed: %s', spec.name, e)
+        return previous(spec.name) or Playlist(name=spec.name)
+
+    def done(p: MediaList) -> asyncio.Future:
+        fut = asyncio.get_running_loop().create_future()
+        fut.set_result(p)
+        return fut
+
+    out = []
+    groups = 0
+
+    def group() -> Playlist:
+        # the playlists are looked up by name so later groups get their own
+        return Playlist(name=f"#{groups + 1}" if groups else "")
+
+    nameless = group()
     for f in files:
         try:
-            specs = PlaylistSpec.from_file(f)
-            if nameless:
-                yield nameless
-                nameless = Playlist()
-            for spec in specs:
-                res = await spec.resolve()
-                yield res
+            loaded = specs.load(f)
         except ValueError:
             nameless.append(PlaylistEntry(resource=f))
+            continue
+        if nameless:
+            out.append((nameless.name, done(nameless)))
+            groups += 1
+            nameless = group()
+        out += [(s.name, asyncio.ensure_future(resolve(s))) for s in loaded]
     if nameless:
-        yield nameless
+        out.append((nameless.name, done(nameless)))
+    return out
+
+
+def _reuse(old: Ctx, playlists: List[MediaList]) -> List[MediaList]:
+    """
+    Keep the playlists of the current context that did not change
+    """
+    out = []
+    changed = 0
+    for p in playlists:
+        prev = old.playlist(p.name)
+        if prev is not None and prev == p:
+            out.append(prev)
+        else:
+            out.append(p)
+            changed += 1
+    _L.debug("rescan changed %s of %s playlists", changed, len(playlists))
+    return out
 
 
 class _TagType:
@@ -43,63 +131,457 @@ class Core:
     Main logic for the software
 
     This component receives events from and passes them to other components.
+
+    on_upcoming is called with the event and the first media of the incoming
+    playlist shortly before a scheduled switch and on_switch when the switch
+    takes effect.
     """
 
-    def __init__(self, _: _TagType, files: Iterable[Path], schedule: Path | None):
-        self._files = files
+    def __init__(
+        self,
+        _: _TagType,
+        files: Iterable[Path],
+        schedule: Path | None,
+        watcher: Watcher | None = None,
+        snapshot: Path | None = None,
+        rescan_debounce: float = 1.0,
+        rescan_max_latency: float = 10.0,
+        catalog: Catalog | None = None,
+        resolve_concurrency: int = 4,
+        resolve_timeout: float | None = None,
+    ):
+        self._files = [Path(f).absolute() for f in files]
         self._sched = schedule
         self._ctx = Ctx([], None)
         # wait for media when playlists are empty
         self._new_plist = asyncio.Event()
-        self._rescan_task: asyncio.Task | None = None
+        # playing from a partially loaded context
+        self._loading = False
+        self._resolve_concurrency = resolve_concurrency
+        self._resolve_timeout = resolve_timeout
+        self._rescans = RescanScheduler(
+            self.rescan, rescan_debounce, rescan_max_latency
+        )
+        # files still being written are left out of the playlists
+        self._settler = Settler()
+        self._settle_task: asyncio.Task | None = None
+        self._watcher = watcher
+        self._catalog = catalog
+        self._index = Index(watcher, self._new_stats, catalog)
+        self._specs = SpecCache(cache_dir() / "specs.pickle")
+        self._watch_task: asyncio.Task | None = None
+        self._load_task: asyncio.Task | None = None
+        # playlists still resolving after the timeout and their updates
+        self._late: List[asyncio.Task] = []
+        self._snapshot = snapshot
+        self._metadata = MetadataCache(cache_dir() / "metadata.sqlite")
+        # unchanged directories are not listed again on rescans
+        self._listings = ListingCache()
+        self._prober: Prober | None = None
+        # bumped on schedule switches so media streams restart
+        self._gen = 0
+        self.on_upcoming: Callable[[Event, Path | None], None] | None = None
+        self.on_switch: Callable[[Event], None] | None = None
+        # monitoring events are published here if set
+        self.events: EventBus | None = None
+
+    async def rescan(self):
+        if self._load_task is not None:
+            await asyncio.wait([self._load_task])
+        self._publish("rescan_started")
+        start = time.perf_counter()
+        try:
+            await self._load_ctx(settle=True)
+        except Exception as e:
+            self._publish("error", message=f"rescan failed: {e}")
+            raise
+        seconds = time.perf_counter() - start
+        metrics.RESCAN_SECONDS.observe(seconds)
+        self._publish(
+            "rescan_finished",
+            seconds=seconds,
+            playlists=len(self._ctx.playlists()),
+        )
+
+    async def rescan_now(self):
+        """
+        Rescan without waiting for more requests and wait until it is done
+        """
+        self.request_rescan(immediate=True)
+        await self._rescans.join()
+
+    @property
+    def files(self) -> List[Path]:
+        return list(self._files)
+
+    @property
+    def schedule(self) -> Path | None:
+        return self._sched
+
+    @property
+    def ctx(self) -> Ctx:
+        return self._ctx
+
+    async def set_files(self, files: Iterable[Path]):
+        """
+        Replace the input files, they are loaded on the next rescan
+        """
+        self._files = [Path(f).absolute() for f in files]
+        if self._watcher is not None:
+            for d in {f.parent for f in self._files}:
+                await self._watcher.watch(d, recursive=False)
+
+    def set_schedule(self, schedule: Path | None):
+        """
+        Replace the schedule file, it is loaded on the next rescan
+        """
+        self._sched = Path(schedule).absolute() if schedule is not None else None
+
+    def _publish(self, kind: str, **data):
+        if self.events is not None:
+            self.events.publish(kind, **data)
+
+    async def _load_initial(self):
+        """
+        Load the inputs, returns once playback can start
+
+        The rest of the playlists are loaded in the background.
+        """
+        self._load_task = asyncio.create_task(self._load_ctx())
+        started = asyncio.create_task(self._new_plist.wait())
+        try:
+            await asyncio.wait(
+                [self._load_task, started], return_when=asyncio.FIRST_COMPLETED
+            )
+        finally:
+            started.cancel()
+        if self._load_task.done():
+            self._load_task.result()
+
+    def start_probing(self, workers: int):
+        """
+        Probe media metadata in the background with the given number of workers
+        """
+        self._prober = Prober(self._metadata, workers)
+        self._probe_all()
+
+    def metadata(self, path: Path) -> Metadata | None:
+        """
+        Probed metadata of a media file, None if not probed yet
+        """
+        try:
+            return self._metadata.get(path, path.stat())
+        except FileNotFoundError:
+            return None
+
+    def _new_stats(self) -> StatCache:
+        return StatCache(metadata=self._metadata, listings=self._listings)
+
+    def _make_ctx(self, playlists: Iterable[MediaList], sched: Schedule | None) -> Ctx:
+        return Ctx(
+            playlists,
+            sched,
+            on_upcoming=self._upcoming,
+            on_switch=self._switched,
+        )
 
-    def rescan(self):
-        return self._load_ctx()
+    def _swap(self, ctx: Ctx):
+        """
+        Replace the context in one step
+
+        Media streams continue from their cursor in the new context.
+        """
+        self._ctx.close()
+        self._ctx = ctx
+        ctx.start()
+        self._new_plist.set()
+
+    def _upcoming(self, ev: Event):
+        plist = self._ctx.playlist(ev.playlist)
+        first = plist[0].resource if plist else None
+        if self.on_upcoming is not None:
+            self.on_upcoming(ev, first)
+
+    def _switched(self, ev: Event):
+        self._gen += 1
+        self._new_plist.set()
+        self._publish("switch", playlist=ev.playlist, scheduled=ev.when.isoformat())
+        if self.on_switch is not None:
+            self.on_switch(ev)
+
+    def _probe_all(self):
+        if self._prober is not None:
+            self._prober.submit(r for p in self._ctx.playlists() for r in p.resources())
+
+    def request_rescan(self, immediate: bool = False):
+        """
+        Rescan the inputs soon
+
+        Requests arriving close to each other are merged into one rescan.
 
-    def request_rescan(self):
+        :param immediate: Do not wait for more requests
+        """
         _L.debug("input file rescan requested")
-        if self._rescan_task is None or self._rescan_task.done():
-            self._rescan_task = asyncio.create_task(self.rescan())
-            _L.debug("scheduled rescan task")
+        self._rescans.request(immediate)
+
+    def _settled_only(self, plist: MediaList) -> MediaList:
+        pending = self._settler.pending
+        if not pending:
+            return plist
+        return Excluding.without(plist, pending)
 
-    def medias(self, *, wait: bool) -> AsyncGenerator[Path, None]:
+    def medias(self, *, wait: bool, follow: bool = False) -> AsyncGenerator[Path, None]:
         """
         Return stream of media files
 
         The stream is autmatically updated when e.g. schedule changes or media files
-        are updated.
+        are updated. Rescans continue from the current position and a schedule
+        switch restarts the stream from the beginning of the new playlist.
 
         :param wait: Whether to wait for media files if none exist
+        :param follow: Wait for more media at the end of the playlists
         """
 
         async def generator() -> AsyncGenerator[Path, None]:
+            cur: Cursor | None = None
+            gen = self._gen
             while True:
-                plists = [p for p in self._ctx.active_playlists() if p]
-                if not plists:
+                if self._gen != gen:
+                    cur, gen = None, self._gen
+                if not any(self._ctx.active_playlists()):
                     if not wait:
                         return
                     self._new_plist.clear()
                     await self._new_plist.wait()
                     continue
-                for plist in plists:
-                    for e in plist:
-                        yield e.resource
-                        await asyncio.sleep(0)
-                return
+                nxt = self._ctx.advance(cur)
+                if nxt is None:
+                    if wait and (self._loading or follow):
+                        # more playlists are on the way
+                        self._new_plist.clear()
+                        await self._new_plist.wait()
+                        continue
+                    return
+                cur = nxt
+                yield cur.resource
+                await asyncio.sleep(0)
 
         return generator()
 
-    async def _load_ctx(self):
+    async def _load_ctx(self, settle: bool = False):
+        """
+        Resolve the inputs and swap in the new context
+
+        :param settle: Hold back files that are still being written. The first
+                       load plays whatever is there to not delay the start.
+        """
         _L.debug("(re)loading input file context")
-        self._new_plist.set()
         sched = Schedule.from_file(self._sched) if self._sched is not None else None
-        playlists = []
-        async for p in _to_playlists(self._files):
-            playlists.append(p)
-        self._ctx = Ctx(playlists, sched)
+        self._cancel_late()
+        self._index.clear()
+        stats = self._new_stats()
+        resolving = _to_playlists(
+            self._files,
+            self._index,
+            self._specs,
+            stats,
+            self._resolve_concurrency,
+            self._resolve_timeout,
+            self._ctx.playlist,
+            self._late.append,
+        )
+        try:
+            if not any(self._ctx.playlists()):
+                await self._start_early(resolving, sched)
+            playlists = [await f for _, f in resolving]
+            self._index.unwatch_stale()
+        finally:
+            self._loading = False
+            for _, f in resolving:
+                f.cancel()
+        if settle:
+            # without the watcher this is the only place new files are seen
+            self._settler.check(stats.relisted, stats)
+            self._start_settling()
+        playlists = [self._settled_only(p) for p in playlists]
+        self._specs.save()
+        playlists = await asyncio.to_thread(_reuse, self._ctx, playlists)
+        self._swap(self._make_ctx(playlists, sched))
+        for t in list(self._late):
+            self._late.append(asyncio.create_task(self._add_late(t)))
+        self._probe_all()
+        if self._snapshot is not None:
+            await asyncio.to_thread(
+                snapshot.save, self._snapshot, self._files, playlists, sched
+            )
 
+    async def _add_late(self, task: asyncio.Task):
+        """
+        Add a playlist that timed out to the context once it is resolved
+        """
+        try:
+            p = await task
+        except ValueError as e:
+            _L.warning("resolving a playlist failed: %s", e)
+            return
+        _L.debug('playlist "%s" resolved after the timeout', p.name)
+        self._ctx.update(self._settled_only(p))
+        self._new_plist.set()
+        self._probe_all()
 
-async def make_core(files: Iterable[Path], schedule: Path | None):
-    c = Core(_Tag, files, schedule)
-    await c._load_ctx()
+    def _cancel_late(self):
+        for t in self._late:
+            t.cancel()
+        self._late = []
+
+    async def _start_early(
+        self, resolving: List[Tuple[str, asyncio.Future]], sched: Schedule | None
+    ):
+        """
+        Start playing once the needed playlist is resolved
+
+        That is the active playlist of the schedule or else the first one. The
+        rest of the playlists are added when all of them are ready.
+        """
+        cur = sched.current() if sched is not None else None
+        needed = next(
+            (f for n, f in resolving if cur is None or n == cur.playlist), None
+        )
+        if needed is None:
+            return
+        await asyncio.wait([needed])
+        if cur is not None:
+            ready = [f.result() for _, f in resolving if f.done()]
+        else:
+            futs = (f for _, f in resolving)
+            ready = [f.result() for f in itertools.takewhile(lambda f: f.done(), futs)]
+        _L.debug("starting with %s of %s playlists", len(ready), len(resolving))
+        self._loading = True
+        self._swap(self._make_ctx(map(self._settled_only, ready), sched))
+
+    def _load_snapshot(self) -> bool:
+        if self._snapshot is None:
+            return False
+        res = snapshot.load(self._snapshot, self._files)
+        if res is None:
+            return False
+        self._swap(self._make_ctx(*res))
+        return True
+
+    def close(self):
+        """
+        Stop following changes and store the current state for the next start
+        """
+        if self._watch_task is not None:
+            self._watch_task.cancel()
+        if self._load_task is not None:
+            self._load_task.cancel()
+        if self._settle_task is not None:
+            self._settle_task.cancel()
+        self._cancel_late()
+        self._rescans.close()
+        self._ctx.close()
+        if self._prober is not None:
+            self._prober.close()
+        if self._snapshot is not None:
+            snapshot.save(
+                self._snapshot,
+                self._files,
+                self._ctx.playlists(),
+                self._ctx.schedule,
+            )
+        self._metadata.close()
+        if self._catalog is not None:
+            self._catalog.close()
+
+    async def _watch(self):
+        """
+        Keep the context up to date based on file system events
+
+        Changes to the input files trigger a full rescan. Changes in the media
+        directories only update the affected playlists. Files that are still
+        being written are added once their size settles.
+        """
+        assert self._watcher is not None
+        for d in {f.parent for f in self._files}:
+            await self._watcher.watch(d, recursive=False)
+        self._start_settling()
+        async for changed in self._watcher.changes():
+            if not set(self._files).isdisjoint(changed):
+                self.request_rescan()
+                continue
+            self._settler.check(changed)
+            await self._update(changed)
+
+    def _start_settling(self):
+        if self._settle_task is None:
+            self._settle_task = asyncio.create_task(self._watch_settled())
+
+    async def _watch_settled(self):
+        async for settled in self._settler.settled():
+            _L.debug("%s files settled", len(settled))
+            await self._update(settled)
+
+    async def _update(self, changed: Iterable[Path]):
+        for p in await self._index.update(changed):
+            self._ctx.update(self._settled_only(p))
+            self._new_plist.set()
+        self._probe_all()
+
+
+async def make_core(
+    files: Iterable[Path],
+    schedule: Path | None,
+    watch=False,
+    warm_start=False,
+    probe_workers=0,
+    rescan_debounce=1.0,
+    rescan_max_latency=10.0,
+    catalog: Path | None = None,
+    resolve_concurrency=4,
+    resolve_timeout: float | None = None,
+):
+    """
+    Create core and load the inputs
+
+    :param watch: Follow file system changes
+    :param warm_start: Start from the snapshot of the previous run if there is
+                       one and rescan in the background
+    :param probe_workers: Number of processes probing media metadata, 0 disables
+    :param rescan_debounce: Seconds without new requests before a rescan starts
+    :param rescan_max_latency: Seconds a rescan may be delayed by new requests
+    :param catalog: SQLite file to keep the resolved playlists in instead of
+                    memory
+    :param resolve_concurrency: Number of playlists resolved at the same time
+    :param resolve_timeout: Seconds a playlist may take to resolve before it
+                            is added later, None for no limit
+    """
+    files = [Path(f).absolute() for f in files]
+    snap = snapshot.default_path(files, schedule) if warm_start else None
+    watcher = None
+    if watch:
+        try:
+            watcher = Watcher()
+        except OSError as e:
+            _L.warning("file system watching not available: %s", e)
+    c = Core(
+        _Tag,
+        files,
+        schedule,
+        watcher,
+        snap,
+        rescan_debounce,
+        rescan_max_latency,
+        Catalog(catalog) if catalog is not None else None,
+        resolve_concurrency,
+        resolve_timeout,
+    )
+    if c._load_snapshot():
+        c.request_rescan(immediate=True)
+    else:
+        await c._load_initial()
+    if probe_workers > 0:
+        c.start_probing(probe_workers)
+    if watcher is not None:
+        c._watch_task = asyncio.create_task(c._watch())
     return c
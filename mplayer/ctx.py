@@ -5,73 +5,178 @@ Context
 import asyncio
 import logging
 
-from datetime import datetime
+from dataclasses import dataclass
+from datetime import datetime, timedelta
 from pathlib import Path
-from collections.abc import AsyncGenerator, Collection, Iterable
+from collections.abc import AsyncGenerator, Callable, Collection, Iterable
 
-from .playlist import Playlist
-from .schedule import Schedule
+from .clock import WallClock
+from .playlist import MediaList
+from .schedule import Event, Schedule
 
 _L = logging.getLogger(__name__)
 
+# How long before a scheduled switch the upcoming playlist is announced
+_LEAD = timedelta(seconds=5)
+
+
+@dataclass(frozen=True)
+class Cursor:
+    """
+    Position in the playlists, survives replacing the playlists
+    """
+
+    playlist: str
+    resource: Path
+    pos: int
+
 
 class Ctx:
     """
     Holds playlists and schedule and emits medias based on those
 
-    This does not know anything about rescanning
+    This does not know anything about rescanning. Following the schedule
+    begins with start().
+
+    :param on_upcoming: Called shortly before a scheduled switch
+    :param on_switch: Called when a scheduled switch takes effect
     """
 
-    def __init__(self, playlists: Iterable[Playlist], schedule: Schedule | None = None):
+    def __init__(
+        self,
+        playlists: Iterable[MediaList],
+        schedule: Schedule | None = None,
+        *,
+        on_upcoming: Callable[[Event], None] | None = None,
+        on_switch: Callable[[Event], None] | None = None,
+    ):
         self._sched = schedule
+        self._on_upcoming = on_upcoming
+        self._on_switch = on_switch
+        self._update_task: asyncio.Task | None = None
         self._plists = {p.name: p for p in playlists}
         self._active_plist = None
         if self._sched is not None:
             curr = self._sched.current()
             if curr is not None:
                 self._active_plist = curr.playlist
-        if self._sched is not None:
+
+    def start(self):
+        """
+        Start following the schedule
+        """
+        if self._sched is not None and self._update_task is None:
             self._update_task = asyncio.create_task(self._update_active_playlist())
 
+    def close(self):
+        """
+        Stop following the schedule
+        """
+        if self._update_task is not None:
+            self._update_task.cancel()
+
     def valid(self) -> bool:
         """
         Check if the context is valid, i.e. schedule points to valid playlists
         """
         if self._sched is None:
             return True
-        for e in self._sched:
-            if e.playlist not in self._plists:
-                return False
-        return True
+        return self._sched.playlists() <= self._plists.keys()
 
-    def active_playlists(self) -> Collection[Playlist]:
+    @property
+    def schedule(self) -> Schedule | None:
+        return self._sched
+
+    def playlists(self) -> Collection[MediaList]:
+        """
+        Return all the playlists
+        """
+        return self._plists.values()
+
+    def playlist(self, name: str) -> MediaList | None:
+        """
+        Get a playlist by name
+        """
+        return self._plists.get(name)
+
+    def update(self, playlist: MediaList):
+        """
+        Replace the playlist with the same name
+        """
+        self._plists[playlist.name] = playlist
+
+    def active_playlists(self) -> Collection[MediaList]:
         """
         Return the currently active playlists
 
-        If a schedule is active this returns a collection with size 1.
+        If a schedule is active this returns a collection with size 1, or 0
+        while the active playlist is not loaded yet.
         If no schedule is active this returns all the playlists in the current object.
         """
         if self._active_plist is not None:
-            return [self._plists[self._active_plist]]
+            p = self._plists.get(self._active_plist)
+            return [p] if p is not None else []
         return self._plists.values()
 
+    def _position(self, plist: MediaList, cur: Cursor) -> int | None:
+        if cur.pos < len(plist) and plist[cur.pos].resource == cur.resource:
+            return cur.pos
+        try:
+            return plist.index(cur.resource)
+        except ValueError:
+            return None
+
+    def advance(self, cur: Cursor | None) -> Cursor | None:
+        """
+        Get the entry after the cursor in the active playlists
+
+        The cursor is found by playlist name and resource so it stays valid
+        when the playlists are replaced. If the resource was removed playback
+        continues from the same position. Returns None at the end of the
+        playlists.
+        """
+        plists = [p for p in self.active_playlists() if p]
+        i, nxt = 0, 0
+        if cur is not None:
+            i = next((i for i, p in enumerate(plists) if p.name == cur.playlist), 0)
+            if i < len(plists) and plists[i].name == cur.playlist:
+                pos = self._position(plists[i], cur)
+                nxt = cur.pos if pos is None else pos + 1
+        while i < len(plists):
+            if nxt < len(plists[i]):
+                p = plists[i]
+                return Cursor(p.name, p[nxt].resource, nxt)
+            i, nxt = i + 1, 0
+        return None
+
+    def _switch(self, ev: Event):
+        self._active_plist = ev.playlist
+        _L.info('switched active playlist to "%s"', self._active_plist)
+        if self._on_switch is not None:
+            self._on_switch(ev)
+
     async def _update_active_playlist(self):
         assert self._sched is not None
         _L.debug("scheduling enabled")
-        while True:
-            try:
-                self._active_plist = await self._next_event(self._sched)
-                _L.info('switched active playlist to "%s"', self._active_plist)
-            except asyncio.CancelledError:
-                _L.info("no more events in schedule")
-                break
-
-    @staticmethod
-    async def _next_event(sched: Schedule) -> str:
-        next_event = sched.next()
-        if next_event is None:
-            raise asyncio.CancelledError()
-        diff = next_event.when - datetime.now()
-        _L.debug("next event in schedule in %ss", diff.total_seconds())
-        await asyncio.sleep((next_event.when - datetime.now()).total_seconds())
-        return next_event.playlist
+        clock = WallClock()
+        try:
+            while True:
+                now = clock.now()
+                # The clock may have been stepped past or before events
+                cur = self._sched.current(now)
+                if cur is not None and cur.playlist != self._active_plist:
+                    self._switch(cur)
+                ev = self._sched.next(now)
+                if ev is None:
+                    break
+                _L.debug("next event in schedule at %s", ev.when)
+                if not await clock.sleep_until(ev.when - _LEAD):
+                    continue
+                if self._on_upcoming is not None:
+                    self._on_upcoming(ev)
+                if not await clock.sleep_until(ev.when):
+                    continue
+                self._switch(ev)
+        finally:
+            clock.close()
+        _L.info("no more events in schedule")
@@ -0,0 +1,108 @@
+"""
+Remote control of a running player
+"""
+
+from pathlib import Path
+from typing import Any, Dict, List
+
+from . import metrics
+from .api import Server
+from .app import App
+from .core import Core
+
+
+class Control:
+    """
+    Control operations served by the daemon
+
+    Each operation is one request so e.g. many files are enqueued with a
+    single rescan.
+    """
+
+    def __init__(self, app: App, core: Core):
+        self._app = app
+        self._core = core
+
+    def register(self, srv: Server):
+        srv.route("play", self.play)
+        srv.route("enqueue", self.enqueue)
+        srv.route("skip", self.skip)
+        srv.route("pause", self.pause)
+        srv.route("resume", self.resume)
+        srv.route("schedule", self.schedule)
+        srv.route("rescan", self.rescan)
+        srv.route("status", self.status)
+        srv.route("stats", self.stats)
+
+    async def play(self, files: List[str]):
+        """
+        Replace the played files and start from the first one
+        """
+        await self._core.set_files(_paths(files))
+        await self._core.rescan_now()
+        self._app.restart()
+        return await self.status()
+
+    async def enqueue(self, files: List[str]):
+        """
+        Add files after the current ones
+        """
+        await self._core.set_files(self._core.files + _paths(files))
+        await self._core.rescan_now()
+        return await self.status()
+
+    async def skip(self):
+        self._app.skip()
+
+    async def pause(self):
+        """
+        Pause the playback, see "pausable" of the status for players that
+        cannot pause
+        """
+        if self._app.can_pause:
+            await self._app.set_paused(True)
+        return await self.status()
+
+    async def resume(self):
+        if self._app.can_pause:
+            await self._app.set_paused(False)
+        return await self.status()
+
+    async def schedule(self, path: str | None = None):
+        """
+        Replace the schedule, None plays the files without one
+        """
+        self._core.set_schedule(_paths([path])[0] if path is not None else None)
+        await self._core.rescan_now()
+        return await self.status()
+
+    async def rescan(self):
+        await self._core.rescan_now()
+        return await self.status()
+
+    async def status(self) -> Dict[str, Any]:
+        ctx = self._core.ctx
+        current = self._app.current
+        sched = self._core.schedule
+        return {
+            "current": str(current) if current is not None else None,
+            "paused": self._app.paused,
+            "pausable": self._app.can_pause,
+            "files": [str(f) for f in self._core.files],
+            "schedule": str(sched) if sched is not None else None,
+            "playlists": [{"name": p.name, "length": len(p)} for p in ctx.playlists()],
+            "active": [p.name for p in ctx.active_playlists()],
+        }
+
+    async def stats(self) -> Dict[str, Any]:
+        return metrics.REGISTRY.snapshot()
+
+
+def _paths(files: List[str]) -> List[Path]:
+    out = []
+    for f in files:
+        p = Path(f)
+        if not p.is_absolute():
+            raise ValueError(f"Not an absolute path: {f}")
+        out.append(p)
+    return out
@@ -0,0 +1,102 @@
+"""
+Events for monitoring
+"""
+
+import asyncio
+import collections
+import logging
+import threading
+
+from datetime import datetime
+from typing import Any, Deque, Dict, Set
+
+_L = logging.getLogger(__name__)
+
+# Events buffered per subscriber before the oldest are dropped
+MAX_QUEUE = 256
+
+
+class Subscription:
+    """
+    Events published after subscribing, iterated asynchronously
+
+    When more than maxsize events are waiting the oldest are dropped and a
+    "dropped" event with their count is delivered before the next event.
+    """
+
+    def __init__(self, bus: "EventBus", maxsize: int):
+        self._bus = bus
+        self._q: Deque[Dict[str, Any]] = collections.deque(maxlen=maxsize)
+        self._wake = asyncio.Event()
+        self.dropped = 0
+        self._unreported = 0
+
+    def _put(self, ev: Dict[str, Any]):
+        if len(self._q) == self._q.maxlen:
+            self.dropped += 1
+            self._unreported += 1
+        self._q.append(ev)
+        self._wake.set()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> Dict[str, Any]:
+        while not self._q:
+            self._wake.clear()
+            await self._wake.wait()
+        if self._unreported:
+            n, self._unreported = self._unreported, 0
+            return {"event": "dropped", "count": n}
+        return self._q.popleft()
+
+    def close(self):
+        self._bus._subs.discard(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+
+class EventBus:
+    """
+    Fans published events out to the subscribers
+
+    publish() never blocks and can be called from any thread, e.g. from
+    libvlc callbacks.
+    """
+
+    def __init__(self):
+        self._subs: Set[Subscription] = set()
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._thread: int | None = None
+
+    def subscribe(self, maxsize: int = MAX_QUEUE) -> Subscription:
+        self._loop = asyncio.get_running_loop()
+        self._thread = threading.get_ident()
+        sub = Subscription(self, maxsize)
+        self._subs.add(sub)
+        return sub
+
+    def publish(self, kind: str, **data: Any):
+        """
+        Publish an event, data must be JSON serializable
+        """
+        if not self._subs:
+            return
+        ev = {"event": kind, "time": datetime.now().isoformat(), **data}
+        if threading.get_ident() == self._thread:
+            self._dispatch(ev)
+            return
+        assert self._loop is not None
+        try:
+            self._loop.call_soon_threadsafe(self._dispatch, ev)
+        except RuntimeError:
+            # the loop is closed
+            pass
+
+    def _dispatch(self, ev: Dict[str, Any]):
+        for sub in list(self._subs):
+            sub._put(ev)
@@ -1,30 +1,253 @@
+"""
+Filters for narrowing down resolved media files
+
+Filters consume the paths as a stream and are composed lazily so a chain over
+a large glob never builds intermediate lists.
+"""
+
+import heapq
+import itertools
+import os
+import random
+import time
+
 from abc import ABC, abstractmethod
 from pathlib import Path
-from typing import Iterable
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Tuple, Type, TypeVar
+
+from . import util
+from .statcache import StatCache
+
+F = TypeVar("F", bound=Type["Filter"])
+
+# filter classes by name, constructed from the value in the playlist file
+_REGISTRY: Dict[str, Callable[[Any], "Filter"]] = {}
+
+
+def register(cls: F) -> F:
+    """
+    Make a filter available in playlist files by its name
+    """
+    _REGISTRY[cls.name] = cls
+    return cls
+
+
+def _as_list(v: str | Iterable[str]) -> List[str]:
+    return [v] if isinstance(v, str) else list(v)
 
 
 class Filter(ABC):
 
+    name: str
+    # whether the filter reads the metadata of the files
+    uses_stat = False
+
     @abstractmethod
-    def __call__(self, paths: Iterable[Path]) -> Iterable[Path]:
-        pass
+    def __call__(self, paths: Iterable[Path], stats: StatCache) -> Iterable[Path]:
+        """
+        Filter a stream of paths
 
+        :param paths: Paths to filter, consumed only once
+        :param stats: Metadata cache of the current scan
+        """
 
-class Newest(Filter):
 
-    name = "newest"
+class TopK(Filter):
+    """
+    Keeps the count files with the largest or smallest key
+
+    The catalog sorts by the order column instead of calling key.
+    """
+
+    # catalog column and descending flag
+    order: Tuple[str, bool]
+    uses_stat = True
 
     def __init__(self, count: int):
         super().__init__()
         self._c = count
 
-    def __call__(self, paths: Iterable[Path]):
-        s = sorted(paths, key=lambda p: p.stat().st_mtime, reverse=True)
-        return s[: self._c]
+    @property
+    def count(self) -> int:
+        return self._c
+
+    @abstractmethod
+    def key(self, st: os.stat_result) -> float:
+        """
+        Sort key of a file from its metadata
+        """
+
+    def __call__(self, paths: Iterable[Path], stats: StatCache):
+        pick = heapq.nlargest if self.order[1] else heapq.nsmallest
+        return pick(self._c, paths, key=lambda p: self.key(stats.stat(p)))
+
+
+@register
+class Newest(TopK):
+
+    name = "newest"
+    order = ("mtime_ns", True)
+
+    def key(self, st: os.stat_result) -> float:
+        return st.st_mtime
+
+
+@register
+class Oldest(TopK):
+
+    name = "oldest"
+    order = ("mtime_ns", False)
+
+    def key(self, st: os.stat_result) -> float:
+        return st.st_mtime
+
+
+@register
+class Largest(TopK):
+
+    name = "largest"
+    order = ("size", True)
+
+    def key(self, st: os.stat_result) -> float:
+        return st.st_size
+
+
+@register
+class ModifiedWithin(Filter):
+    """
+    Files modified within the given duration, e.g. "7d"
+    """
+
+    name = "modified_within"
+    uses_stat = True
+
+    def __init__(self, duration: str):
+        super().__init__()
+        self._d = util.parse_timedelta(str(duration)).total_seconds()
+
+    def __call__(self, paths: Iterable[Path], stats: StatCache):
+        cutoff = time.time() - self._d
+        return (p for p in paths if stats.stat(p).st_mtime >= cutoff)
+
+
+@register
+class Extension(Filter):
+    """
+    Files with one of the given extensions, case insensitive
+    """
+
+    name = "extension"
+
+    def __init__(self, exts: str | Iterable[str]):
+        super().__init__()
+        self._exts = {"." + e.lower().lstrip(".") for e in _as_list(exts)}
+
+    def __call__(self, paths: Iterable[Path], stats: StatCache):
+        return (p for p in paths if p.suffix.lower() in self._exts)
+
+
+@register
+class Exclude(Filter):
+    """
+    Drop files matching any of the glob patterns
+
+    Patterns are matched from the right like with PurePath.match()
+    """
+
+    name = "exclude"
+
+    def __init__(self, patterns: str | Iterable[str]):
+        super().__init__()
+        self._pats = _as_list(patterns)
+
+    def __call__(self, paths: Iterable[Path], stats: StatCache):
+        return (p for p in paths if not any(p.match(pat) for pat in self._pats))
+
+
+@register
+class MaxDuration(Filter):
+    """
+    Media not longer than the given duration, e.g. "5m"
+
+    Media with unknown duration, like images or files not probed yet, pass.
+    """
+
+    name = "max_duration"
+    uses_stat = True
+
+    def __init__(self, duration: str):
+        super().__init__()
+        self._d = util.parse_timedelta(str(duration)).total_seconds()
+
+    def _keep(self, p: Path, stats: StatCache) -> bool:
+        meta = stats.metadata(p)
+        return meta is None or meta.duration is None or meta.duration <= self._d
+
+    def __call__(self, paths: Iterable[Path], stats: StatCache):
+        return (p for p in paths if self._keep(p, stats))
+
+
+@register
+class Sample(Filter):
+    """
+    Uniform random sample of the files, in their original order
+    """
+
+    name = "sample"
+
+    def __init__(self, count: int, rng: random.Random | None = None):
+        super().__init__()
+        self._c = count
+        self._rng = rng or random.Random()
+
+    def __call__(self, paths: Iterable[Path], stats: StatCache):
+        # Algorithm R
+        it = enumerate(paths)
+        res = list(itertools.islice(it, self._c))
+        for i, p in it:
+            j = self._rng.randrange(i + 1)
+            if j < self._c:
+                res[j] = (i, p)
+        return [p for _, p in sorted(res)]
+
+
+def filter_by_name(nm: str) -> Callable[[Any], Filter]:
+    try:
+        return _REGISTRY[nm]
+    except KeyError:
+        raise ValueError(f"Unknown filter: {nm}") from None
+
+
+def from_yaml(obj: Dict[str, Any] | List[Dict[str, Any]]) -> List[Filter]:
+    """
+    Create a filter chain
+
+    Accepts either a mapping or a list of mappings for when the same filter is
+    needed more than once. Filters are applied in the given order.
+    """
+    if isinstance(obj, dict):
+        obj = [obj]
+    return [filter_by_name(k)(v) for d in obj for k, v in d.items()]
+
+
+def chain(
+    filters: Iterable[Filter], paths: Iterable[Path], stats: StatCache
+) -> Iterator[Path]:
+    """
+    Apply the filters in order
+    """
+    filters = list(filters)
+    if any(f.uses_stat for f in filters):
+        # files are stat'ed lazily so some may be gone by now
+        paths = (p for p in paths if _exists(p, stats))
+    for f in filters:
+        paths = f(paths, stats)
+    return iter(paths)
 
 
-def filter_by_name(nm: str):
-    for candidate in [Newest]:
-        if candidate.name == nm:
-            return Newest
-    raise ValueError(f"Unknown filter: {nm}")
+def _exists(p: Path, stats: StatCache) -> bool:
+    try:
+        stats.stat(p)
+    except FileNotFoundError:
+        return False
+    return True
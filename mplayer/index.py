@@ -0,0 +1,199 @@
+"""
+Incrementally updated library index
+"""
+
+import asyncio
+import logging
+import os
+
+from bisect import bisect_left, insort
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Callable, Iterable, List, Set, Tuple
+
+from . import url
+from .catalog import Catalog, CatalogPlaylist
+from .inotify import Watcher
+from .playlist import MediaList, PlaylistSpec, Playlist
+from .statcache import StatCache
+
+_L = logging.getLogger(__name__)
+
+
+def _key(p: Path):
+    # the order of the walk, depth-first with each directory sorted
+    return p.parts
+
+
+def _affects(path: Path, base: Path, recursive: bool) -> bool:
+    if base.is_relative_to(path):
+        return True
+    if recursive:
+        return path.is_relative_to(base)
+    return path.parent == base
+
+
+@dataclass
+class _Indexed:
+    spec: PlaylistSpec
+    bases: List[Tuple[Path, bool]] = field(default_factory=list)
+    results: List[List[Path]] = field(default_factory=list)
+
+    def playlist(self) -> Playlist:
+        return Playlist.from_paths(
+            (r for res in self.results for r in res), name=self.spec.name
+        )
+
+
+class Index:
+    """
+    Resolved playlist specs kept current by file system events
+
+    Each spec entry remembers its resolved media files and the directory they
+    were searched from so only the entries whose directories changed need to
+    be updated. Changes below the directory of an entry without filters are
+    applied to its files directly, other entries are resolved again. With a
+    catalog the media files are kept there instead of in memory.
+    """
+
+    def __init__(
+        self,
+        watcher: Watcher | None = None,
+        new_stats: Callable[[], StatCache] = StatCache,
+        catalog: Catalog | None = None,
+    ):
+        self._watcher = watcher
+        self._new_stats = new_stats
+        self._catalog = catalog
+        self._specs: List[_Indexed] = []
+        self._watched: Set[Tuple[Path, bool]] = set()
+        # watched for specs dropped by clear(), until unwatch_stale()
+        self._stale: Set[Tuple[Path, bool]] = set()
+
+    def clear(self):
+        """
+        Forget the specs, their watches are kept for the specs added next
+        """
+        self._specs = []
+        self._stale |= self._watched
+        self._watched = set()
+
+    def unwatch_stale(self):
+        """
+        Stop watching the directories of the specs dropped by clear() that
+        were not added again
+        """
+        if self._watcher is not None:
+            for b in self._stale:
+                self._watcher.unwatch(*b)
+        self._stale = set()
+
+    async def _resolve(self, idx: _Indexed, i: int, stats: StatCache) -> bool:
+        """
+        Resolve a spec entry, returns False if it is known to be unchanged
+        """
+        spec, e = idx.spec, idx.spec[i]
+        if self._catalog is None:
+            res = [r async for r in spec.walk_entry(e, stats)]
+            if i < len(idx.results):
+                idx.results[i] = res
+            else:
+                idx.results.append(res)
+            return True
+        paths = url.resolve_async(e.resource, root=spec.root, stats=stats)
+        return await self._catalog.store_async(
+            spec.name, i, paths, stats, e.filters, idx.bases[i][0]
+        )
+
+    def _playlist(self, idx: _Indexed) -> MediaList:
+        if self._catalog is None:
+            return idx.playlist()
+        return self._catalog.playlist(idx.spec.name)
+
+    async def add(
+        self, spec: PlaylistSpec, stats: StatCache | None = None
+    ) -> MediaList:
+        """
+        Resolve the spec and start tracking it
+
+        :param stats: Metadata cache shared within a scan
+        """
+        stats = stats if stats is not None else self._new_stats()
+        idx = _Indexed(spec)
+        for e in spec:
+            b = url.base(e.resource, root=spec.root)
+            idx.bases.append(b)
+            if self._watcher is not None and b not in self._watched:
+                self._watched.add(b)
+                if b in self._stale:
+                    self._stale.discard(b)
+                else:
+                    await self._watcher.watch(*b)
+        for i in range(len(spec)):
+            await self._resolve(idx, i, stats)
+        if self._catalog is not None:
+            self._catalog.trim(spec.name, len(spec))
+        self._specs.append(idx)
+        return self._playlist(idx)
+
+    def _incremental(self, idx: _Indexed, i: int, paths: List[Path]) -> bool:
+        # filters may depend on all the files and the catalog is kept by
+        # store(), a change of the directory itself needs a walk anyway
+        b = idx.bases[i][0]
+        return (
+            self._catalog is None
+            and not idx.spec[i].filters
+            and all(p != b and p.is_relative_to(b) for p in paths)
+        )
+
+    async def _apply(self, idx: _Indexed, i: int, paths: List[Path]) -> bool:
+        """
+        Add and remove the changed paths of an entry, returns True if any of
+        its files changed
+        """
+        e, res = idx.spec[i], idx.results[i]
+        exists = await asyncio.to_thread(lambda: [os.path.lexists(p) for p in paths])
+        dirty = False
+        for p, there in zip(paths, exists):
+            j = bisect_left(res, _key(p), key=_key)
+            if not there:
+                # a removed directory takes the files below it along
+                end = j
+                while end < len(res) and res[end].is_relative_to(p):
+                    end += 1
+                if end > j:
+                    del res[j:end]
+                    dirty = True
+            elif j < len(res) and res[j] == p:
+                # modified or settled, the playlist is passed on again
+                dirty = True
+            elif url.matches(e.resource, p, root=idx.spec.root):
+                insort(res, p, key=_key)
+                dirty = True
+        return dirty
+
+    async def update(self, changed: Iterable[Path]) -> List[MediaList]:
+        """
+        Update the entries affected by the changed paths
+
+        Returns the playlists that were updated.
+        """
+        changed = list(changed)
+        stats = self._new_stats()
+        if stats.listings is not None:
+            stats.listings.invalidate(changed)
+        out = []
+        for idx in self._specs:
+            dirty = False
+            for i, (b, rec) in enumerate(idx.bases):
+                paths = [p for p in changed if _affects(p, b, rec)]
+                if not paths:
+                    continue
+                if self._incremental(idx, i, paths):
+                    dirty |= await self._apply(idx, i, paths)
+                else:
+                    dirty |= await self._resolve(idx, i, stats)
+            if dirty:
+                _L.debug('playlist "%s" updated', idx.spec.name)
+                out.append(self._playlist(idx))
+        return out
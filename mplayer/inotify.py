@@ -0,0 +1,226 @@
+"""
+Linux inotify bindings and recursive directory watching
+"""
+
+import asyncio
+import ctypes
+import ctypes.util
+import logging
+import os
+import struct
+
+from pathlib import Path
+from typing import AsyncIterator, Dict, List, NamedTuple, Set
+
+_L = logging.getLogger(__name__)
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+
+# Events that change the set of files or their contents
+CHANGES = (
+    IN_CLOSE_WRITE
+    | IN_MOVED_FROM
+    | IN_MOVED_TO
+    | IN_CREATE
+    | IN_DELETE
+    | IN_DELETE_SELF
+    | IN_MOVE_SELF
+)
+
+_EVENT = struct.Struct("iIII")
+
+
+class Event(NamedTuple):
+    wd: int
+    mask: int
+    cookie: int
+    name: str
+
+
+class Inotify:
+    """
+    Thin wrapper around an inotify file descriptor
+
+    Raises OSError if inotify is not supported on the platform.
+    """
+
+    def __init__(self):
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+            self._add = libc.inotify_add_watch
+            self._rm = libc.inotify_rm_watch
+            init = libc.inotify_init1
+        except (OSError, AttributeError) as e:
+            raise OSError("inotify not supported") from e
+        self._add.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self._rm.argtypes = [ctypes.c_int, ctypes.c_int]
+        self._fd = init(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self._fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+
+    def fileno(self) -> int:
+        return self._fd
+
+    def add_watch(self, path: os.PathLike, mask: int) -> int:
+        wd = self._add(self._fd, os.fsencode(path), mask)
+        if wd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err), str(path))
+        return wd
+
+    def rm_watch(self, wd: int):
+        self._rm(self._fd, wd)
+
+    def read(self) -> List[Event]:
+        """
+        Read pending events without blocking
+        """
+        try:
+            buf = os.read(self._fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+        out = []
+        off = 0
+        while off < len(buf):
+            wd, mask, cookie, length = _EVENT.unpack_from(buf, off)
+            off += _EVENT.size
+            name = os.fsdecode(buf[off : off + length].rstrip(b"\x00"))
+            off += length
+            out.append(Event(wd, mask, cookie, name))
+        return out
+
+    def close(self):
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+
+class Watcher:
+    """
+    Watch directories, optionally recursively, and report changed paths
+
+    New subdirectories of recursively watched directories are watched
+    automatically.
+    """
+
+    def __init__(self):
+        self._ino = Inotify()
+        self._dirs: Dict[int, Path] = {}
+        self._recursive: Set[Path] = set()
+        self._single: Set[Path] = set()
+
+    def close(self):
+        self._ino.close()
+
+    async def watch(self, path: os.PathLike, recursive: bool = True):
+        path = Path(path)
+        if recursive:
+            self._recursive.add(path)
+            await asyncio.to_thread(self._add_tree, path)
+        else:
+            self._single.add(path)
+            self._add(path)
+
+    def unwatch(self, path: os.PathLike, recursive: bool = True):
+        """
+        Undo watch(), directories still watched otherwise are kept
+        """
+        path = Path(path)
+        if recursive:
+            self._recursive.discard(path)
+        else:
+            self._single.discard(path)
+        for wd, d in list(self._dirs.items()):
+            if d != path and not (recursive and d.is_relative_to(path)):
+                continue
+            if d in self._single or self._is_recursive(d):
+                continue
+            self._ino.rm_watch(wd)
+            del self._dirs[wd]
+
+    def _add(self, path: Path) -> bool:
+        try:
+            wd = self._ino.add_watch(path, CHANGES | IN_ONLYDIR)
+        except FileNotFoundError:
+            return False
+        except OSError as e:
+            _L.warning("cannot watch %s: %s", path, e)
+            return False
+        self._dirs[wd] = path
+        return True
+
+    def _add_tree(self, root: Path):
+        for d, _, _ in os.walk(root):
+            self._add(Path(d))
+
+    def _is_recursive(self, path: Path) -> bool:
+        return any(path.is_relative_to(r) for r in self._recursive)
+
+    def _add_created(self, dirs: List[Path]) -> Set[Path]:
+        out: Set[Path] = set()
+        for d in dirs:
+            # Files may have appeared before the watch was in place
+            self._add_tree(d)
+            out.update(d.rglob("*"))
+        return out
+
+    def _handle(self, ev: Event, out: Set[Path], created: List[Path]):
+        if ev.mask & IN_Q_OVERFLOW:
+            _L.warning("inotify queue overflow")
+            out.update(self._recursive)
+            out.update(self._dirs.values())
+            return
+        d = self._dirs.get(ev.wd)
+        if d is None:
+            return
+        if ev.mask & IN_IGNORED:
+            del self._dirs[ev.wd]
+            return
+        path = d / ev.name if ev.name else d
+        out.add(path)
+        if ev.mask & IN_ISDIR and ev.mask & (IN_CREATE | IN_MOVED_TO):
+            if self._is_recursive(path):
+                created.append(path)
+
+    async def changes(self, delay: float = 0.1) -> AsyncIterator[Set[Path]]:
+        """
+        Stream sets of changed paths
+
+        Events arriving within delay from each other are reported together.
+        """
+        loop = asyncio.get_running_loop()
+        ready = asyncio.Event()
+        loop.add_reader(self._ino.fileno(), ready.set)
+        try:
+            while True:
+                await ready.wait()
+                out: Set[Path] = set()
+                while ready.is_set():
+                    ready.clear()
+                    created: List[Path] = []
+                    for ev in self._ino.read():
+                        self._handle(ev, out, created)
+                    if created:
+                        # walking new trees may take long on large directories
+                        out |= await asyncio.to_thread(self._add_created, created)
+                    try:
+                        await asyncio.wait_for(ready.wait(), delay)
+                    except TimeoutError:
+                        pass
+                if out:
+                    yield out
+        finally:
+            loop.remove_reader(self._ino.fileno())
@@ -2,15 +2,22 @@ import sys
 import os
 import argparse
 import asyncio
+import json
 import logging
 import signal
 
-from . import api, util
+from pathlib import Path
+
+from . import api, bench, metrics, util
 from .app import App
+from .player import Player
+from .sim_player import SimPlayer
 from .playlist import PlaylistSpec, Entry as PlaylistEntry
 from .schedule import Schedule
 from .core import Core, make_core
-
+from .daemon import Control
+from .events import EventBus
+from .worker import WorkerPlayer
 
 _DEFAULT_SOCKET = os.environ.get("MPLAYER_SOCKET", "/tmp/foo.sock")
 
@@ -42,7 +49,8 @@ def _parse_cli() -> argparse.Namespace:
         "-q", "--quiet", dest="loglevel", action="store_const", const="error"
     )
     sp = p.add_subparsers(dest="cmd")
-    play = sp.add_parser("play", help="Play files")
+    # options shared by play and daemon
+    play = argparse.ArgumentParser(add_help=False)
     play.add_argument(
         "-f",
         "--fullscreen",
@@ -50,18 +58,99 @@ def _parse_cli() -> argparse.Namespace:
         action=argparse.BooleanOptionalAction,
         help="run in fullscreen",
     )
+    play.add_argument(
+        "--player",
+        choices=["vlc", "vlc-worker", "sim"],
+        default="vlc",
+        help="Playback backend. 'vlc-worker' runs libvlc in a separate process "
+        "that is restarted if it hangs or crashes. 'sim' plays nothing and only "
+        "simulates media durations, for load testing",
+    )
+    play.add_argument(
+        "--worker-timeout",
+        default="10s",
+        type=util.parse_timedelta,
+        help="How long playback may stall before the vlc-worker process is "
+        "restarted and the media skipped",
+    )
     play.add_argument(
         "--image-duration",
         default=None,
         type=util.parse_timedelta,
         help="Image duration, e.g. '10s'",
     )
+    play.add_argument(
+        "--switch-grace",
+        default="0s",
+        type=util.parse_timedelta,
+        help="How long the current media may continue after a scheduled "
+        "playlist switch, e.g. '30s'",
+    )
+    play.add_argument(
+        "--finish-images",
+        action=argparse.BooleanOptionalAction,
+        help="Let images play to their end on scheduled playlist switches",
+        default=True,
+    )
     play.add_argument(
         "--repeat",
         action=argparse.BooleanOptionalAction,
         help="Repeat the files",
         default=False,
     )
+    play.add_argument(
+        "--watch",
+        action=argparse.BooleanOptionalAction,
+        help="Follow changes in the media directories via inotify",
+        default=True,
+    )
+    play.add_argument(
+        "--rescan-debounce",
+        default="1s",
+        type=util.parse_timedelta,
+        help="Quiet period before a requested rescan starts",
+    )
+    play.add_argument(
+        "--rescan-max-latency",
+        default="10s",
+        type=util.parse_timedelta,
+        help="Longest time a rescan is postponed by new requests",
+    )
+    play.add_argument(
+        "--warm-start",
+        action=argparse.BooleanOptionalAction,
+        help="Start playing from the library snapshot of the previous run "
+        "while rescanning in the background",
+        default=True,
+    )
+    play.add_argument(
+        "--resolve-concurrency",
+        type=int,
+        default=4,
+        help="Number of playlists resolved at the same time",
+    )
+    play.add_argument(
+        "--resolve-timeout",
+        default=None,
+        type=util.parse_timedelta,
+        help="Longest time a playlist may take to resolve before playback goes "
+        "on with its previous contents, it is updated once resolved. No limit "
+        "by default",
+    )
+    play.add_argument(
+        "--catalog",
+        type=Path,
+        default=None,
+        help="Keep the resolved playlists in the given SQLite file instead of "
+        "in memory, for very large libraries",
+    )
+    play.add_argument(
+        "--probe-workers",
+        type=int,
+        default=2,
+        help="Number of processes probing media metadata in the background. "
+        "0 disables probing",
+    )
     play.add_argument(
         "--schedule",
         help="Read schedule from file. Implies --repeat. "
@@ -69,52 +158,206 @@ def _parse_cli() -> argparse.Namespace:
         "Playlists need to be passed via positional arguments. "
         "Non-playlist files are part of nameless playlists.",
     )
+    play.add_argument(
+        "--metrics-file",
+        type=Path,
+        default=None,
+        help="Write metrics to the given file in the Prometheus text format, "
+        "e.g. for the textfile collector of node_exporter",
+    )
+    play.add_argument(
+        "--metrics-interval",
+        default="15s",
+        type=util.parse_timedelta,
+        help="How often the metrics file is written",
+    )
     play.add_argument("files", help="Files to play", nargs="*")
+    sp.add_parser("play", parents=[play], help="Play files")
 
-    daemon = sp.add_parser("daemon", help="launch mplayerd")
+    daemon = sp.add_parser(
+        "daemon",
+        parents=[play],
+        help="Play in the background, controlled with ctl",
+    )
     daemon.add_argument("-s", "--socket", help="socket path")
 
+    b = sp.add_parser("bench", help="Run benchmarks on synthetic media trees")
+    b.add_argument(
+        "--files",
+        type=int,
+        nargs="+",
+        default=[10_000],
+        help="Numbers of files in the generated trees",
+    )
+    b.add_argument(
+        "--layout", nargs="+", choices=bench.LAYOUTS, default=list(bench.LAYOUTS)
+    )
+    b.add_argument(
+        "--only",
+        nargs="+",
+        choices=bench.BENCHMARKS,
+        default=list(bench.BENCHMARKS),
+        help="Benchmarks to run",
+    )
+    b.add_argument("--playlists", type=int, default=1, help="Number of playlists")
+    b.add_argument("--events", type=int, default=1000, help="Schedule size")
+    b.add_argument("--repeat", type=int, default=3, help="Rounds per benchmark")
+    b.add_argument(
+        "--transitions", type=int, default=1000, help="Transitions to measure"
+    )
+    b.add_argument("--requests", type=int, default=10_000, help="API requests per mode")
+    b.add_argument("--dir", default=None, help="Where to generate the trees")
+    b.add_argument("-o", "--output", default="-", help="JSON output file")
+
     ctl = sp.add_parser("ctl", help="mplayerctl for controlling mplayerd")
     ctl.add_argument("-s", "--socket", help="daemon socket path")
-    ctl_sp = ctl.add_subparsers(dest="ctl_cmd")
-    ctl_play = ctl_sp.add_parser("play", help="play files")
-    ctl_play.add_argument("files", help="files to play", nargs="*")
+    ctl_sp = ctl.add_subparsers(dest="ctl_cmd", required=True)
+    ctl_play = ctl_sp.add_parser("play", help="replace the played files")
+    ctl_play.add_argument("files", help="files to play", nargs="+")
+    ctl_enqueue = ctl_sp.add_parser("enqueue", help="add files to play")
+    ctl_enqueue.add_argument("files", help="files to add", nargs="+")
+    ctl_sp.add_parser("skip", help="skip the current media")
+    ctl_sp.add_parser("pause", help="pause playback")
+    ctl_sp.add_parser("resume", help="resume playback")
+    ctl_sched = ctl_sp.add_parser("schedule", help="replace the schedule")
+    ctl_sched.add_argument("path", help="schedule file, none if omitted", nargs="?")
+    ctl_sp.add_parser("rescan", help="rescan the files now")
+    ctl_sp.add_parser("status", help="show the player state")
+    ctl_sp.add_parser("stats", help="show the metrics")
     return p.parse_args()
 
 
+def _make_player(ns: argparse.Namespace, core: Core) -> Player | None:
+    name = ns.player
+    if name == "vlc-worker":
+        return WorkerPlayer(timeout=ns.worker_timeout.total_seconds())
+    if name == "sim":
+
+        def duration(path):
+            meta = core.metadata(path)
+            return meta.duration if meta is not None else None
+
+        return SimPlayer(duration=duration)
+    return None
+
+
+async def _make_app(ns: argparse.Namespace, events: EventBus | None = None):
+    core = await make_core(
+        ns.files,
+        ns.schedule,
+        watch=ns.watch,
+        warm_start=ns.warm_start,
+        probe_workers=ns.probe_workers,
+        rescan_debounce=ns.rescan_debounce.total_seconds(),
+        rescan_max_latency=ns.rescan_max_latency.total_seconds(),
+        catalog=ns.catalog,
+        resolve_concurrency=ns.resolve_concurrency,
+        resolve_timeout=(
+            ns.resolve_timeout.total_seconds()
+            if ns.resolve_timeout is not None
+            else None
+        ),
+    )
+    asyncio.get_running_loop().add_signal_handler(signal.SIGHUP, core.request_rescan)
+    app = None
+    try:
+        app = App(core, _make_player(ns, core), events)
+        if ns.image_duration is not None:
+            await app.set_image_duration(ns.image_duration)
+        await app.set_fullscreen(ns.fullscreen)
+        await app.set_cutover(ns.switch_grace, ns.finish_images)
+        await app.set_repeat(ns.repeat or bool(ns.schedule))
+    except BaseException:
+        if app is not None:
+            await app.close()
+        core.close()
+        raise
+    return core, app
+
+
+def _write_metrics(ns: argparse.Namespace) -> asyncio.Task | None:
+    if ns.metrics_file is None:
+        return None
+    return asyncio.create_task(
+        metrics.REGISTRY.write_periodically(
+            ns.metrics_file, ns.metrics_interval.total_seconds()
+        )
+    )
+
+
 async def _run(ns: argparse.Namespace):
     """
     Run the player in foreground mode
     """
-    core = await make_core(ns.files, ns.schedule)
-    asyncio.get_running_loop().add_signal_handler(signal.SIGHUP, core.request_rescan)
-    app = App(core)
-    if ns.image_duration is not None:
-        await app.set_image_duration(ns.image_duration)
-    await app.set_fullscreen(ns.fullscreen)
-    await app.set_repeat(ns.repeat or bool(ns.schedule))
-    await app.play()
+    core, app = await _make_app(ns)
+    metrics_task = _write_metrics(ns)
+    try:
+        await app.play()
+    finally:
+        if metrics_task is not None:
+            metrics_task.cancel()
+        await app.close()
+        core.close()
 
 
 async def _run_daemon(ns: argparse.Namespace):
+    """
+    Keep playing and serve control requests until stopped
+    """
     sock = ns.socket or _DEFAULT_SOCKET
-    srv = api.Server()
-
-    async def on_echo(msg: str):
-        return msg
-
-    srv.route("echo", echoer)
-
-    await api.start_server(sock, api.Server())
-    await asyncio.sleep(10)
+    srv = api.Server(sock)
+    core, app = await _make_app(ns, srv.events)
+    # files added later are played after the current ones
+    await app.set_follow(True)
+    Control(app, core).register(srv)
+    metrics_task = _write_metrics(ns)
+    play = asyncio.create_task(app.play())
+    serve = asyncio.create_task(srv.serve_forever())
+    try:
+        done, _ = await asyncio.wait([play, serve], return_when=asyncio.FIRST_COMPLETED)
+        for t in done:
+            t.result()
+    finally:
+        play.cancel()
+        serve.cancel()
+        if metrics_task is not None:
+            metrics_task.cancel()
+        srv.close()
+        await app.close()
+        core.close()
+        if os.path.exists(sock):
+            os.unlink(sock)
 
 
 async def _run_ctl(ns: argparse.Namespace):
     sock = ns.socket or _DEFAULT_SOCKET
+    args = {}
+    if ns.ctl_cmd in ("play", "enqueue"):
+        args["files"] = [str(Path(f).absolute()) for f in ns.files]
+    elif ns.ctl_cmd == "schedule":
+        args["path"] = str(Path(ns.path).absolute()) if ns.path else None
     c = api.Client(sock)
-    res = await c.echo("asdfsdaf")
-    print("responded with: ", res)
-    pass
+    try:
+        res = await c.call(ns.ctl_cmd, **args)
+    finally:
+        await c.close()
+    if res is not None:
+        print(json.dumps(res, indent=2))
+
+
+async def _run_bench(ns: argparse.Namespace):
+    res = await bench.run(
+        files=ns.files,
+        layouts=ns.layout,
+        benchmarks=ns.only,
+        playlists=ns.playlists,
+        events=ns.events,
+        repeat=ns.repeat,
+        transitions=ns.transitions,
+        requests=ns.requests,
+        directory=ns.dir,
+    )
+    bench.write(res, ns.output)
 
 
 async def _main_coro(ns: argparse.Namespace):
@@ -131,6 +374,8 @@ async def _main_coro(ns: argparse.Namespace):
         await _run_daemon(ns)
     elif ns.cmd == "ctl":
         await _run_ctl(ns)
+    elif ns.cmd == "bench":
+        await _run_bench(ns)
     else:
         raise ValueError(f"Unknown command {ns.cmd}")
 
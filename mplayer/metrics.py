@@ -0,0 +1,248 @@
+"""
+In-process metrics
+
+Counters and histograms are cheap enough to update on the playback path and
+can be called from any thread, e.g. from libvlc callbacks. They are read with
+snapshot() or exported in the Prometheus text format.
+"""
+
+import asyncio
+import logging
+import math
+import os
+import threading
+
+from bisect import bisect_left
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Sequence
+
+from .cache import write_atomic
+
+_L = logging.getLogger(__name__)
+
+# Upper bounds in seconds, for durations from sub-millisecond gaps to rescans
+# of large libraries
+SECONDS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+)
+
+
+class Counter:
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        self._lock = threading.Lock()
+        self._value = 0
+        self._forward: Callable[[str, float], None] | None = None
+
+    def inc(self, n: int = 1):
+        with self._lock:
+            self._value += n
+        if self._forward is not None:
+            self._forward(self.name, n)
+
+    def snapshot(self) -> int:
+        return self._value
+
+    def _prometheus(self) -> List[str]:
+        return [
+            f"# HELP {self.name} {self.help}",
+            f"# TYPE {self.name} counter",
+            f"{self.name} {self._value}",
+        ]
+
+
+class Histogram:
+    """
+    Distribution of samples in buckets with fixed upper bounds
+
+    :param buckets: Increasing upper bounds, samples above the last one are
+                    counted in an implicit +Inf bucket
+    """
+
+    def __init__(self, name: str, help: str, buckets: Sequence[float] = SECONDS):
+        self.name = name
+        self.help = help
+        self._bounds = list(buckets)
+        self._lock = threading.Lock()
+        # per bucket, not cumulative, the last one is +Inf
+        self._counts = [0] * (len(self._bounds) + 1)
+        self._sum = 0.0
+        self._max = 0.0
+        self._forward: Callable[[str, float], None] | None = None
+
+    def observe(self, v: float):
+        i = bisect_left(self._bounds, v)
+        with self._lock:
+            self._counts[i] += 1
+            self._sum += v
+            if v > self._max:
+                self._max = v
+        if self._forward is not None:
+            self._forward(self.name, v)
+
+    @property
+    def count(self) -> int:
+        return sum(self._counts)
+
+    def quantile(self, q: float) -> float | None:
+        """
+        Estimate a quantile as the upper bound of the bucket it falls in
+        """
+        with self._lock:
+            counts = list(self._counts)
+            top = self._max
+        total = sum(counts)
+        if not total:
+            return None
+        rank = math.ceil(q * total)
+        seen = 0
+        for bound, n in zip(self._bounds, counts):
+            seen += n
+            if seen >= rank:
+                return min(bound, top)
+        return top
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            count, total, top = sum(self._counts), self._sum, self._max
+        return {
+            "count": count,
+            "sum": total,
+            "max": top,
+            "p50": self.quantile(0.5),
+            "p99": self.quantile(0.99),
+        }
+
+    def _prometheus(self) -> List[str]:
+        with self._lock:
+            counts = list(self._counts)
+            total = self._sum
+        out = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        seen = 0
+        for bound, n in zip(self._bounds + [math.inf], counts):
+            seen += n
+            le = "+Inf" if bound == math.inf else repr(bound)
+            out.append(f'{self.name}_bucket{{le="{le}"}} {seen}')
+        out.append(f"{self.name}_sum {total!r}")
+        out.append(f"{self.name}_count {seen}")
+        return out
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, Counter | Histogram] = {}
+
+    def counter(self, name: str, help: str) -> Counter:
+        return self._add(Counter(name, help))
+
+    def histogram(
+        self, name: str, help: str, buckets: Sequence[float] = SECONDS
+    ) -> Histogram:
+        return self._add(Histogram(name, help, buckets))
+
+    def _add(self, m):
+        if m.name in self._metrics:
+            raise ValueError(f"Duplicate metric: {m.name}")
+        self._metrics[m.name] = m
+        return m
+
+    def forward(self, to: Callable[[str, float], None]):
+        """
+        Pass every update to to(name, value) too, e.g. from a worker process
+        to the registry of the main process
+        """
+        for m in self._metrics.values():
+            m._forward = to
+
+    def record(self, name: str, value: float):
+        """
+        Apply an update passed on by forward()
+        """
+        m = self._metrics.get(name)
+        if m is None:
+            _L.debug("unknown metric: %s", name)
+        elif isinstance(m, Counter):
+            m.inc(int(value))
+        else:
+            m.observe(value)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """
+        Current values as JSON serializable data
+        """
+        return {name: m.snapshot() for name, m in self._metrics.items()}
+
+    def prometheus(self) -> str:
+        """
+        Current values in the Prometheus text exposition format
+        """
+        lines = []
+        for m in self._metrics.values():
+            lines += m._prometheus()
+        return "\n".join(lines) + "\n"
+
+    def write(self, path: os.PathLike):
+        """
+        Replace path with the Prometheus text atomically
+        """
+        write_atomic(Path(path), self.prometheus().encode())
+
+    async def write_periodically(self, path: os.PathLike, interval: float):
+        """
+        Write the Prometheus text every interval seconds until cancelled
+        """
+        while True:
+            try:
+                self.write(path)
+            except OSError as e:
+                _L.warning("writing metrics failed: %s", e)
+            await asyncio.sleep(interval)
+
+
+REGISTRY = Registry()
+
+RESCAN_SECONDS = REGISTRY.histogram(
+    "mplayer_rescan_seconds", "Duration of input rescans"
+)
+RESCANS = REGISTRY.counter("mplayer_rescans_total", "Rescans run")
+RESCAN_REQUESTS = REGISTRY.counter(
+    "mplayer_rescan_requests_total", "Rescan requests, merged into fewer rescans"
+)
+PERSIST_SECONDS = REGISTRY.histogram(
+    "mplayer_persist_seconds", "Time to pin a media file for playback"
+)
+PERSIST_COPIES = REGISTRY.counter(
+    "mplayer_persist_copies_total", "Media files pinned by copying"
+)
+FIRST_FRAME_SECONDS = REGISTRY.histogram(
+    "mplayer_first_frame_seconds", "Time from starting a media to its first frame"
+)
+GAP_SECONDS = REGISTRY.histogram(
+    "mplayer_transition_gap_seconds",
+    "Time from the end of a media to the first frame of the next",
+)
+SWITCH_LATENCY_SECONDS = REGISTRY.histogram(
+    "mplayer_switch_latency_seconds",
+    "Time from a scheduled switch to the start of the new playlist",
+)
+WORKER_RESTARTS = REGISTRY.counter(
+    "mplayer_worker_restarts_total", "Player worker processes that died or hung"
+)
+PLAYED = REGISTRY.counter("mplayer_media_played_total", "Media started")
+ERRORS = REGISTRY.counter("mplayer_playback_errors_total", "Playback errors")
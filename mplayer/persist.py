@@ -1,23 +1,137 @@
+"""
+Pinning media files for the duration of playback
+"""
+
+import asyncio
+import contextlib
+import fcntl
+import logging
+import os
 import shutil
 import tempfile
-import contextlib
+import time
 
 from pathlib import Path
-from typing import Iterator
+from typing import AsyncIterator, Dict, Tuple
+
+from . import metrics
+from .cache import cache_dir
+
+_L = logging.getLogger(__name__)
+
+# _IOW(0x94, 9, int) from linux/fs.h
+_FICLONE = 0x40049409
+_PROC_FD = Path("/proc/self/fd")
+# staging directory per device
+_roots: Dict[int, str | None] = {}
+
+
+def _hardlink(src: Path, dst: Path) -> bool:
+    try:
+        os.link(src, dst)
+    except FileNotFoundError:
+        raise
+    except OSError as e:
+        _L.debug("cannot hardlink %s: %s", src, e)
+        return False
+    return True
+
+
+def _reflink(src: Path, dst: Path) -> bool:
+    with open(src, "rb") as s:
+        d = os.open(dst, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        try:
+            fcntl.ioctl(d, _FICLONE, s.fileno())
+        except OSError as e:
+            _L.debug("cannot reflink %s: %s", src, e)
+            os.close(d)
+            os.unlink(dst)
+            return False
+        os.close(d)
+    return True
+
+
+def _staging_root(dev: int) -> str | None:
+    """
+    Directory on the filesystem of the device for staging, None if there is none
+
+    Hardlinks and reflinks only work within a filesystem. The cache and temp
+    directories are used if they are on it. Nothing is created on other
+    filesystems, e.g. the media share, where staged files could show up in
+    playlists or be left behind.
+    """
+    if dev in _roots:
+        root = _roots[dev]
+        if root is None or os.path.isdir(root):
+            return root
+    root = None
+    for d in (cache_dir() / "staging", Path(tempfile.gettempdir())):
+        try:
+            if d.exists() and os.stat(d).st_dev != dev:
+                continue
+            d.mkdir(mode=0o700, parents=True, exist_ok=True)
+            if os.stat(d).st_dev == dev and os.access(d, os.W_OK):
+                root = str(d)
+                break
+        except OSError as e:
+            _L.debug("cannot stage in %s: %s", d, e)
+    _roots[dev] = root
+    return root
+
+
+@contextlib.asynccontextmanager
+async def pin(path: os.PathLike) -> AsyncIterator[Tuple[Path, str]]:
+    """
+    persist() that also tells how the file was pinned
+
+    Yields the path and "hardlink", "reflink", "fd" or "copy".
+    """
+    path = Path(path)
+    start = time.perf_counter()
+    root = _staging_root(os.stat(path).st_dev)
+    with tempfile.TemporaryDirectory(prefix="mplayer-", dir=root) as d:
+        dst = Path(d) / path.name
+        method = None
+        if root is not None:
+            if _hardlink(path, dst):
+                method = "hardlink"
+            elif _reflink(path, dst):
+                method = "reflink"
+        if method is not None:
+            metrics.PERSIST_SECONDS.observe(time.perf_counter() - start)
+            yield dst, method
+            return
+        if _PROC_FD.is_dir():
+            fd = os.open(path, os.O_RDONLY | os.O_CLOEXEC)
+            try:
+                metrics.PERSIST_SECONDS.observe(time.perf_counter() - start)
+                yield _PROC_FD / str(fd), "fd"
+            finally:
+                os.close(fd)
+            return
+        _L.debug("copying %s", path)
+        await asyncio.to_thread(shutil.copy, path, dst)
+        metrics.PERSIST_SECONDS.observe(time.perf_counter() - start)
+        metrics.PERSIST_COPIES.inc()
+        yield dst, "copy"
 
 
-@contextlib.contextmanager
-def persist(path: Path) -> Iterator[Path]:
+@contextlib.asynccontextmanager
+async def persist(path: os.PathLike) -> AsyncIterator[Path]:
     """
     Get a persistent handle to a file
 
-    Create a persistent copy of the given file that is valid for the duration
-    of the context manager. This effectively creates a temporary file with the
-    same name with the same contents as the original file
+    The returned path stays valid for the duration of the context manager even
+    if the original file is removed or replaced. The file is pinned without
+    copying when possible by trying, in order:
+
+    - hardlink into a private staging directory on the same filesystem
+    - reflink into the staging directory on copy-on-write filesystems
+    - an open file descriptor referred through /proc/self/fd
+
+    If none of those work the file is copied in a worker thread.
 
     May throw FileNotFoundError if the file is deleted while being persisted
     """
-    with tempfile.TemporaryDirectory() as d:
-        dst = Path(d) / path.name
-        shutil.copy(path, dst)
-        yield dst
+    async with pin(path) as (p, _):
+        yield p
@@ -1,13 +1,61 @@
 import os
 
 from abc import ABC, abstractmethod
+from datetime import timedelta
+from pathlib import Path
+from typing import Callable
 
 
 class Player(ABC):
 
+    # Called when a media starts playing and when playing it fails. These may
+    # be called from the threads of the player.
+    on_playing: Callable[[Path], None] | None = None
+    on_error: Callable[[Path, str], None] | None = None
+    # Whether set_paused() is implemented
+    can_pause = False
+
     def __init__(self) -> None:
         pass
 
     @abstractmethod
     async def play(self, file: os.PathLike):
         pass
+
+    @abstractmethod
+    async def set_image_duration(self, duration: timedelta):
+        pass
+
+    @abstractmethod
+    async def set_fullscreen(self, val: bool):
+        pass
+
+    async def set_paused(self, val: bool):
+        raise NotImplementedError("Pausing is not supported by the player")
+
+    def position(self) -> float | None:
+        """
+        Playback position in the current media in seconds, None if unknown
+        """
+        return None
+
+    async def stage(self, file: os.PathLike):
+        """
+        Prepare the file that is likely played next
+
+        Called while the current media is still playing. Players may use this
+        to reduce the gap between media.
+        """
+
+    async def preload(self, file: os.PathLike):
+        """
+        Prepare a file that is played at a known later point
+
+        Used e.g. for the first media after a scheduled switch. Unlike stage()
+        this does not make the file the next media to play.
+        """
+
+    async def close(self):
+        """
+        Release the resources of the player, e.g. a worker process
+        """
@@ -3,26 +3,121 @@ Playlist implementation
 """
 
 import asyncio
+import bisect
 import os
+import queue
+import sys
 
+from abc import abstractmethod
+from array import array
+from collections.abc import Collection, Sequence
 from dataclasses import dataclass, field
 from pathlib import Path
-from typing import Iterable, List, TypeVar, Generic, Dict, Any
+from typing import (
+    Any,
+    AsyncIterator,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    TypeVar,
+    Generic,
+    Tuple,
+    TYPE_CHECKING,
+    overload,
+)
 
 import yaml
 
-from . import url
-from .filters import Filter, filter_by_name
+from . import cache, filters, url
+from .filters import Filter
+from .statcache import StatCache
 
+if TYPE_CHECKING:
+    from .catalog import Catalog, CatalogPlaylist
 
 T = TypeVar("T")
 
+_END = object()
 
-def _filters_from_dict(d: Dict[str, Any]) -> List[Filter]:
-    out = []
-    for k, v in d.items():
-        out.append(filter_by_name(k)(v))
-    return out
+_FS_ENC = sys.getfilesystemencoding()
+_FS_ERRORS = sys.getfilesystemencodeerrors()
+
+# libyaml based loader is an order of magnitude faster when available
+_Loader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
+_PLAYLIST_EXTS = {".yaml", ".yml"}
+_MEDIA_EXTS = set(
+    ".png .jpg .jpeg .gif .bmp .webp .tif .tiff .svg "
+    ".mp4 .mkv .webm .avi .mov .m4v .mpg .mpeg .ts .wmv .flv "
+    ".mp3 .ogg .flac .wav .m4a .opus".split()
+)
+_MAGIC = [
+    b"\x89PNG",
+    b"\xff\xd8\xff",
+    b"GIF8",
+    b"RIFF",
+    b"OggS",
+    b"fLaC",
+    b"ID3",
+    b"\x1a\x45\xdf\xa3",
+    b"II*\x00",
+    b"MM\x00*",
+    b"\x00\x00\x01\xba",
+    b"\x00\x00\x01\xb3",
+]
+
+
+def is_playlist(path: Path) -> bool:
+    """
+    Cheap check whether the file can be a playlist
+
+    Decides by extension when possible and otherwise by the first bytes of the
+    file, so media files are not read through the YAML parser.
+    """
+    ext = path.suffix.lower()
+    if ext in _PLAYLIST_EXTS:
+        return True
+    if ext in _MEDIA_EXTS:
+        return False
+    with open(path, "rb") as f:
+        head = f.read(512)
+    if any(head.startswith(m) for m in _MAGIC) or head[4:8] == b"ftyp":
+        return False
+    return b"\x00" not in head
+
+
+def _read_docs(path: Path) -> List[Dict[str, Any]]:
+    if not is_playlist(path):
+        raise ValueError(f"Not a playlist: {path}")
+    try:
+        with open(path) as f:
+            docs = list(yaml.load_all(f, Loader=_Loader))
+    except yaml.YAMLError as e:
+        raise ValueError(f"Not a playlist: {path}") from e
+    if not all(isinstance(d, dict) for d in docs):
+        raise ValueError(f"Not a playlist: {path}")
+    return docs
+
+
+async def _apply_filters(
+    chain: List[Filter], paths: AsyncIterator[Path], stats: StatCache
+) -> List[Path]:
+    """
+    Run the filters in a worker thread while paths are streamed to them
+    """
+    q: queue.SimpleQueue = queue.SimpleQueue()
+
+    def run():
+        return list(filters.chain(chain, iter(q.get, _END), stats))
+
+    task = asyncio.ensure_future(asyncio.to_thread(run))
+    try:
+        async for p in paths:
+            q.put(p)
+    finally:
+        q.put(_END)
+    return await task
 
 
 @dataclass
@@ -49,16 +144,312 @@ class _PlaylistImpl(Generic[T], List[Entry[T]]):
         return self._nm
 
 
-class Playlist(_PlaylistImpl[Path]):
+class MediaEntry:
+    """
+    Entry of a resolved playlist, created on access
+    """
+
+    __slots__ = ("resource",)
+
+    def __init__(self, resource: Path):
+        self.resource = resource
+
+    def __eq__(self, other):
+        if not isinstance(other, (MediaEntry, Entry)):
+            return NotImplemented
+        return self.resource == other.resource
+
+    def __repr__(self) -> str:
+        return f"MediaEntry(resource={self.resource!r})"
+
+
+class MediaList(Sequence[MediaEntry]):
+    """
+    Resolved playlist, see Playlist and CatalogPlaylist
+    """
+
+    @property
+    @abstractmethod
+    def name(self) -> str: ...
+
+    @abstractmethod
+    def __len__(self) -> int: ...
+
+    @overload
+    def __getitem__(self, i: int) -> MediaEntry: ...
+
+    @overload
+    def __getitem__(self, i: slice) -> Sequence[MediaEntry]: ...
+
+    @abstractmethod
+    def __getitem__(self, i: int | slice) -> MediaEntry | Sequence[MediaEntry]: ...
+
+    @abstractmethod
+    def resources(self) -> Iterator[Path]:
+        """
+        Iterate the media files without creating entries
+        """
+
+    @abstractmethod
+    def positions(self, path: os.PathLike) -> List[int]:
+        """
+        Positions of a media file in ascending order
+        """
+
+    def __iter__(self) -> Iterator[MediaEntry]:
+        return (MediaEntry(r) for r in self.resources())
+
+    def index(self, entry: Entry[Path] | MediaEntry | os.PathLike, *_) -> int:
+        """
+        Position of a media file, raises ValueError if not found
+        """
+        path = entry.resource if isinstance(entry, (Entry, MediaEntry)) else entry
+        found = self.positions(path)
+        if not found:
+            raise ValueError(f"{path} is not in playlist")
+        return found[0]
+
+    def __contains__(self, entry) -> bool:
+        try:
+            self.index(entry)
+        except ValueError:
+            return False
+        return True
+
+
+class Excluding(MediaList):
+    """
+    Playlist without some of its media files
+
+    Only the positions of the left out files are stored, the rest is read
+    from the underlying playlist on access.
+    """
+
+    def __init__(self, plist: MediaList, skip: Iterable[int]):
+        self._plist = plist
+        self._skip = sorted(set(skip))
+
+    @staticmethod
+    def without(plist: MediaList, paths: Collection[Path]) -> MediaList:
+        """
+        Leave out the given media files, returns plist if none of them is in it
+        """
+        if len(paths) < len(plist):
+            skip = [i for p in paths for i in plist.positions(p)]
+        else:
+            skip = [i for i, r in enumerate(plist.resources()) if r in paths]
+        return Excluding(plist, skip) if skip else plist
+
+    @property
+    def name(self) -> str:
+        return self._plist.name
+
+    def __len__(self) -> int:
+        return len(self._plist) - len(self._skip)
+
+    def _outer(self, i: int) -> int:
+        # position in the underlying playlist
+        for s in self._skip:
+            if s > i:
+                break
+            i += 1
+        return i
+
+    @overload
+    def __getitem__(self, i: int) -> MediaEntry: ...
+
+    @overload
+    def __getitem__(self, i: slice) -> List[MediaEntry]: ...
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("playlist index out of range")
+        return self._plist[self._outer(i)]
+
+    def resources(self) -> Iterator[Path]:
+        skip = iter(self._skip)
+        nxt = next(skip, -1)
+        for i, r in enumerate(self._plist.resources()):
+            if i == nxt:
+                nxt = next(skip, -1)
+            else:
+                yield r
+
+    def positions(self, path: os.PathLike) -> List[int]:
+        return [
+            i - bisect.bisect_left(self._skip, i)
+            for i in self._plist.positions(path)
+            if i not in self._skip
+        ]
+
+    def __eq__(self, other):
+        if not isinstance(other, Sequence):
+            return NotImplemented
+        if len(self) != len(other):
+            return False
+        return all(a == b for a, b in zip(self, other))
+
+    __hash__ = None  # type: ignore
+
+    def __repr__(self) -> str:
+        return f"Excluding({self._plist!r}, {len(self._skip)} entries)"
+
+
+class Playlist(MediaList):
     """
     Playlist containing media files
 
+    Directories are interned and file names are packed into a single buffer so
+    large playlists take tens of bytes per entry. Entries are created on access.
+
     This list is not affected by removing files.
     Use PlaylistSpec.resolve() to re-resolve wildcards in those cases
     """
 
-    def __init__(self, entries: Iterable[Entry[Path]] = (), name=""):
-        super().__init__(entries, name)
+    def __init__(self, entries: Iterable[Entry[Path] | MediaEntry] = (), name=""):
+        self._nm = name
+        self._roots: List[str] = []
+        self._root_ix: Dict[str, int] = {}
+        # per entry: index to _roots and end offset of the name in _names
+        self._dirs = array("I")
+        self._ends = array("Q")
+        # NUL terminated file names
+        self._names = bytearray()
+        self.extend(entries)
+
+    @staticmethod
+    def from_paths(paths: Iterable[os.PathLike | str], name="") -> "Playlist":
+        out = Playlist(name=name)
+        for p in paths:
+            out.add(p)
+        return out
+
+    @property
+    def name(self):
+        return self._nm
+
+    def add(self, path: os.PathLike | str):
+        """
+        Append a media file
+        """
+        d, n = os.path.split(os.fspath(path))
+        i = self._root_ix.get(d)
+        if i is None:
+            i = self._root_ix[d] = len(self._roots)
+            self._roots.append(sys.intern(d))
+        self._dirs.append(i)
+        self._names += os.fsencode(n)
+        self._names.append(0)
+        self._ends.append(len(self._names))
+
+    def append(self, entry: Entry[Path] | MediaEntry):
+        self.add(entry.resource)
+
+    def extend(self, entries: Iterable[Entry[Path] | MediaEntry]):
+        for e in entries:
+            self.add(e.resource)
+
+    def __len__(self) -> int:
+        return len(self._dirs)
+
+    def _resource(self, i: int) -> Path:
+        start = self._ends[i - 1] if i else 0
+        name = self._names[start : self._ends[i] - 1].decode(_FS_ENC, _FS_ERRORS)
+        return Path(self._roots[self._dirs[i]], name)
+
+    @overload
+    def __getitem__(self, i: int) -> MediaEntry: ...
+
+    @overload
+    def __getitem__(self, i: slice) -> "Playlist": ...
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return Playlist.from_paths(
+                (self._resource(j) for j in range(*i.indices(len(self)))), self._nm
+            )
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("playlist index out of range")
+        return MediaEntry(self._resource(i))
+
+    def resources(self) -> Iterator[Path]:
+        return (self._resource(i) for i in range(len(self)))
+
+    def _find(self, path: os.PathLike) -> Iterator[int]:
+        d, n = os.path.split(os.fspath(path))
+        root = self._root_ix.get(d)
+        if root is None:
+            return
+        needle = os.fsencode(n) + b"\0"
+        off = self._names.find(needle)
+        while off >= 0:
+            # the match must be a whole name
+            if off == 0 or self._names[off - 1] == 0:
+                i = bisect.bisect_right(self._ends, off)
+                if self._dirs[i] == root:
+                    yield i
+            off = self._names.find(needle, off + 1)
+
+    def positions(self, path: os.PathLike) -> List[int]:
+        return list(self._find(path))
+
+    def index(self, entry: Entry[Path] | MediaEntry | os.PathLike, *_) -> int:
+        """
+        Position of a media file, raises ValueError if not found
+        """
+        path = entry.resource if isinstance(entry, (Entry, MediaEntry)) else entry
+        i = next(self._find(path), None)
+        if i is None:
+            raise ValueError(f"{path} is not in playlist")
+        return i
+
+    def __eq__(self, other):
+        if not isinstance(other, Playlist):
+            if isinstance(other, list):
+                return list(self) == other
+            return NotImplemented
+        if len(self) != len(other):
+            return False
+        if self._roots == other._roots:
+            return self._dirs == other._dirs and self._names == other._names
+        return all(a == b for a, b in zip(self.resources(), other.resources()))
+
+    __hash__ = None  # type: ignore
+
+    def __getstate__(self):
+        return self._nm, self._roots, self._dirs, self._ends, bytes(self._names)
+
+    def __setstate__(self, state):
+        self._nm, self._roots, self._dirs, self._ends, names = state
+        self._roots = [sys.intern(r) for r in self._roots]
+        self._root_ix = {r: i for i, r in enumerate(self._roots)}
+        self._names = bytearray(names)
+
+    def nbytes(self) -> int:
+        """
+        Approximate memory used by the storage
+        """
+        return (
+            sys.getsizeof(self._dirs)
+            + sys.getsizeof(self._ends)
+            + sys.getsizeof(self._names)
+            + sys.getsizeof(self._roots)
+            + sys.getsizeof(self._root_ix)
+        )
+
+    def __repr__(self) -> str:
+        return f"Playlist(name={self._nm})"
+
+    def __str__(self) -> str:
+        return (
+            f"Playlist(name={self._nm}, entries={[str(r) for r in self.resources()]})"
+        )
 
 
 class PlaylistSpec(_PlaylistImpl[str]):
@@ -89,7 +480,7 @@ class PlaylistSpec(_PlaylistImpl[str]):
                     out[-1].append(
                         Entry(
                             resource=m["url"],
-                            filters=_filters_from_dict(m.get("filters", {})),
+                            filters=filters.from_yaml(m.get("filters", {})),
                         )
                     )
             out[-1]._root = root
@@ -97,35 +488,64 @@ class PlaylistSpec(_PlaylistImpl[str]):
 
     @staticmethod
     def from_file(path: os.PathLike):
+        """
+        Load playlist specs from a YAML file
+
+        Raises ValueError if the file is not a playlist
+        """
         path = Path(path)
-        with open(path) as f:
-            return PlaylistSpec.from_yaml(yaml.safe_load_all(f), path.parent)
+        return PlaylistSpec.from_yaml(_read_docs(path), path.parent)
+
+    @property
+    def root(self) -> Path:
+        return self._root
+
+    async def walk_entry(self, e: Entry[str], stats: StatCache | None = None):
+        """
+        Walk the media files of a single entry
+
+        :param stats: Metadata cache shared within a scan
+        """
+        stats = stats if stats is not None else StatCache()
+        paths = url.resolve_async(e.resource, root=self._root, stats=stats)
+        if e.filters:
+            for r in await _apply_filters(e.filters, paths, stats):
+                yield r
+                await asyncio.sleep(0)
+            return
+        async for r in paths:
+            yield r
 
-    async def walk(self):
+    async def walk(self, stats: StatCache | None = None):
         """
         Walk the media files without resolving
 
         This does not store the results anywhere, just walks the wildcard paths
         """
+        stats = stats if stats is not None else StatCache()
         for e in self:
-            res = []
-            for f in url.resolve(e.resource, root=self._root):
-                await asyncio.sleep(0)
-                res.append(f)
-            for f in e.filters:
-                await asyncio.sleep(0)
-                res = f(res)
-            for r in res:
+            async for r in self.walk_entry(e, stats):
                 yield r
-                await asyncio.sleep(0)
 
-    async def resolve(self) -> Playlist:
+    async def resolve(
+        self, stats: StatCache | None = None, catalog: "Catalog | None" = None
+    ) -> "Playlist | CatalogPlaylist":
         """
         Resolve media paths
+
+        :param catalog: Store the results in the catalog instead of in memory
         """
+        if catalog is not None:
+            stats = stats if stats is not None else StatCache()
+            for i, e in enumerate(self):
+                paths = url.resolve_async(e.resource, root=self._root, stats=stats)
+                b, _ = url.base(e.resource, root=self._root)
+                await catalog.store_async(self.name, i, paths, stats, e.filters, b)
+            catalog.trim(self.name, len(self))
+            return catalog.playlist(self.name)
         out = Playlist(name=self.name)
-        async for e in self.walk():
-            out.append(Entry(resource=e))
+        async for e in self.walk(stats):
+            out.add(e)
         return out
 
     def resolve_sync(self) -> Playlist:
@@ -133,12 +553,62 @@ class PlaylistSpec(_PlaylistImpl[str]):
         Resolve media paths
         """
         out = Playlist(name=self.name)
+        stats = StatCache()
         for e in self:
-            res = []
-            for f in url.resolve(e.resource, root=self._root):
-                assert f.is_absolute()
-                res.append(f)
-            for f in e.filters:
-                res = f(res)
-            out.extend(Entry(resource=r) for r in res)
+            res = url.resolve(e.resource, root=self._root)
+            for r in filters.chain(e.filters, res, stats):
+                assert r.is_absolute()
+                out.add(r)
         return out
+
+
+class SpecCache:
+    """
+    Parsed playlist files keyed by path, modification time and size
+
+    Files that are not playlists are remembered too so they are not read again
+    on every rescan.
+    """
+
+    def __init__(self, path: Path | None = None):
+        self._path = path
+        self._entries: Dict[Path, Tuple[int, int, List[Dict[str, Any]] | None]] = {}
+        if path is not None:
+            self._entries = cache.load_pickle(path, {})
+        self._used: set[Path] = set()
+        self._dirty = False
+
+    def load(self, path: os.PathLike) -> List[PlaylistSpec]:
+        """
+        Same as PlaylistSpec.from_file() but reuses results for unchanged files
+        """
+        path = Path(path)
+        st = path.stat()
+        self._used.add(path)
+        hit = self._entries.get(path)
+        if hit is not None and hit[:2] == (st.st_mtime_ns, st.st_size):
+            docs = hit[2]
+        else:
+            try:
+                docs = _read_docs(path)
+            except ValueError:
+                docs = None
+            self._entries[path] = (st.st_mtime_ns, st.st_size, docs)
+            self._dirty = True
+        if docs is None:
+            raise ValueError(f"Not a playlist: {path}")
+        return PlaylistSpec.from_yaml(docs, path.parent)
+
+    def save(self):
+        """
+        Write the cache to disk dropping files not loaded since the last save
+        """
+        stale = self._entries.keys() - self._used
+        if stale:
+            self._dirty = True
+            for p in stale:
+                del self._entries[p]
+        self._used = set()
+        if self._path is not None and self._dirty:
+            cache.save_pickle(self._path, self._entries)
+        self._dirty = False
@@ -0,0 +1,204 @@
+"""
+Background media probing
+"""
+
+import asyncio
+import hashlib
+import logging
+import multiprocessing
+import os
+import sqlite3
+import threading
+import time
+
+from concurrent.futures import Executor, ProcessPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, Iterable, Set, Tuple
+
+_L = logging.getLogger(__name__)
+
+_FINGERPRINT_CHUNK = 64 * 1024
+_PARSE_TIMEOUT = 10.0
+
+# libvlc instance of a worker process
+_inst = None
+
+
+@dataclass(frozen=True)
+class Metadata:
+    # seconds, None if not known, e.g. for images
+    duration: float | None = None
+    width: int | None = None
+    height: int | None = None
+    codec: str | None = None
+    fingerprint: str = ""
+
+
+def fingerprint(path: os.PathLike | str) -> str:
+    """
+    Content fingerprint from the size and the first and last bytes of the file
+    """
+    h = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        h.update(size.to_bytes(8, "little"))
+        h.update(f.read(_FINGERPRINT_CHUNK))
+        if size > 2 * _FINGERPRINT_CHUNK:
+            f.seek(-_FINGERPRINT_CHUNK, os.SEEK_END)
+            h.update(f.read(_FINGERPRINT_CHUNK))
+    return h.hexdigest()
+
+
+def _probe(path: str) -> Metadata:
+    """
+    Probe a media file with libvlc, run in a worker process
+    """
+    import vlc
+
+    global _inst
+    if _inst is None:
+        _inst = vlc.Instance("--quiet")
+    media = _inst.media_new_path(path)
+    media.parse_with_options(vlc.MediaParseFlag.local, int(_PARSE_TIMEOUT * 1000))
+    deadline = time.monotonic() + _PARSE_TIMEOUT
+    while media.get_parsed_status() == 0 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    dur = media.get_duration()
+    width = height = codec = None
+    for t in media.tracks_get() or []:
+        if t.type == vlc.TrackType.video:
+            width, height = t.video.contents.width, t.video.contents.height
+            codec = vlc.libvlc_media_get_codec_description(t.type, t.codec)
+            if isinstance(codec, bytes):
+                codec = codec.decode(errors="replace")
+            break
+    media.release()
+    return Metadata(
+        duration=dur / 1000 if dur > 0 else None,
+        width=width,
+        height=height,
+        codec=codec,
+        fingerprint=fingerprint(path),
+    )
+
+
+class MetadataCache:
+    """
+    Media metadata stored in SQLite and keyed by path, size and mtime
+
+    Safe to use from multiple threads.
+    """
+
+    def __init__(self, path: os.PathLike | str = ":memory:"):
+        if path != ":memory:":
+            Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS metadata ("
+            "path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, "
+            "duration REAL, width INTEGER, height INTEGER, codec TEXT, "
+            "fingerprint TEXT)"
+        )
+
+    def close(self):
+        self._db.close()
+
+    def get(self, path: Path, st: os.stat_result) -> Metadata | None:
+        with self._lock:
+            row = self._db.execute(
+                "SELECT duration, width, height, codec, fingerprint FROM metadata "
+                "WHERE path = ? AND size = ? AND mtime_ns = ?",
+                (str(path), st.st_size, st.st_mtime_ns),
+            ).fetchone()
+        return Metadata(*row) if row is not None else None
+
+    def put(self, path: Path, st: os.stat_result, meta: Metadata):
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO metadata VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    str(path),
+                    st.st_size,
+                    st.st_mtime_ns,
+                    meta.duration,
+                    meta.width,
+                    meta.height,
+                    meta.codec,
+                    meta.fingerprint,
+                ),
+            )
+
+
+class Prober:
+    """
+    Probe media files in worker processes ahead of playback
+
+    Results go to the metadata cache so each file is probed only once.
+    """
+
+    def __init__(
+        self,
+        cache: MetadataCache,
+        workers: int = 2,
+        *,
+        probe: Callable[[str], Metadata] = _probe,
+        executor: Executor | None = None,
+    ):
+        self._cache = cache
+        self._probe = probe
+        self._pool = executor or ProcessPoolExecutor(
+            workers, mp_context=multiprocessing.get_context("spawn")
+        )
+        self._queue: asyncio.Queue[Path] = asyncio.Queue()
+        self._queued: Set[Path] = set()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(workers)]
+
+    def submit(self, paths: Iterable[Path]):
+        """
+        Queue files for probing, files already cached are skipped later
+        """
+        for p in paths:
+            if p not in self._queued:
+                self._queued.add(p)
+                self._queue.put_nowait(p)
+
+    async def join(self):
+        """
+        Wait until the queued files are probed
+        """
+        await self._queue.join()
+
+    def close(self):
+        for t in self._tasks:
+            t.cancel()
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+    def _cached(self, p: Path) -> Tuple[os.stat_result, Metadata | None]:
+        st = p.stat()
+        return st, self._cache.get(p, st)
+
+    async def _worker(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            p = await self._queue.get()
+            try:
+                # the stat and the database may block, e.g. on network shares
+                st, cached = await asyncio.to_thread(self._cached, p)
+                if cached is None:
+                    meta = await loop.run_in_executor(self._pool, self._probe, str(p))
+                    await asyncio.to_thread(self._cache.put, p, st, meta)
+                    _L.debug("probed %s: %s", p.name, meta)
+            except FileNotFoundError:
+                pass
+            except ImportError as e:
+                _L.warning("media probing not available: %s", e)
+                self.close()
+            except Exception as e:
+                _L.warning("probing %s failed: %s", p, e)
+            finally:
+                self._queued.discard(p)
+                self._queue.task_done()
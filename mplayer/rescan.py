@@ -0,0 +1,168 @@
+"""
+Scheduling of rescans
+"""
+
+import asyncio
+import collections
+import logging
+import os
+import stat
+import time
+
+from pathlib import Path
+from typing import (
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Deque,
+    Dict,
+    Iterable,
+    Mapping,
+    Set,
+)
+
+from . import metrics
+
+_L = logging.getLogger(__name__)
+
+
+class RescanScheduler:
+    """
+    Coalesce rescan requests
+
+    A rescan starts once no new requests arrived for debounce seconds, but at
+    the latest max_latency seconds after the first pending request. Requests
+    arriving during a rescan are followed by one more rescan.
+
+    :param scan: Performs the rescan
+    """
+
+    def __init__(
+        self,
+        scan: Callable[[], Awaitable[None]],
+        debounce: float = 1.0,
+        max_latency: float = 10.0,
+    ):
+        self._scan = scan
+        self._debounce = debounce
+        self._max_latency = max_latency
+        self._pending = 0
+        self._first = 0.0
+        self._last = 0.0
+        self._wake = asyncio.Event()
+        self._task: asyncio.Task | None = None
+        # number of requests merged into each of the recent rescans
+        self.merged: Deque[int] = collections.deque(maxlen=100)
+
+    def request(self, immediate: bool = False):
+        """
+        Request a rescan
+
+        :param immediate: Start without waiting for more requests
+        """
+        now = float("-inf") if immediate else time.monotonic()
+        if not self._pending or immediate:
+            self._first = now
+        self._pending += 1
+        self._last = now
+        self._wake.set()
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def join(self):
+        """
+        Wait until the pending rescans are done
+        """
+        while self._task is not None and not self._task.done():
+            await asyncio.shield(self._task)
+
+    def close(self):
+        if self._task is not None:
+            self._task.cancel()
+
+    def _deadline(self) -> float:
+        return min(self._last + self._debounce, self._first + self._max_latency)
+
+    async def _run(self):
+        while self._pending:
+            while (delay := self._deadline() - time.monotonic()) > 0:
+                self._wake.clear()
+                try:
+                    await asyncio.wait_for(self._wake.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+            n, self._pending = self._pending, 0
+            self.merged.append(n)
+            metrics.RESCANS.inc()
+            metrics.RESCAN_REQUESTS.inc(n)
+            _L.debug("rescanning, %s requests merged", n)
+            try:
+                await self._scan()
+            except Exception:
+                _L.exception("rescan failed")
+
+
+class Settler:
+    """
+    Hold back files that are still being written, e.g. partial uploads
+
+    Recently modified files are tracked until their size has not changed for
+    interval seconds.
+    """
+
+    def __init__(self, interval: float = 2.0):
+        self._interval = interval
+        self._sizes: Dict[Path, int] = {}
+        self._wake = asyncio.Event()
+
+    @property
+    def pending(self) -> Set[Path]:
+        return set(self._sizes)
+
+    def check(self, paths: Iterable[Path], stats: Mapping[Path, os.stat_result] = {}):
+        """
+        Start tracking the files modified within the interval
+
+        :param stats: Known metadata of the paths, the rest are stat'ed
+        """
+        now = time.time()
+        for p in paths:
+            st = stats.get(p)
+            if st is None:
+                try:
+                    st = os.stat(p)
+                except OSError:
+                    pass
+            if (
+                st is not None
+                and stat.S_ISREG(st.st_mode)
+                and now - st.st_mtime < self._interval
+            ):
+                if p not in self._sizes:
+                    self._sizes[p] = -1
+                    self._wake.set()
+            else:
+                self._sizes.pop(p, None)
+
+    async def settled(self) -> AsyncIterator[Set[Path]]:
+        """
+        Stream the files once they have settled
+        """
+        while True:
+            if not self._sizes:
+                self._wake.clear()
+                await self._wake.wait()
+            out = set()
+            for p, size in list(self._sizes.items()):
+                try:
+                    cur = os.stat(p).st_size
+                except OSError:
+                    cur = None
+                if cur is None or cur == size:
+                    del self._sizes[p]
+                    out.add(p)
+                else:
+                    self._sizes[p] = cur
+            if out:
+                yield out
+            await asyncio.sleep(self._interval)
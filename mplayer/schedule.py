@@ -1,13 +1,30 @@
 """
 Scheduling
+
+A schedule consists of one-off events and recurring rules. One-off events are
+kept sorted and looked up with bisect. Rules are never materialised, their
+occurrences are computed around the queried time so a schedule covering years
+costs the same to query as one with a few entries.
+
+Times are naive local times. Timezone-aware times are converted on input.
 """
 
+import bisect
+import heapq
+import itertools
 import os
 from dataclasses import dataclass
-from datetime import datetime, timedelta
-from typing import List, Iterable
+from datetime import date, datetime, time, timedelta
+from typing import Any, Dict, FrozenSet, Iterable, Iterator, List, Set, Tuple
 import yaml
 
+from . import util
+
+_DAYS = ["mon", "tue", "wed", "thu", "fri", "sat", "sun"]
+# Anchor of interval rules without a start, a Monday so weekly intervals align
+_EPOCH = datetime(2000, 1, 3)
+_TICK = timedelta(microseconds=1)
+
 
 @dataclass
 class Event:
@@ -18,62 +35,262 @@ class Event:
         return hash((self.when, self.playlist))
 
 
+@dataclass(frozen=True)
+class Rule:
+    """
+    Recurring event
+
+    Occurs either every interval counting from start, or at the given times of
+    day on the given weekdays (0 is Monday, None means every day). Occurrences
+    are limited to [start, until).
+    """
+
+    playlist: str
+    interval: timedelta | None = None
+    at: Tuple[time, ...] = ()
+    days: FrozenSet[int] | None = None
+    start: datetime | None = None
+    until: datetime | None = None
+
+    def __post_init__(self):
+        if (self.interval is None) == (not self.at):
+            raise ValueError("Rule needs either an interval or times of day")
+        if self.interval is not None and self.interval <= timedelta(0):
+            raise ValueError(f"Invalid interval: {self.interval}")
+        if self.days is not None and not self.days:
+            raise ValueError("Rule has no days")
+        if self.days is not None and self.interval is not None:
+            raise ValueError("Days are only supported with times of day")
+
+    def _days(self, d: date, step: int) -> Iterator[datetime]:
+        # A week covers all the weekdays
+        for i in range(8):
+            day = d + timedelta(days=i * step)
+            if self.days is None or day.weekday() in self.days:
+                times = [datetime.combine(day, t) for t in self.at]
+                yield from times if step > 0 else reversed(times)
+
+    def _prev(self, now: datetime) -> datetime | None:
+        if self.interval is not None:
+            anchor = self.start or _EPOCH
+            return anchor + ((now - anchor) // self.interval) * self.interval
+        return next((t for t in self._days(now.date(), -1) if t <= now), None)
+
+    def _next(self, now: datetime) -> datetime | None:
+        if self.interval is not None:
+            anchor = self.start or _EPOCH
+            return anchor + ((now - anchor) // self.interval + 1) * self.interval
+        return next((t for t in self._days(now.date(), 1) if t > now), None)
+
+    def last(self, now: datetime) -> Event | None:
+        """
+        Get the latest occurrence at or before now
+        """
+        if self.until is not None:
+            now = min(now, self.until - _TICK)
+        t = self._prev(now)
+        if t is None or (self.start is not None and t < self.start):
+            return None
+        return Event(when=t, playlist=self.playlist)
+
+    def first(self, now: datetime) -> Event | None:
+        """
+        Get the first occurrence after now
+        """
+        if self.start is not None:
+            now = max(now, self.start - _TICK)
+        t = self._next(now)
+        if t is None or (self.until is not None and t >= self.until):
+            return None
+        return Event(when=t, playlist=self.playlist)
+
+    def occurrences(self, now: datetime) -> Iterator[Event]:
+        """
+        Lazily expand the occurrences after now
+        """
+        e = self.first(now)
+        while e is not None:
+            yield e
+            e = self.first(e.when)
+
+    @staticmethod
+    def from_yaml(obj: Dict[str, Any], now: datetime | None = None) -> "Rule":
+        """
+        Parse a rule, e.g.
+
+            every: 2h
+            from: 2024-01-01 08:00
+            until: 2024-02-01 00:00
+            playlist: news
+
+        or
+
+            at: ["08:00", "12:30"]
+            days: mon-fri
+            playlist: morning
+        """
+        interval = None
+        if "every" in obj:
+            interval = util.parse_timedelta(str(obj["every"]))
+        at = obj.get("at", [])
+        if not isinstance(at, list):
+            at = [at]
+        days = obj.get("days")
+        return Rule(
+            playlist=obj["playlist"],
+            interval=interval,
+            at=tuple(sorted(_parse_time_of_day(t) for t in at)),
+            days=_parse_days(days) if days is not None else None,
+            start=_parse_time(obj["from"], now) if "from" in obj else None,
+            until=_parse_time(obj["until"], now) if "until" in obj else None,
+        )
+
+
+def _local(dt: datetime) -> datetime:
+    if dt.tzinfo is None:
+        return dt
+    return dt.astimezone().replace(tzinfo=None)
+
+
+def _parse_time(a: str | int | datetime, now: datetime | None) -> datetime:
+    if isinstance(a, datetime):
+        return _local(a)
+    if isinstance(a, str):
+        if a.startswith("now+"):
+            return _local(now or datetime.now()) + timedelta(seconds=int(a[4:]))
+        try:
+            return datetime.strptime(a, "%Y-%m-%d %H:%M")
+        except ValueError:
+            # e.g. with an UTC offset
+            return _local(datetime.fromisoformat(a))
+    if isinstance(a, int):
+        return datetime.fromtimestamp(a)
+    raise ValueError(f"Unsupported time format: {a}")
+
+
+def _parse_time_of_day(t: str | int) -> time:
+    if isinstance(t, int):
+        # YAML reads unquoted HH:MM as a base 60 integer
+        return time(t // 60, t % 60)
+    return time.fromisoformat(str(t))
+
+
+def _parse_day(d: str) -> int:
+    try:
+        return _DAYS.index(d.strip().lower()[:3])
+    except ValueError:
+        raise ValueError(f"Unknown day: {d}") from None
+
+
+def _parse_days(days: str | Iterable[str]) -> FrozenSet[int]:
+    if isinstance(days, str):
+        days = days.split(",")
+    out: Set[int] = set()
+    for d in days:
+        first, _, last = d.partition("-")
+        a = _parse_day(first)
+        b = _parse_day(last) if last else a
+        out.update(i % 7 for i in range(a, b + 1 if b >= a else b + 8))
+    return frozenset(out)
+
+
 class Schedule(List[Event]):
     """
     Contains instructions on changing behavior
 
+    The list holds the one-off events in chronological order and is not meant
+    to be modified after construction. Recurring rules are in rules.
     """
 
-    def __init__(self, events: Iterable[Event] | None = None):
+    def __init__(
+        self, events: Iterable[Event] | None = None, rules: Iterable[Rule] = ()
+    ):
         events = events or []
+        events = (
+            e if e.when.tzinfo is None else Event(_local(e.when), e.playlist)
+            for e in events
+        )
         events = sorted(events, key=lambda e: e.when)
         super().__init__(events)
+        self.rules = list(rules)
+        self._times = [e.when for e in self]
+
+    def __eq__(self, other):
+        if isinstance(other, Schedule) and self.rules != other.rules:
+            return False
+        return super().__eq__(other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    __hash__ = None  # type: ignore
 
     @staticmethod
-    def from_yaml(objs: list, now=datetime.now()):
+    def from_yaml(objs: list, now: datetime | None = None):
         events = []
+        rules = []
         for obj in objs:
-            a = obj["after"]
-            if isinstance(a, str):
-                if a.startswith("now+"):
-                    a = a[4:]
-                    a = now + timedelta(seconds=int(a))
-                else:
-                    a = datetime.strptime(a, "%Y-%m-%d %H:%M")
-            elif isinstance(a, int):
-                a = datetime.fromtimestamp(a)
+            if "after" in obj:
+                events.append(
+                    Event(when=_parse_time(obj["after"], now), playlist=obj["playlist"])
+                )
             else:
-                raise ValueError(f"Unsupported time format: {a}")
-            events.append(Event(when=a, playlist=obj["playlist"]))
-        return Schedule(events)
+                rules.append(Rule.from_yaml(obj, now))
+        return Schedule(events, rules)
 
     @staticmethod
     def from_file(path: os.PathLike):
         with open(path) as f:
             return Schedule.from_yaml(yaml.safe_load(f))
 
-    def current(self, now=datetime.now()) -> Event | None:
+    def playlists(self) -> Set[str]:
+        """
+        Names of all the playlists referred to
+        """
+        return {e.playlist for e in self} | {r.playlist for r in self.rules}
+
+    def current(self, now: datetime | None = None) -> Event | None:
         """
         Get the currently active event
         """
-        for e in reversed(self):
-            if e.when <= now:
-                return e
-        return None
+        now = _local(now) if now is not None else datetime.now()
+        i = bisect.bisect_right(self._times, now)
+        best = self[i - 1] if i else None
+        for r in self.rules:
+            e = r.last(now)
+            if e is not None and (best is None or e.when > best.when):
+                best = e
+        return best
 
     def next(self, now: datetime | None = None) -> Event | None:
         """
         Get the next event
         """
-        now = now or datetime.now()
-        for e in self:
-            if e.when > now:
-                print(e.when, now)
-                return e
-        return None
-
-    def non_expired(self, now=datetime.now()) -> "Schedule":
-        for i, e in enumerate(reversed(self)):
-            if e.when <= now:
-                return Schedule(self[len(self) - 1 - i :])
-        return Schedule()
+        now = _local(now) if now is not None else datetime.now()
+        i = bisect.bisect_right(self._times, now)
+        best = self[i] if i < len(self) else None
+        for r in self.rules:
+            e = r.first(now)
+            if e is not None and (best is None or e.when < best.when):
+                best = e
+        return best
+
+    def events(self, now: datetime | None = None) -> Iterator[Event]:
+        """
+        Lazily iterate the events after now in chronological order
+        """
+        now = _local(now) if now is not None else datetime.now()
+        i = bisect.bisect_right(self._times, now)
+        return heapq.merge(
+            itertools.islice(self, i, None),
+            *(r.occurrences(now) for r in self.rules),
+            key=lambda e: e.when,
+        )
+
+    def non_expired(self, now: datetime | None = None) -> "Schedule":
+        """
+        Drop the one-off events superseded before now
+        """
+        now = _local(now) if now is not None else datetime.now()
+        i = bisect.bisect_right(self._times, now)
+        return Schedule(self[max(i - 1, 0) :], self.rules)
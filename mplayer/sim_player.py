@@ -0,0 +1,141 @@
+"""
+Headless player for load tests and benchmarks
+"""
+
+import asyncio
+import logging
+import os
+
+from dataclasses import dataclass
+from datetime import timedelta
+from pathlib import Path
+from typing import Callable, List
+
+from .player import Player
+
+_L = logging.getLogger(__name__)
+
+
+class VirtualClock:
+    """
+    Clock for simulated playback
+
+    :param speed: Real seconds slept per virtual second. With 0 the clock
+                  advances instantly and only yields to the event loop.
+    """
+
+    def __init__(self, speed: float = 0.0):
+        self._t = 0.0
+        self._speed = speed
+
+    def now(self) -> float:
+        return self._t
+
+    async def sleep(self, seconds: float):
+        if self._speed <= 0:
+            await asyncio.sleep(0)
+            self._t += seconds
+            return
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        try:
+            await asyncio.sleep(seconds * self._speed)
+        except asyncio.CancelledError:
+            self._t += min(seconds, (loop.time() - start) / self._speed)
+            raise
+        self._t += seconds
+
+
+@dataclass
+class Played:
+    file: Path
+    start: float
+    end: float
+    # whether the media was staged or preloaded before it was played
+    staged: bool
+
+
+class SimPlayer(Player):
+    """
+    Player that does not decode anything
+
+    Each media is "played" for its duration on a virtual clock and the
+    timestamps are recorded in log.
+
+    :param duration: Duration of a media in seconds, None for unknown
+    :param default_duration: Used for media with unknown duration
+    """
+
+    can_pause = True
+
+    def __init__(
+        self,
+        clock: VirtualClock | None = None,
+        duration: Callable[[Path], float | None] = lambda _: None,
+        default_duration: timedelta = timedelta(seconds=10),
+    ):
+        super().__init__()
+        self.clock = clock or VirtualClock()
+        self.log: List[Played] = []
+        self._duration = duration
+        self._default = default_duration.total_seconds()
+        self._staged: Path | None = None
+        self._preloaded: Path | None = None
+        self._paused = asyncio.Event()
+        self._resumed = asyncio.Event()
+        self._resumed.set()
+
+    async def set_image_duration(self, duration: timedelta):
+        self._default = duration.total_seconds()
+
+    async def set_fullscreen(self, val: bool):
+        pass
+
+    async def set_paused(self, val: bool):
+        if val:
+            self._resumed.clear()
+            self._paused.set()
+        else:
+            self._paused.clear()
+            self._resumed.set()
+
+    async def _sleep(self, seconds: float):
+        """
+        Sleep on the virtual clock, which stops while paused
+        """
+        end = self.clock.now() + seconds
+        while (remaining := end - self.clock.now()) > 0:
+            await self._resumed.wait()
+            sleep = asyncio.create_task(self.clock.sleep(remaining))
+            pause = asyncio.create_task(self._paused.wait())
+            try:
+                await asyncio.wait([sleep, pause], return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                sleep.cancel()
+                pause.cancel()
+            await asyncio.wait([sleep])
+
+    async def stage(self, file: os.PathLike):
+        self._staged = Path(file)
+
+    async def preload(self, file: os.PathLike):
+        self._preloaded = Path(file)
+
+    async def play(self, file: os.PathLike):
+        file = Path(file)
+        if not file.exists():
+            raise FileNotFoundError(file)
+        staged = file in (self._staged, self._preloaded)
+        self._staged = None
+        if self._preloaded == file:
+            self._preloaded = None
+        dur = self._duration(file)
+        dur = dur if dur is not None else self._default
+        start = self.clock.now()
+        _L.debug("playing %s for %ss", file.name, dur)
+        if self.on_playing is not None:
+            self.on_playing(file)
+        try:
+            await self._sleep(dur)
+        finally:
+            self.log.append(Played(file, start, self.clock.now(), staged))
@@ -0,0 +1,56 @@
+"""
+Warm-start snapshots of the resolved library
+"""
+
+import hashlib
+import logging
+
+from pathlib import Path
+from typing import Iterable, List, Tuple
+
+from . import cache
+from .playlist import MediaList
+from .schedule import Schedule
+
+_L = logging.getLogger(__name__)
+
+_VERSION = 3
+
+
+def default_path(files: Iterable[Path], schedule: Path | None) -> Path:
+    """
+    Snapshot location for the given command line inputs
+    """
+    key = repr(([str(f) for f in files], str(schedule)))
+    digest = hashlib.sha256(key.encode()).hexdigest()[:16]
+    return cache.cache_dir() / f"snapshot-{digest}.pickle"
+
+
+def save(
+    path: Path,
+    files: List[Path],
+    playlists: Iterable[MediaList],
+    schedule: Schedule | None,
+):
+    """
+    Store the resolved playlists and schedule for the given input files
+    """
+    # playlists pickle in their packed form
+    data = (_VERSION, files, list(playlists), schedule)
+    cache.save_pickle(path, data)
+
+
+def load(
+    path: Path, files: List[Path]
+) -> Tuple[List[MediaList], Schedule | None] | None:
+    """
+    Load a snapshot
+
+    Returns None if there is no usable snapshot for the input files
+    """
+    data = cache.load_pickle(path)
+    if not isinstance(data, tuple) or data[0] != _VERSION or data[1] != files:
+        return None
+    _, _, playlists, schedule = data
+    _L.debug("loaded snapshot %s", path)
+    return playlists, schedule
@@ -0,0 +1,132 @@
+"""
+File metadata caching
+"""
+
+import os
+
+from pathlib import Path
+from typing import Dict, Iterable, List, Set, Tuple
+
+from .probe import Metadata, MetadataCache
+
+
+class Listed:
+    """
+    Directory entry kept in a ListingCache
+
+    Only the name and the type are kept. The mtime of the directory does not
+    change when its files are written so stat() is not cached.
+    """
+
+    __slots__ = ("name", "path", "_dir", "_link")
+
+    def __init__(self, entry: os.DirEntry):
+        self.name = entry.name
+        self.path = entry.path
+        try:
+            self._dir = entry.is_dir()
+            self._link = entry.is_symlink()
+        except OSError:
+            self._dir = self._link = False
+
+    def is_dir(self) -> bool:
+        return self._dir
+
+    def is_symlink(self) -> bool:
+        return self._link
+
+    def stat(self) -> os.stat_result:
+        return os.stat(self.path)
+
+
+class ListingCache:
+    """
+    Directory listings kept between scans
+
+    A listing is reused while the mtime of the directory stays the same. The
+    mtime changes when entries are added, removed or renamed.
+    """
+
+    def __init__(self):
+        self._dirs: Dict[str, Tuple[int, List[Listed]]] = {}
+
+    def __len__(self) -> int:
+        return len(self._dirs)
+
+    def get(self, d: str, mtime_ns: int) -> List[Listed] | None:
+        cached = self._dirs.get(d)
+        if cached is None or cached[0] != mtime_ns:
+            return None
+        return cached[1]
+
+    def put(self, d: str, mtime_ns: int | None, entries: List[Listed]):
+        """
+        Store a fresh listing, None as mtime_ns only drops the outdated one
+        """
+        if mtime_ns is None:
+            old = self._dirs.pop(d, None)
+        else:
+            old = self._dirs.get(d)
+            self._dirs[d] = (mtime_ns, entries)
+        if old is not None:
+            # subdirectories that are gone are not listed again
+            dirs = {e.path for e in entries if e.is_dir()}
+            for e in old[1]:
+                if e.is_dir() and e.path not in dirs:
+                    self.discard(e.path)
+
+    def discard(self, d: str):
+        """
+        Drop the listings of a directory and of the directories below it
+        """
+        self._dirs.pop(d, None)
+        prefix = d.rstrip(os.sep) + os.sep
+        for k in [k for k in self._dirs if k.startswith(prefix)]:
+            del self._dirs[k]
+
+    def invalidate(self, paths: Iterable[Path]):
+        """
+        Drop the listings of the paths and of their parent directories
+        """
+        for p in paths:
+            self._dirs.pop(str(p), None)
+            self._dirs.pop(str(p.parent), None)
+
+
+class StatCache(Dict[Path, os.stat_result]):
+    """
+    Per-scan cache of file metadata
+
+    Files are stat'ed on first use, e.g. by filters, so a scan of unchanged
+    directories does not stat every file. Probed media metadata is available
+    too if a metadata cache is given, and directory listings are reused
+    between scans if a listing cache is given.
+    """
+
+    def __init__(
+        self,
+        *args,
+        metadata: MetadataCache | None = None,
+        listings: ListingCache | None = None,
+    ):
+        super().__init__(*args)
+        self._meta = metadata
+        self.listings = listings
+        # files found in directories that were listed again, i.e. new or
+        # changed directories
+        self.relisted: Set[Path] = set()
+
+    def stat(self, path: Path) -> os.stat_result:
+        try:
+            return self[path]
+        except KeyError:
+            st = self[path] = path.stat()
+            return st
+
+    def metadata(self, path: Path) -> Metadata | None:
+        """
+        Probed metadata of the file, None if not probed yet
+        """
+        if self._meta is None:
+            return None
+        return self._meta.get(path, self.stat(path))
@@ -1,8 +1,22 @@
+import asyncio
+import fnmatch
 import glob
 import os
+import re
+import time
 
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
 from pathlib import Path
-from typing import Iterable
+from typing import AsyncIterator, Dict, FrozenSet, Iterable, Iterator, List, Set, Tuple
+
+from .statcache import Listed, ListingCache, StatCache
+
+_MAGIC = re.compile("[*?[]")
+_MAX_WORKERS = min(8, (os.cpu_count() or 1) + 4)
+_executor: ThreadPoolExecutor | None = None
+# Directories modified more recently are not cached
+_SETTLE_NS = 2_000_000_000
 
 
 def _resolve_abs(scheme: str, path: str):
@@ -24,6 +38,37 @@ def _resolve_rel(root: Path, scheme: str, path: str):
         raise ValueError(f"Unknown scheme: {scheme}")
 
 
+def _split(url: str):
+    try:
+        scheme, path = url.split("://")
+    except ValueError:
+        scheme, path = "file", url
+    return scheme, path
+
+
+def base(url: str, *, root: Path | None = None) -> tuple[Path, bool]:
+    """
+    Get the directory containing all the matches for the URL
+
+    Returns the directory and whether its subdirectories may contain matches.
+
+    :param url: URL in format <scheme>://<path>. Path can be relative only if root is set
+    :param root: Optional root path for the search
+    """
+    scheme, path = _split(url)
+    if scheme == "file":
+        return (root / path if root is not None else Path(path)).parent, False
+    if scheme != "glob":
+        raise ValueError(f"Unknown scheme: {scheme}")
+    if root is not None:
+        return root, True
+    parts = Path(path).parts
+    for i, part in enumerate(parts):
+        if _MAGIC.search(part):
+            return Path(*parts[:i]), True
+    return Path(path).parent, False
+
+
 def resolve(url: str, *, root: Path | None = None) -> Iterable[Path]:
     """
     Resolve media URLs
@@ -31,13 +76,265 @@ def resolve(url: str, *, root: Path | None = None) -> Iterable[Path]:
     :param url: URL in format <scheme>://<path>. Path can be relative only if root is set
     :param root: Optional root path for the search
     """
-    try:
-        scheme, path = url.split("://")
-    except ValueError:
-        scheme, path = "file", url
+    scheme, path = _split(url)
     if root is None:
         if not os.path.isabs(path):
             raise ValueError("Absolute path required without root")
         yield from _resolve_abs(scheme, path)
     else:
         yield from _resolve_rel(root, scheme, path)
+
+
+@dataclass(frozen=True)
+class _Pattern:
+    parts: Tuple[str, ...]
+    # glob.glob() skips hidden files unless explicitly matched, Path.rglob() does not
+    hidden: bool
+    # glob.glob() descends into symlinked directories, Path.rglob() does not
+    follow: bool
+
+    def expand(self, positions: Iterable[int]) -> Set[int]:
+        # "**" also matches zero directories
+        out = set()
+        for i in positions:
+            out.add(i)
+            while self.parts[i] == "**" and i + 1 < len(self.parts):
+                i += 1
+                out.add(i)
+        return out
+
+    def ends_in(self, i: int) -> bool:
+        # A trailing "**" matches the directory itself too
+        return self.parts[-1] == "**" and len(self.parts) - 1 in self.expand([i])
+
+    def match(self, part: str, name: str) -> bool:
+        if not _MAGIC.search(part):
+            return part == name
+        if not self.hidden and name.startswith(".") and not part.startswith("."):
+            return False
+        return fnmatch.fnmatchcase(name, part)
+
+
+def _scan(
+    d: str, positions: FrozenSet[int], pat: _Pattern, stats: StatCache | None
+) -> List[Tuple[Path, bool, FrozenSet[int]]]:
+    """
+    List a single directory and match its entries against the pattern
+
+    Returns the entries that match or are descended into, sorted by name, with
+    whether they match and the pattern positions active in them, empty if not
+    descended into. The matches are not stat'ed. Those in a directory that was
+    listed again are added to stats.relisted if stats is given.
+    """
+    positions = frozenset(pat.expand(positions))
+    last = len(pat.parts) - 1
+    out = []
+    try:
+        entries, fresh = _list(d, stats.listings if stats is not None else None)
+    except OSError:
+        return []
+    for entry in sorted(entries, key=lambda e: e.name):
+        matched = False
+        descend: Set[int] = set()
+        for i in positions:
+            part = pat.parts[i]
+            if part == "**":
+                if not pat.hidden and entry.name.startswith("."):
+                    continue
+                if i == last:
+                    matched = True
+                if _is_dir(entry, pat.follow):
+                    descend.add(i)
+                continue
+            if not pat.match(part, entry.name):
+                continue
+            if i == last:
+                matched = True
+            elif _is_dir(entry, True):
+                descend.add(i + 1)
+                matched = matched or pat.ends_in(i + 1)
+        if not matched and not descend:
+            continue
+        p = Path(entry.path)
+        if matched and fresh and stats is not None:
+            stats.relisted.add(p)
+        out.append((p, matched, frozenset(descend)))
+    return out
+
+
+def _entries(it) -> Iterator[os.DirEntry]:
+    with it:
+        yield from it
+
+
+def _list(
+    d: str, listings: ListingCache | None
+) -> Tuple[Iterable[os.DirEntry | Listed], bool]:
+    """
+    List a directory, reusing the cached listing if the directory is unchanged
+
+    Returns the entries and whether the directory was listed again.
+    """
+    if listings is None:
+        return _entries(os.scandir(d)), True
+    try:
+        mtime = os.stat(d).st_mtime_ns
+    except FileNotFoundError:
+        listings.discard(d)
+        raise
+    entries = listings.get(d, mtime)
+    if entries is not None:
+        return entries, False
+    with os.scandir(d) as it:
+        entries = [Listed(e) for e in it]
+    # a change within the mtime granularity would go unnoticed
+    settled = time.time_ns() - mtime > _SETTLE_NS
+    listings.put(d, mtime if settled else None, entries)
+    return entries, True
+
+
+def _is_dir(entry: os.DirEntry | Listed, follow: bool) -> bool:
+    try:
+        return entry.is_dir() and (follow or not entry.is_symlink())
+    except OSError:
+        return False
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(_MAX_WORKERS, thread_name_prefix="mplayer-scan")
+    return _executor
+
+
+async def _walk(
+    start: Path, pat: _Pattern, stats: StatCache | None
+) -> AsyncIterator[Path]:
+    """
+    Stream the matches depth-first with each directory sorted by name
+
+    Subdirectories are scanned in parallel as soon as they are found. Scans
+    that finish early are kept until their turn so the order is stable.
+    """
+    loop = asyncio.get_running_loop()
+    pool = _get_executor()
+    scans: Dict[str, asyncio.Future] = {}
+
+    def submit(d: str, positions: FrozenSet[int]) -> asyncio.Future:
+        fut = scans.get(d)
+        if fut is None:
+            fut = loop.run_in_executor(pool, _scan, d, positions, pat, stats)
+            fut.add_done_callback(expand)
+            scans[d] = fut
+        return fut
+
+    def expand(fut: asyncio.Future):
+        if fut.cancelled() or fut.exception() is not None:
+            return
+        for p, _, positions in fut.result():
+            if positions:
+                submit(str(p), positions)
+
+    async def emit(d: str, positions: FrozenSet[int]) -> AsyncIterator[Path]:
+        entries = await submit(d, positions)
+        del scans[d]
+        for p, matched, sub in entries:
+            if matched:
+                yield p
+            if sub:
+                async for m in emit(str(p), sub):
+                    yield m
+
+    try:
+        async for p in emit(str(start), frozenset({0})):
+            yield p
+    finally:
+        for fut in scans.values():
+            fut.cancel()
+
+
+def _compile(url: str, root: Path | None) -> Tuple[Path, _Pattern | None]:
+    """
+    Get the directory to walk from and the pattern below it, no pattern for
+    URLs naming a single file
+    """
+    scheme, path = _split(url)
+    if scheme not in ("file", "glob"):
+        raise ValueError(f"Unknown scheme: {scheme}")
+    if root is None and not os.path.isabs(path):
+        raise ValueError("Absolute path required without root")
+    if scheme == "file":
+        return (root / path if root is not None else Path(path)), None
+    if root is not None:
+        return root, _Pattern(("**",) + Path(path).parts, hidden=True, follow=False)
+    parts = Path(path).parts
+    i = next((i for i, p in enumerate(parts) if _MAGIC.search(p)), len(parts))
+    if i == len(parts):
+        return Path(path), None
+    return Path(*parts[:i]), _Pattern(parts[i:], hidden=False, follow=True)
+
+
+async def resolve_async(
+    url: str, *, root: Path | None = None, stats: StatCache | None = None
+) -> AsyncIterator[Path]:
+    """
+    Resolve media URLs without blocking the event loop
+
+    Same as resolve() but directories are listed in a bounded thread pool, one
+    directory per task, and the matches are streamed depth-first with each
+    directory sorted by name.
+
+    :param url: URL in format <scheme>://<path>. Path can be relative only if root is set
+    :param root: Optional root path for the search
+    :param stats: Optional cache of the scan, see _scan()
+    """
+    start, pat = _compile(url, root)
+    if pat is None:
+        if _split(url)[0] == "file" or os.path.lexists(start):
+            yield start
+        return
+    if pat.ends_in(0):
+        yield start
+    async for p in _walk(start, pat, stats):
+        yield p
+
+
+def matches(url: str, path: Path, *, root: Path | None = None) -> bool:
+    """
+    Check if resolve_async() yields the path when it exists
+
+    Symlinked directories are assumed to be followed. Used to apply file system
+    events without walking the directories again.
+    """
+    start, pat = _compile(url, root)
+    if pat is None:
+        return path == start
+    if path == start:
+        return pat.ends_in(0)
+    if not path.is_relative_to(start):
+        return False
+    names = path.relative_to(start).parts
+    last = len(pat.parts) - 1
+    positions = frozenset({0})
+    for n, name in enumerate(names):
+        matched = False
+        nxt: Set[int] = set()
+        for i in pat.expand(positions):
+            part = pat.parts[i]
+            if part == "**":
+                if not pat.hidden and name.startswith("."):
+                    continue
+                matched = matched or i == last
+                nxt.add(i)
+            elif pat.match(part, name):
+                if i == last:
+                    matched = True
+                else:
+                    nxt.add(i + 1)
+                    matched = matched or pat.ends_in(i + 1)
+        if n == len(names) - 1:
+            return matched
+        if not nxt:
+            return False
+        positions = frozenset(nxt)
+    return False
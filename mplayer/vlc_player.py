@@ -1,18 +1,48 @@
 import os
 import asyncio
+import contextlib
 import logging
+import threading
+import time
 
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
 from datetime import timedelta
+from pathlib import Path
 
 import vlc
 
+from . import metrics
 from .player import Player
 from .persist import persist
 
 _L = logging.getLogger(__name__)
 
+# Target for the time between the end of a media and the first frame of the next
+_GAP_TARGET = 0.05
+
+
+@dataclass
+class _Prepared:
+    file: Path
+    media: vlc.Media
+    # keeps the persisted file alive
+    stack: contextlib.AsyncExitStack
+
 
 class VlcPlayer(Player):
+    """
+    Player backed by libvlc
+
+    The next media can be staged while the current one plays. Staged media
+    is persisted and pre-parsed ahead of time and started directly from the
+    end-of-media event, without a round trip through the event loop.
+    Preloaded media is prepared the same way but only used once it is played.
+    The demuxer and decoders are only opened at the switch, so their start-up
+    is still part of the measured gap.
+    """
+
+    can_pause = True
 
     def __init__(self):
         # args = ["--no-xlib"]
@@ -22,11 +52,32 @@ class VlcPlayer(Player):
         self._inst = vlc.Instance(*args)
         self._player = self._inst.media_player_new()
         self._loop = asyncio.get_running_loop()
-        self._player.event_manager().event_attach(
+        em = self._player.event_manager()
+        em.event_attach(
             vlc.EventType.MediaPlayerEndReached, lambda _: self._play_done()
         )
+        em.event_attach(vlc.EventType.MediaPlayerVout, lambda _: self._first_frame())
+        em.event_attach(vlc.EventType.MediaPlayerPlaying, lambda _: self._playing())
+        em.event_attach(
+            vlc.EventType.MediaPlayerEncounteredError, lambda _: self._error()
+        )
         self._sem = asyncio.Semaphore(0)
         self._img_dur = None
+        # libvlc must not be called from its own event callbacks
+        self._switcher = ThreadPoolExecutor(1, thread_name_prefix="mplayer-switch")
+        self._lock = threading.Lock()
+        self._staged: _Prepared | None = None
+        # handed over to follow the media that ended, started by _advance()
+        self._advanced: _Prepared | None = None
+        # media given to libvlc most recently, guarded by _lock
+        self._active: _Prepared | None = None
+        self._preloaded: _Prepared | None = None
+        self._ended_at: float | None = None
+        # when libvlc was last told to play, for the time to the first frame
+        self._started_at: float | None = None
+        # media given to libvlc most recently
+        self._current: Path | None = None
+        self.last_gap: float | None = None
 
     async def set_image_duration(self, duration: timedelta):
         _L.debug("image duration set: %s", self._img_dur)
@@ -35,25 +86,122 @@ class VlcPlayer(Player):
     async def set_fullscreen(self, val: bool):
         self._player.set_fullscreen(val)
 
-    async def play(self, file: os.PathLike):
+    async def set_paused(self, val: bool):
+        self._player.set_pause(1 if val else 0)
+
+    def position(self) -> float | None:
+        # -1 until a media has started, which also shows a stall
+        return self._player.get_time() / 1000
+
+    async def _prepare(self, file: os.PathLike) -> _Prepared:
+        stack = contextlib.AsyncExitStack()
         # Open so the file is not deleted by accident
-        with persist(file) as tmp:
-            _L.debug("playing %s", tmp.name)
-            media = self._inst.media_new(tmp)
-            if self._img_dur is not None:
-                media.add_option(f"image-duration={self._img_dur.total_seconds()}")
-
-            # This would be nice info but parsing takes like 0.2 sec on my laptop
-            # so not worth it
-            # media.parse()
-            # _L.debug("media duration: %ss", media.get_duration() / 1000)
-            self._player.set_media(media)
-            self._player.play()
+        tmp = await stack.enter_async_context(persist(file))
+        media = self._inst.media_new(tmp)
+        if self._img_dur is not None:
+            media.add_option(f"image-duration={self._img_dur.total_seconds()}")
+        return _Prepared(Path(file), media, stack)
+
+    async def _parsed(self, file: os.PathLike) -> _Prepared:
+        prep = await self._prepare(file)
+        # Probe the container in libvlc's preparser thread so opening is cheap
+        prep.media.parse_with_options(vlc.MediaParseFlag.local, 0)
+        return prep
+
+    async def stage(self, file: os.PathLike):
+        prep = await self._parsed(file)
+        with self._lock:
+            old, self._staged = self._staged, prep
+        if old is not None:
+            await old.stack.aclose()
+
+    async def preload(self, file: os.PathLike):
+        prep = await self._parsed(file)
+        with self._lock:
+            old, self._preloaded = self._preloaded, prep
+        if old is not None:
+            await old.stack.aclose()
+
+    async def play(self, file: os.PathLike):
+        file = Path(file)
+        with self._lock:
+            cur, self._advanced = self._advanced, None
+            started = cur is not None and cur is self._active
+            if cur is not None:
+                # a late _advance() must not start it again
+                self._active = cur
+            else:
+                cur, self._staged = self._staged, None
+            pre = None
+            if self._preloaded is not None and self._preloaded.file == file:
+                pre, self._preloaded = self._preloaded, None
+        if cur is not None and cur.file != file:
+            # Something else than the staged media is wanted
+            await cur.stack.aclose()
+            cur, started = None, False
+        if cur is None:
+            cur = pre or await self._prepare(file)
+        elif pre is not None:
+            await pre.stack.aclose()
+        async with cur.stack:
+            _L.debug("playing %s", file.name)
+            if not started:
+                with self._lock:
+                    self._active = cur
+                self._current = cur.file
+                self._started_at = time.perf_counter()
+                self._player.set_media(cur.media)
+                self._player.play()
             try:
                 await self._sem.acquire()
             except asyncio.CancelledError:
                 self._player.stop()
                 raise
 
+    def _advance(self, ended: _Prepared | None, nxt: _Prepared):
+        with self._lock:
+            if self._active is not ended:
+                # play() already started something
+                return
+            self._active = nxt
+        self._current = nxt.file
+        self._started_at = time.perf_counter()
+        self._player.set_media(nxt.media)
+        self._player.play()
+
     def _play_done(self):
+        self._ended_at = time.perf_counter()
+        # Hand the staged media over now, stage() may replace it before the
+        # switcher runs
+        with self._lock:
+            ended = self._active
+            nxt, self._staged = self._staged, None
+            self._advanced = nxt
+        if nxt is not None:
+            self._switcher.submit(self._advance, ended, nxt)
         self._loop.call_soon_threadsafe(self._sem.release)
+
+    def _first_frame(self):
+        now = time.perf_counter()
+        if self._started_at is not None:
+            metrics.FIRST_FRAME_SECONDS.observe(now - self._started_at)
+            self._started_at = None
+        if self._ended_at is None:
+            return
+        self.last_gap = now - self._ended_at
+        self._ended_at = None
+        metrics.GAP_SECONDS.observe(self.last_gap)
+        _L.debug(
+            "transition gap %.1f ms (target %.0f ms)",
+            self.last_gap * 1000,
+            _GAP_TARGET * 1000,
+        )
+
+    def _playing(self):
+        if self.on_playing is not None and self._current is not None:
+            self.on_playing(self._current)
+
+    def _error(self):
+        _L.warning("libvlc failed to play %s", self._current)
+        if self.on_error is not None and self._current is not None:
+            self.on_error(self._current, "libvlc playback error")
@@ -0,0 +1,395 @@
+"""
+Player running in a worker process
+
+The worker hosts a backend player, normally libvlc, so decoder hangs, GIL
+contention from its callbacks or crashes do not stall the main process.
+
+The processes talk over the stdin and stdout of the worker with the framing
+of the control API. Requests are {"id": int, "op": str, "args": {...}} and
+answered with {"id": int, "result": ...} or {"id": int, "error": str,
+"type": str}. {"op": "cancel", "args": {"id": int}} cancels a request. The
+worker sends {"event": {"kind": str, ...}} messages for the player hooks and
+a heartbeat with the playback position. Updates of the metrics recorded in
+the worker are sent as events too.
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import signal
+import sys
+import time
+
+from datetime import timedelta
+from pathlib import Path
+from typing import Any, Dict, Set
+
+from . import metrics
+from .api import read_frame, write_frame
+from .player import Player
+
+_L = logging.getLogger(__name__)
+
+# Delay before restarting a worker after the first consecutive death, doubled
+# for each further one
+_BACKOFF = 0.5
+_MAX_BACKOFF = 30.0
+# Workers dying before their first heartbeat, e.g. without libvlc, before
+# giving up
+_MAX_START_FAILURES = 5
+
+
+class WorkerError(Exception):
+    """
+    The request failed in the worker or the worker died
+    """
+
+
+class WorkerPlayer(Player):
+    """
+    Player forwarding to a backend in a worker process
+
+    The worker is started on the first request. A watchdog kills it when the
+    heartbeat stops or the playback position has not advanced for timeout
+    seconds. The media being played is then reported through on_error and
+    skipped, and the next request starts a new worker. Restarts back off
+    exponentially, and play() raises WorkerError once workers repeatedly die
+    before they are up.
+
+    :param backend: "vlc" or "sim"
+    :param timeout: Seconds without progress before the worker is restarted
+    :param heartbeat: Seconds between heartbeats of the worker
+    """
+
+    can_pause = True
+
+    def __init__(self, backend: str = "vlc", timeout=10.0, heartbeat=0.5):
+        super().__init__()
+        self._backend = backend
+        self._timeout = timeout
+        self._heartbeat = heartbeat
+        self._proc: asyncio.subprocess.Process | None = None
+        self._starting = asyncio.Lock()
+        self._pending: Dict[int, asyncio.Future] = {}
+        self._next_id = 0
+        # replayed to restarted workers
+        self._settings: Dict[str, Dict[str, Any]] = {}
+        self._last_beat = 0.0
+        self._position: float | None = None
+        self._moved_at = 0.0
+        self._current: Path | None = None
+        self._paused = False
+        self._kill_reason: str | None = None
+        self._closed = False
+        self._tasks: Set[asyncio.Task] = set()
+        # consecutive deaths since the last media played, for the backoff
+        self._deaths = 0
+        # consecutive workers that died before their first heartbeat
+        self._start_failures = 0
+
+    @property
+    def pid(self) -> int | None:
+        return self._proc.pid if self._proc is not None else None
+
+    async def set_image_duration(self, duration: timedelta):
+        await self._setting("set_image_duration", seconds=duration.total_seconds())
+
+    async def set_fullscreen(self, val: bool):
+        await self._setting("set_fullscreen", val=val)
+
+    async def set_paused(self, val: bool):
+        await self._setting("set_paused", val=val)
+        self._paused = val
+        self._moved_at = time.monotonic()
+
+    async def stage(self, file: os.PathLike):
+        try:
+            await self._call("stage", file=str(file))
+        except WorkerError as e:
+            _L.debug("staging %s failed: %s", file, e)
+
+    async def preload(self, file: os.PathLike):
+        try:
+            await self._call("preload", file=str(file))
+        except WorkerError as e:
+            _L.debug("preloading %s failed: %s", file, e)
+
+    async def play(self, file: os.PathLike):
+        file = Path(file)
+        self._current = file
+        self._moved_at = time.monotonic()
+        try:
+            await self._call("play", file=str(file))
+            self._deaths = 0
+        except WorkerError as e:
+            if self._start_failures >= _MAX_START_FAILURES:
+                raise
+            _L.warning("skipping %s: %s", file, e)
+            if self.on_error is not None:
+                self.on_error(file, str(e))
+        finally:
+            self._current = None
+
+    async def close(self):
+        self._closed = True
+        if self._proc is not None:
+            self._proc.kill()
+            await self._proc.wait()
+
+    async def _setting(self, op: str, **args):
+        self._settings[op] = args
+        await self._call(op, **args)
+
+    async def _call(self, op: str, **args) -> Any:
+        proc = await self._start()
+        assert proc.stdin is not None
+        rid = self._next_id
+        self._next_id += 1
+        fut = asyncio.get_running_loop().create_future()
+        self._pending[rid] = fut
+        try:
+            write_frame(proc.stdin, {"id": rid, "op": op, "args": args})
+            await proc.stdin.drain()
+            res = await fut
+        except ConnectionError as e:
+            raise WorkerError(f"player worker died: {e}") from e
+        except asyncio.CancelledError:
+            if not proc.stdin.is_closing():
+                write_frame(proc.stdin, {"op": "cancel", "args": {"id": rid}})
+            raise
+        finally:
+            self._pending.pop(rid, None)
+        if "error" in res:
+            if res.get("type") == "FileNotFoundError":
+                raise FileNotFoundError(res["error"])
+            raise WorkerError(res["error"])
+        return res.get("result")
+
+    async def _start(self) -> asyncio.subprocess.Process:
+        async with self._starting:
+            if self._proc is not None:
+                return self._proc
+            if self._start_failures >= _MAX_START_FAILURES:
+                raise WorkerError(
+                    f"player worker failed to start {self._start_failures} times"
+                )
+            if self._deaths:
+                delay = min(_BACKOFF * 2 ** (self._deaths - 1), _MAX_BACKOFF)
+                _L.debug("restarting the player worker in %.1f s", delay)
+                await asyncio.sleep(delay)
+            proc = await asyncio.create_subprocess_exec(
+                sys.executable,
+                "-m",
+                __name__,
+                "--backend",
+                self._backend,
+                "--heartbeat",
+                str(self._heartbeat),
+                "--loglevel",
+                str(logging.getLogger().getEffectiveLevel()),
+                stdin=asyncio.subprocess.PIPE,
+                stdout=asyncio.subprocess.PIPE,
+                env=_worker_env(),
+            )
+            _L.debug("started player worker %s", proc.pid)
+            assert proc.stdin is not None
+            self._proc = proc
+            self._kill_reason = None
+            self._last_beat = self._moved_at = time.monotonic()
+            self._position = None
+            for op, args in self._settings.items():
+                write_frame(proc.stdin, {"id": None, "op": op, "args": args})
+            self._spawn(self._read(proc))
+            self._spawn(self._watch(proc))
+            return proc
+
+    def _spawn(self, coro):
+        t = asyncio.create_task(coro)
+        self._tasks.add(t)
+        t.add_done_callback(self._tasks.discard)
+
+    async def _read(self, proc: asyncio.subprocess.Process):
+        assert proc.stdout is not None
+        up = False
+        try:
+            while (msg := await read_frame(proc.stdout)) is not None:
+                if "event" in msg:
+                    if not up and msg["event"].get("kind") == "beat":
+                        up = True
+                        self._start_failures = 0
+                    self._event(msg["event"])
+                    continue
+                rid = msg.get("id")
+                fut = self._pending.get(rid) if rid is not None else None
+                if fut is not None and not fut.done():
+                    fut.set_result(msg)
+        except (ValueError, asyncio.IncompleteReadError) as e:
+            _L.warning("bad message from player worker: %s", e)
+            proc.kill()
+        finally:
+            code = await proc.wait()
+            reason = self._kill_reason or f"player worker exited with {code}"
+            if self._proc is proc:
+                self._proc = None
+            if not self._closed:
+                metrics.WORKER_RESTARTS.inc()
+                self._deaths += 1
+                if not up:
+                    self._start_failures += 1
+            for fut in self._pending.values():
+                if not fut.done():
+                    fut.set_exception(WorkerError(reason))
+
+    def _event(self, ev: Dict[str, Any]):
+        kind = ev.get("kind")
+        if kind == "beat":
+            self._last_beat = time.monotonic()
+            if ev.get("position") != self._position:
+                self._position = ev.get("position")
+                self._moved_at = self._last_beat
+        elif kind == "playing" and self.on_playing is not None:
+            self.on_playing(Path(ev["file"]))
+        elif kind == "error" and self.on_error is not None:
+            self.on_error(Path(ev["file"]), ev["message"])
+        elif kind == "metric":
+            metrics.REGISTRY.record(ev["name"], ev["value"])
+
+    async def _watch(self, proc: asyncio.subprocess.Process):
+        while proc.returncode is None:
+            await asyncio.sleep(self._heartbeat)
+            now = time.monotonic()
+            if now - self._last_beat > self._timeout:
+                reason = "player worker not responding"
+            elif (
+                self._current is not None
+                and self._position is not None
+                and not self._paused
+                and now - self._moved_at > self._timeout
+            ):
+                reason = f"playback of {self._current.name} stalled"
+            else:
+                continue
+            _L.warning("%s, restarting the player worker", reason)
+            self._kill_reason = reason
+            proc.kill()
+            return
+
+
+def _worker_env() -> Dict[str, str]:
+    # the package is not necessarily installed, e.g. when run from a checkout
+    root = str(Path(__file__).resolve().parent.parent)
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [root, env.get("PYTHONPATH")]))
+    return env
+
+
+def _make_backend(name: str) -> Player:
+    if name == "sim":
+        from .sim_player import SimPlayer
+
+        return SimPlayer()
+    from .vlc_player import VlcPlayer
+
+    return VlcPlayer()
+
+
+async def _pipe_writer(fd: int) -> asyncio.StreamWriter:
+    loop = asyncio.get_running_loop()
+    transport, proto = await loop.connect_write_pipe(
+        asyncio.streams.FlowControlMixin, os.fdopen(fd, "wb")
+    )
+    return asyncio.StreamWriter(transport, proto, None, loop)
+
+
+async def _serve(backend: str, heartbeat: float, out: int):
+    loop = asyncio.get_running_loop()
+    r = asyncio.StreamReader()
+    await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(r), sys.stdin)
+    w = await _pipe_writer(out)
+    player = _make_backend(backend)
+
+    def send(msg: Dict[str, Any]):
+        if not w.is_closing():
+            write_frame(w, msg)
+
+    def send_threadsafe(msg: Dict[str, Any]):
+        # the hooks may be called from the threads of the backend
+        loop.call_soon_threadsafe(send, msg)
+
+    player.on_playing = lambda f: send_threadsafe(
+        {"event": {"kind": "playing", "file": str(f)}}
+    )
+    player.on_error = lambda f, err: send_threadsafe(
+        {"event": {"kind": "error", "file": str(f), "message": err}}
+    )
+    # the stats of the main process include the metrics of the backend
+    metrics.REGISTRY.forward(
+        lambda name, v: send_threadsafe(
+            {"event": {"kind": "metric", "name": name, "value": v}}
+        )
+    )
+
+    ops = {
+        "play": lambda file: player.play(Path(file)),
+        "stage": lambda file: player.stage(Path(file)),
+        "preload": lambda file: player.preload(Path(file)),
+        "set_image_duration": lambda seconds: player.set_image_duration(
+            timedelta(seconds=seconds)
+        ),
+        "set_fullscreen": player.set_fullscreen,
+        "set_paused": player.set_paused,
+    }
+
+    async def handle(req: Dict[str, Any]):
+        rid = req.get("id")
+        try:
+            res = {"id": rid, "result": await ops[req["op"]](**req["args"])}
+        except asyncio.CancelledError:
+            res = {"id": rid, "error": "cancelled", "type": "CancelledError"}
+        except Exception as e:
+            _L.debug("request %s failed", req, exc_info=True)
+            res = {"id": rid, "error": str(e), "type": type(e).__name__}
+        send(res)
+
+    async def beat():
+        while True:
+            send({"event": {"kind": "beat", "position": player.position()}})
+            await w.drain()
+            await asyncio.sleep(heartbeat)
+
+    tasks: Dict[Any, asyncio.Task] = {}
+    beating = asyncio.create_task(beat())
+    try:
+        while (req := await read_frame(r)) is not None:
+            if req.get("op") == "cancel":
+                t = tasks.get(req["args"]["id"])
+                if t is not None:
+                    t.cancel()
+                continue
+            rid = req.get("id")
+            t = tasks[rid] = asyncio.create_task(handle(req))
+            t.add_done_callback(lambda _, rid=rid: tasks.pop(rid, None))
+    finally:
+        beating.cancel()
+        for t in tasks.values():
+            t.cancel()
+
+
+def main():
+    p = argparse.ArgumentParser(description="Player worker process")
+    p.add_argument("--backend", choices=["vlc", "sim"], default="vlc")
+    p.add_argument("--heartbeat", type=float, default=0.5)
+    p.add_argument("--loglevel", type=int, default=logging.WARNING)
+    ns = p.parse_args()
+    # The backend may print to stdout so keep it for the protocol only
+    out = os.dup(1)
+    os.dup2(2, 1)
+    logging.basicConfig(level=ns.loglevel, format="[%(levelname)s] worker: %(message)s")
+    # the main process handles interrupts and closes the pipe
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    asyncio.run(_serve(ns.backend, ns.heartbeat, out))
+
+
+if __name__ == "__main__":
+    main()
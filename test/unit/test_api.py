@@ -0,0 +1,89 @@
+import asyncio
+
+import pytest
+
+from mplayer.api import ApiError, Client, Server
+
+
+def _serve(sock, run):
+    async def main():
+        srv = Server(sock)
+        await srv.run()
+        c = Client(sock)
+        try:
+            return await run(srv, c)
+        finally:
+            await c.close()
+            srv.close()
+
+    return asyncio.run(asyncio.wait_for(main(), 5))
+
+
+def test_pipelined(tmp_path):
+    async def run(srv, c):
+        async def sleep(secs: float, tag: str):
+            await asyncio.sleep(secs)
+            return tag
+
+        srv.route("sleep", sleep)
+        slow = asyncio.create_task(c.call("sleep", secs=0.2, tag="slow"))
+        fast = [c.call("sleep", secs=0, tag=str(i)) for i in range(100)]
+        res = await asyncio.gather(*fast)
+        # the fast requests were not held up by the slow one
+        assert not slow.done()
+        return res, await slow
+
+    res, slow = _serve(tmp_path / "s.sock", run)
+    assert res == [str(i) for i in range(100)]
+    assert slow == "slow"
+
+
+def test_errors(tmp_path):
+    async def run(srv, c):
+        async def fail():
+            raise RuntimeError("broken")
+
+        srv.route("fail", fail)
+        with pytest.raises(ApiError, match="broken"):
+            await c.call("fail")
+        with pytest.raises(ApiError, match="Unknown operation"):
+            await c.call("nope")
+        # the connection is still usable
+        await c.ping()
+
+    _serve(tmp_path / "s.sock", run)
+
+
+def test_on_scan(tmp_path):
+    async def run(srv, c):
+        calls = []
+
+        async def scan():
+            calls.append(1)
+
+        srv.on_scan(scan)
+        await c.scan()
+        await c.scan()
+        return calls
+
+    assert _serve(tmp_path / "s.sock", run) == [1, 1]
+
+
+def test_subscribe(tmp_path):
+    async def run(srv, c):
+        events = c.subscribe(maxsize=2)
+        # the subscription is made by the first request
+        first = asyncio.ensure_future(anext(events))
+        while not srv.events._subs:
+            await asyncio.sleep(0.01)
+        for i in range(5):
+            srv.events.publish("tick", n=i)
+        got = [await first, await anext(events), await anext(events)]
+        await events.aclose()
+        while srv.events._subs:
+            await asyncio.sleep(0.01)
+        return got
+
+    got = _serve(tmp_path / "s.sock", run)
+    assert got[0] == {"event": "dropped", "count": 3}
+    assert [(e["event"], e["n"]) for e in got[1:]] == [("tick", 3), ("tick", 4)]
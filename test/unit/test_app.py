@@ -0,0 +1,143 @@
+import asyncio
+
+from datetime import timedelta
+
+from mplayer.app import App
+from mplayer.core import make_core
+from mplayer.events import EventBus
+from mplayer.sim_player import SimPlayer, VirtualClock
+
+
+def test_play(tmp_path):
+    files = [tmp_path / f"{i}.png" for i in range(3)]
+    for f in files:
+        f.touch()
+
+    async def run():
+        core = await make_core(files, None)
+        player = SimPlayer(
+            VirtualClock(speed=0.001),
+            duration=lambda p: 2.0 if p.name == "1.png" else None,
+        )
+        app = App(core, player)
+        await app.set_image_duration(timedelta(seconds=5))
+        await app.play()
+        return player
+
+    player = asyncio.run(run())
+    assert [p.file for p in player.log] == files
+    assert [(p.start, p.end) for p in player.log] == [(0, 5), (5, 7), (7, 12)]
+    assert [p.staged for p in player.log] == [False, True, True]
+
+
+def test_repeat_throughput(tmp_path):
+    files = [tmp_path / f"{i}.png" for i in range(10)]
+    for f in files:
+        f.touch()
+
+    async def run():
+        core = await make_core(files, None)
+        player = SimPlayer()
+        app = App(core, player)
+        await app.set_repeat(True)
+        task = asyncio.create_task(app.play())
+        while len(player.log) < 1000:
+            await asyncio.sleep(0.01)
+        task.cancel()
+        return player
+
+    player = asyncio.run(asyncio.wait_for(run(), 10))
+    assert [p.file for p in player.log[:20]] == files * 2
+
+
+def _scheduled(tmp_path, after: str):
+    for name in "ab":
+        for i in range(3):
+            (tmp_path / f"{name}{i}.mp4").touch()
+        (tmp_path / f"{name}.yaml").write_text(
+            f"name: {name}\nmedia:\n  - glob://{name}*.mp4\n"
+        )
+    sched = tmp_path / "schedule.yaml"
+    sched.write_text(f"- after: 0\n  playlist: a\n- after: {after}\n  playlist: b\n")
+    return [tmp_path / "a.yaml", tmp_path / "b.yaml"], sched
+
+
+def test_cutover(tmp_path):
+    files, sched = _scheduled(tmp_path, "now+1")
+
+    async def run():
+        core = await make_core(files, sched)
+        # a0 would play for 1000 s of virtual time, i.e. 10 s
+        player = SimPlayer(VirtualClock(speed=0.01), duration=lambda _: 1000.0)
+        app = App(core, player)
+        await app.set_repeat(True)
+        task = asyncio.create_task(app.play())
+        # the latency is recorded when the first media of b starts
+        while not player.log or not app.switch_latencies:
+            await asyncio.sleep(0.01)
+        task.cancel()
+        core.close()
+        return app, player
+
+    app, player = asyncio.run(asyncio.wait_for(run(), 5))
+    first = player.log[0]
+    assert first.file.name == "a0.mp4"
+    assert first.end - first.start < 200
+    assert len(app.switch_latencies) == 1
+    assert 0 <= app.switch_latencies[0] < 0.5
+
+
+def test_cutover_grace(tmp_path):
+    files, sched = _scheduled(tmp_path, "now+1")
+
+    async def run():
+        core = await make_core(files, sched)
+        player = SimPlayer(
+            VirtualClock(speed=0.01),
+            duration=lambda p: 150.0 if p.name == "a0.mp4" else 10.0,
+        )
+        app = App(core, player)
+        await app.set_repeat(True)
+        await app.set_cutover(grace=timedelta(seconds=5))
+        task = asyncio.create_task(app.play())
+        while len(player.log) < 2:
+            await asyncio.sleep(0.01)
+        task.cancel()
+        core.close()
+        return player
+
+    player = asyncio.run(asyncio.wait_for(run(), 5))
+    # a0 finishes within the grace period
+    assert player.log[0].file.name == "a0.mp4"
+    assert player.log[1].file.name.startswith("b")
+    assert player.log[0].end - player.log[0].start == 150
+    assert player.log[1].staged
+
+
+def test_events(tmp_path):
+    files = [tmp_path / f"{i}.png" for i in range(3)]
+    for f in files:
+        f.touch()
+
+    async def run():
+        bus = EventBus()
+        sub = bus.subscribe()
+        core = await make_core(files, None)
+        app = App(core, SimPlayer(), bus)
+        await app.play()
+        await core.rescan()
+        # publishing from another thread is delivered through the loop
+        await asyncio.to_thread(bus.publish, "error", message="x")
+        core.close()
+        out = []
+        while sub._q:
+            out.append(await anext(sub))
+        return out
+
+    events = asyncio.run(asyncio.wait_for(run(), 5))
+    assert [e["event"] for e in events] == ["now_playing"] * 3 + [
+        "rescan_started",
+        "rescan_finished",
+        "error",
+    ]
+    assert [e["file"] for e in events[:3]] == [str(f) for f in files]
@@ -0,0 +1,31 @@
+import asyncio
+
+from mplayer import bench
+
+
+def test_make_tree(tmp_path):
+    flat = bench.make_tree(tmp_path / "flat", 250, "flat")
+    deep = bench.make_tree(tmp_path / "deep", 250, "deep")
+    assert len({p.parent for p in flat}) == 1
+    assert len({p.parent for p in deep}) == 3
+    assert all(p.exists() for p in flat + deep)
+
+
+def test_run(tmp_path):
+    res = asyncio.run(
+        bench.run(
+            files=[50],
+            layouts=["flat", "deep"],
+            benchmarks=list(bench.BENCHMARKS),
+            events=10,
+            repeat=1,
+            transitions=10,
+            requests=20,
+            directory=tmp_path,
+        )
+    )
+    names = [(r["benchmark"], r.get("layout")) for r in res["results"]]
+    assert names[0] == ("schedule", None)
+    assert names[1:4] == [("api", None)] * 3
+    assert len(names) == 1 + 3 + 2 * 4
+    assert all(r["seconds"]["min"] >= 0 for r in res["results"])
@@ -0,0 +1,96 @@
+import asyncio
+import os
+import pickle
+
+from mplayer.catalog import Catalog
+from mplayer.core import make_core
+from mplayer.filters import Extension, Newest
+from mplayer.playlist import PlaylistSpec
+from mplayer.statcache import StatCache
+
+
+def _files(tmp_path, n):
+    out = []
+    for i in range(n):
+        f = tmp_path / f"{i}.png"
+        f.write_bytes(b"x" * i)
+        os.utime(f, (1000 + i, 1000 + i))
+        out.append(f)
+    return out
+
+
+def test_store_and_read(tmp_path):
+    files = _files(tmp_path, 5)
+    cat = Catalog(tmp_path / "cat.sqlite")
+    assert cat.store("p", 0, files, StatCache())
+    assert cat.store("p", 1, files[:2], StatCache())
+    plist = cat.playlist("p")
+    assert len(plist) == 7
+    assert list(plist.resources()) == files + files[:2]
+    assert plist[-1].resource == files[1]
+    assert plist.index(files[3]) == 3
+    assert tmp_path / "x.png" not in plist
+    assert plist == [e for e in plist]
+    cat.close()
+
+
+def test_unchanged_store(tmp_path):
+    files = _files(tmp_path, 3)
+    cat = Catalog(tmp_path / "cat.sqlite")
+    cat.store("p", 0, files, StatCache())
+    before = cat.playlist("p")
+    assert not cat.store("p", 0, files, StatCache())
+    assert cat.store("p", 0, files[:1], StatCache())
+    after = cat.playlist("p")
+    assert before != after
+    # the view taken before the store still reads the old entries
+    assert [e.resource for e in before] == files
+    assert len(after) == 1
+    cat.close()
+
+
+def test_top_query(tmp_path):
+    files = _files(tmp_path, 10)
+    cat = Catalog(tmp_path / "cat.sqlite")
+    cat.store("p", 0, files, StatCache(), [Newest(3), Extension("png")])
+    assert list(cat.playlist("p").resources()) == files[:-4:-1]
+    cat.close()
+
+
+def test_resolve_into_catalog(tmp_path):
+    files = _files(tmp_path, 4)
+    spec = PlaylistSpec.from_yaml(
+        {
+            "name": "p",
+            "media": [
+                "glob://*.png",
+                {"url": "glob://*.png", "filters": {"largest": 1}},
+            ],
+        },
+        tmp_path,
+    )[0]
+    cat = Catalog(tmp_path / "cat.sqlite")
+    plist = asyncio.run(spec.resolve(catalog=cat))
+    assert sorted(plist.resources())[:4] == files
+    assert plist[4].resource == files[-1]
+    assert pickle.loads(pickle.dumps(plist)) == plist
+    cat.close()
+
+
+def test_core_with_catalog(tmp_path):
+    files = _files(tmp_path, 3)
+    plist = tmp_path / "p.yaml"
+    plist.write_text("name: p\nmedia:\n  - glob://*.png\n")
+
+    async def run():
+        core = await make_core([plist], None, catalog=tmp_path / "cat.sqlite")
+        seen = [m async for m in core.medias(wait=False)]
+        before = core._ctx.playlist("p")
+        await core.rescan()
+        after = core._ctx.playlist("p")
+        core.close()
+        return seen, before, after
+
+    seen, before, after = asyncio.run(run())
+    assert sorted(seen) == files
+    assert after is before
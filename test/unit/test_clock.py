@@ -0,0 +1,65 @@
+import asyncio
+import time
+
+from datetime import datetime, timedelta
+
+from mplayer.clock import WallClock
+
+
+def test_sleep_until_past():
+    async def run():
+        clock = WallClock()
+        try:
+            return await clock.sleep_until(datetime.now() - timedelta(hours=1))
+        finally:
+            clock.close()
+
+    assert asyncio.run(run())
+
+
+def test_sleep_until():
+    target = datetime.now() + timedelta(seconds=0.2)
+
+    async def run():
+        clock = WallClock(max_slice=0.05)
+        try:
+            return await clock.sleep_until(target)
+        finally:
+            clock.close()
+
+    assert asyncio.run(run())
+    assert datetime.now() >= target
+
+
+def test_sleep_until_aware():
+    target = (datetime.now() + timedelta(seconds=0.1)).astimezone()
+
+    async def run():
+        clock = WallClock()
+        try:
+            return await clock.sleep_until(target)
+        finally:
+            clock.close()
+
+    assert asyncio.run(run())
+    assert datetime.now().astimezone() >= target
+
+
+def test_step_back(monkeypatch):
+    real = time.time
+    start = real()
+    # the wall clock is set back an hour 0.1 s from now
+    monkeypatch.setattr(
+        time, "time", lambda: real() - (3600 if real() - start > 0.1 else 0)
+    )
+
+    async def run():
+        clock = WallClock(max_slice=0.05)
+        try:
+            return await clock.sleep_until(datetime.now() + timedelta(seconds=1))
+        finally:
+            clock.close()
+
+    begin = real()
+    assert not asyncio.run(run())
+    assert real() - begin < 0.5
@@ -0,0 +1,145 @@
+import asyncio
+import os
+import time
+
+from mplayer.core import make_core
+from mplayer.index import Index
+
+
+def _touch_old(path):
+    # files modified recently are held back by rescans until they settle
+    path.touch()
+    t = time.time() - 60
+    os.utime(path, (t, t))
+
+
+def test_rescan_keeps_position(tmp_path):
+    for i in range(4):
+        _touch_old(tmp_path / f"{i}.png")
+    plist = tmp_path / "p.yaml"
+    plist.write_text("name: p\nmedia:\n  - glob://*.png\n")
+
+    async def run():
+        core = await make_core([plist], None)
+        medias = core.medias(wait=False)
+        seen = [await anext(medias), await anext(medias)]
+        ctx = core._ctx
+        await core.rescan()
+        assert core._ctx is not ctx
+        seen += [m async for m in medias]
+        core.close()
+        return seen
+
+    seen = asyncio.run(run())
+    assert sorted(m.name for m in seen) == [f"{i}.png" for i in range(4)]
+
+
+def test_rescan_reuses_unchanged(tmp_path):
+    _touch_old(tmp_path / "0.png")
+    plist = tmp_path / "p.yaml"
+    plist.write_text("name: p\nmedia:\n  - glob://*.png\n")
+
+    async def run():
+        core = await make_core([plist], None)
+        before = core._ctx.playlist("p")
+        await core.rescan()
+        after = core._ctx.playlist("p")
+        core.close()
+        return before, after
+
+    before, after = asyncio.run(run())
+    assert after is before
+
+
+def test_rescan_holds_back_unsettled(tmp_path):
+    _touch_old(tmp_path / "0.png")
+    plist = tmp_path / "p.yaml"
+    plist.write_text("name: p\nmedia:\n  - glob://*.png\n")
+
+    async def run():
+        core = await make_core([plist], None)
+        core._settler._interval = 0.5
+        (tmp_path / "1.png").write_bytes(b"partial")
+        await core.rescan()
+        before = list(core._ctx.playlist("p").resources())
+        while len(core._ctx.playlist("p")) < 2:
+            await asyncio.sleep(0.01)
+        core.close()
+        return before
+
+    assert asyncio.run(asyncio.wait_for(run(), 5)) == [tmp_path / "0.png"]
+
+
+def _slowed(monkeypatch, name, delay):
+    add = Index.add
+
+    async def slow_add(self, spec, stats=None):
+        if spec.name == name:
+            await asyncio.sleep(delay)
+        return await add(self, spec, stats)
+
+    monkeypatch.setattr(Index, "add", slow_add)
+
+
+def _plists(tmp_path, names):
+    out = []
+    for name in names:
+        (tmp_path / f"{name}.png").touch()
+        out.append(tmp_path / f"{name}.yaml")
+        out[-1].write_text(f"name: {name}\nmedia:\n  - glob://{name}.png\n")
+    return out
+
+
+def test_resolve_timeout(tmp_path, monkeypatch):
+    _slowed(monkeypatch, "slow", 0.5)
+    files = _plists(tmp_path, ["slow", "fast"])
+
+    async def run():
+        core = await make_core(files, None, resolve_timeout=0.1)
+        await core._load_task
+        names = [(p.name, len(p)) for p in core._ctx.playlists()]
+        # the slow playlist is added once resolved
+        while not core._ctx.playlist("slow"):
+            await asyncio.sleep(0.01)
+        core.close()
+        return names
+
+    assert asyncio.run(asyncio.wait_for(run(), 5)) == [("slow", 0), ("fast", 1)]
+
+
+def test_start_before_all_resolved(tmp_path, monkeypatch):
+    _slowed(monkeypatch, "b", 0.5)
+    files = _plists(tmp_path, ["a", "b"])
+
+    async def run():
+        core = await make_core(files, None)
+        medias = core.medias(wait=True)
+        first = await anext(medias)
+        loaded = core._load_task.done()
+        rest = [await anext(medias)]
+        core.close()
+        return first, loaded, rest
+
+    first, loaded, rest = asyncio.run(asyncio.wait_for(run(), 5))
+    assert first.name == "a.png"
+    assert not loaded
+    assert [m.name for m in rest] == ["b.png"]
+
+
+def test_nameless_groups(tmp_path):
+    _touch_old(tmp_path / "a.mp4")
+    _touch_old(tmp_path / "b.mp4")
+    files = [tmp_path / "a.mp4", *_plists(tmp_path, ["p"]), tmp_path / "b.mp4"]
+
+    async def run():
+        core = await make_core(files, None)
+        await core._load_task
+        medias = [m.name async for m in core.medias(wait=False)]
+        names = [p.name for p in core._ctx.playlists()]
+        core.close()
+        return names, medias
+
+    names, medias = asyncio.run(asyncio.wait_for(run(), 5))
+    # the files around the playlist do not replace each other
+    assert names == ["", "p", "#2"]
+    assert medias == ["a.mp4", "p.png", "b.mp4"]
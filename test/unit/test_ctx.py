@@ -0,0 +1,41 @@
+from pathlib import Path
+
+from mplayer.ctx import Ctx, Cursor
+from mplayer.playlist import Entry, Playlist
+
+
+def _plist(name, *resources):
+    return Playlist((Entry(resource=Path(r)) for r in resources), name=name)
+
+
+def _walk(ctx, cur=None):
+    out = []
+    while (cur := ctx.advance(cur)) is not None:
+        out.append(str(cur.resource))
+    return out
+
+
+def test_advance():
+    ctx = Ctx([_plist("a", "1", "2"), _plist("b"), _plist("c", "3")])
+    assert _walk(ctx) == ["1", "2", "3"]
+
+
+def test_advance_replaced():
+    ctx = Ctx([_plist("a", "1", "2", "3"), _plist("b", "4")])
+    cur = ctx.advance(ctx.advance(None))
+    assert cur == Cursor("a", Path("2"), 1)
+    # entries added before the cursor
+    ctx.update(_plist("a", "0", "1", "2", "3"))
+    assert _walk(ctx, cur) == ["3", "4"]
+
+
+def test_advance_removed():
+    ctx = Ctx([_plist("a", "1", "2", "3"), _plist("b", "4")])
+    cur = Cursor("a", Path("2"), 1)
+    ctx.update(_plist("a", "1", "3"))
+    assert _walk(ctx, cur) == ["3", "4"]
+
+
+def test_advance_playlist_gone():
+    ctx = Ctx([_plist("b", "4")])
+    assert _walk(ctx, Cursor("a", Path("2"), 1)) == ["4"]
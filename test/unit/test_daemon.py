@@ -0,0 +1,111 @@
+import asyncio
+
+from mplayer.api import Client, Server
+from mplayer.app import App
+from mplayer.core import make_core
+from mplayer.daemon import Control
+from mplayer.sim_player import SimPlayer, VirtualClock
+
+
+def _files(tmp_path, prefix, n):
+    out = []
+    for i in range(n):
+        f = tmp_path / f"{prefix}{i}.mp4"
+        f.touch()
+        out.append(f)
+    return out
+
+
+def _daemon(tmp_path, files, run, speed=0.001):
+    async def main():
+        core = await make_core(files, None)
+        player = SimPlayer(VirtualClock(speed=speed), duration=lambda _: 100.0)
+        srv = Server(tmp_path / "s.sock")
+        app = App(core, player, srv.events)
+        await app.set_follow(True)
+        Control(app, core).register(srv)
+        await srv.run()
+        play = asyncio.create_task(app.play())
+        c = Client(tmp_path / "s.sock")
+        try:
+            return await run(c, player)
+        finally:
+            await c.close()
+            play.cancel()
+            srv.close()
+            core.close()
+
+    return asyncio.run(asyncio.wait_for(main(), 5))
+
+
+async def _until(cond):
+    while not cond():
+        await asyncio.sleep(0.01)
+
+
+def test_enqueue_and_skip(tmp_path):
+    a = _files(tmp_path, "a", 2)
+    b = _files(tmp_path, "b", 2)
+
+    async def run(c, player):
+        await _until(lambda: player.log)
+        status = await c.call("enqueue", files=[str(f) for f in b])
+        assert status["files"] == [str(f) for f in a + b]
+        assert status["playlists"][0]["length"] == 4
+        # the enqueued files are played after the first ones
+        await _until(lambda: len(player.log) == 3)
+        await c.call("skip")
+        await _until(lambda: len(player.log) == 4)
+        stats = await c.call("stats")
+        assert stats["mplayer_media_played_total"] >= 4
+        assert stats["mplayer_rescan_seconds"]["count"] >= 1
+        return player
+
+    player = _daemon(tmp_path, a, run)
+    assert [p.file for p in player.log] == a + b
+    # the skipped media was cut short
+    assert player.log[3].end - player.log[3].start < 100
+
+
+def test_play_and_pause(tmp_path):
+    a = _files(tmp_path, "a", 3)
+    b = _files(tmp_path, "b", 2)
+
+    async def run(c, player):
+        async def playing(f):
+            while (await c.call("status"))["current"] != str(f):
+                await asyncio.sleep(0.01)
+
+        await playing(a[0])
+        await c.call("play", files=[str(f) for f in b])
+        await playing(b[0])
+        await c.call("pause")
+        assert (await c.call("status"))["paused"]
+        n = len(player.log)
+        t = player.clock.now()
+        await asyncio.sleep(0.2)
+        # the clock stops while paused
+        assert len(player.log) == n
+        assert player.clock.now() == t
+        await c.call("resume")
+        await _until(lambda: len(player.log) == n + 1)
+        return player
+
+    player = _daemon(tmp_path, a, run, speed=0.01)
+    # playing new files cuts the current media short and starts from the first
+    assert player.log[0].file == a[0]
+    assert player.log[0].end < 100
+    assert [p.file for p in player.log[1:]] == b
+
+
+def test_pause_unsupported(tmp_path):
+    a = _files(tmp_path, "a", 2)
+
+    async def run(c, player):
+        player.can_pause = False
+        status = await c.call("pause")
+        assert not status["pausable"]
+        assert not status["paused"]
+        await _until(lambda: len(player.log) == 2)
+
+    _daemon(tmp_path, a, run)
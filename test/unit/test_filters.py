@@ -0,0 +1,95 @@
+import asyncio
+import os
+import random
+import time
+
+from pathlib import Path
+
+import pytest
+
+from mplayer import filters, url
+from mplayer.filters import Newest
+from mplayer.statcache import StatCache
+
+
+def _stat(mtime: int):
+    return os.stat_result((0, 0, 0, 0, 0, 0, 0, 0, mtime, 0))
+
+
+def test_newest():
+    stats = StatCache({Path(str(i)): _stat(i) for i in range(100)})
+    res = Newest(3)((Path(str(i)) for i in range(100)), stats)
+    assert res == [Path("99"), Path("98"), Path("97")]
+
+
+def test_stats_lazy(tmp_path):
+    for i in range(3):
+        (tmp_path / f"{i}.png").touch()
+        os.utime(tmp_path / f"{i}.png", (i, i))
+    stats = StatCache()
+
+    async def run():
+        return [
+            p
+            async for p in url.resolve_async("glob://*.png", root=tmp_path, stats=stats)
+        ]
+
+    paths = asyncio.run(run())
+    # the walk does not stat the files, the filters do
+    assert not stats
+    assert set(stats.relisted) == set(paths)
+    (tmp_path / "2.png").unlink()
+    assert list(filters.chain([Newest(1)], paths, stats)) == [tmp_path / "1.png"]
+    assert set(stats) == set(paths[:2])
+
+
+def _stats(n: int):
+    return StatCache(
+        {
+            Path(f"{i}.png"): os.stat_result((0,) * 6 + (n - i, 0, i, 0))
+            for i in range(n)
+        }
+    )
+
+
+def test_oldest_largest():
+    stats = _stats(10)
+    assert filters.Oldest(2)(stats, stats) == [Path("0.png"), Path("1.png")]
+    assert filters.Largest(1)(stats, stats) == [Path("0.png")]
+
+
+def test_modified_within():
+    now = int(time.time())
+    stats = StatCache({Path("old"): _stat(now - 3600), Path("new"): _stat(now)})
+    f = filters.ModifiedWithin("1m")
+    assert list(f(stats, stats)) == [Path("new")]
+
+
+def test_extension_exclude():
+    paths = [Path("a.PNG"), Path("b.jpg"), Path("tmp/c.png"), Path("d.mp4")]
+    res = filters.Extension(["png", ".jpg"])(paths, StatCache())
+    res = filters.Exclude("tmp/*")(res, StatCache())
+    assert list(res) == [Path("a.PNG"), Path("b.jpg")]
+
+
+def test_sample():
+    paths = [Path(str(i)) for i in range(1000)]
+    res = filters.Sample(10, random.Random(0))(iter(paths), StatCache())
+    assert len(res) == 10
+    assert len(set(res)) == 10
+    assert res == sorted(res, key=paths.index)
+    assert filters.Sample(10)(paths[:3], StatCache()) == paths[:3]
+
+
+def test_chain_from_yaml():
+    chain = filters.from_yaml([{"extension": "png"}, {"newest": 2}])
+    assert [f.name for f in chain] == ["extension", "newest"]
+    paths = [Path("a.jpg")] + list(_stats(5))
+    res = list(filters.chain(chain, paths, _stats(5)))
+    assert res == [Path("4.png"), Path("3.png")]
+
+
+def test_unknown():
+    with pytest.raises(ValueError):
+        filters.filter_by_name("asdf")
+    assert filters.filter_by_name("oldest") is filters.Oldest
@@ -0,0 +1,132 @@
+import asyncio
+import shutil
+
+from pathlib import Path
+
+from mplayer import url
+from mplayer.index import Index
+from mplayer.inotify import Watcher
+from mplayer.playlist import PlaylistSpec
+
+
+def _spec(root: Path):
+    (p,) = PlaylistSpec.from_yaml(
+        {"name": "test", "media": ["glob://*.png", "file://c.jpg"]}, root
+    )
+    return p
+
+
+def _names(plist):
+    return sorted(e.resource.name for e in plist)
+
+
+def test_update(tmp_path):
+    (tmp_path / "a.png").touch()
+    (tmp_path / "c.jpg").touch()
+
+    async def run():
+        idx = Index()
+        p = await idx.add(_spec(tmp_path))
+        assert _names(p) == ["a.png", "c.jpg"]
+        (tmp_path / "b.png").touch()
+        assert await idx.update([tmp_path.parent / "other"]) == []
+        (p,) = await idx.update([tmp_path / "b.png"])
+        assert _names(p) == ["a.png", "b.png", "c.jpg"]
+
+    asyncio.run(run())
+
+
+def test_watch(tmp_path):
+    (tmp_path / "sub").mkdir()
+
+    async def run():
+        w = Watcher()
+        idx = Index(w)
+        p = await idx.add(_spec(tmp_path))
+        assert _names(p) == ["c.jpg"]
+        changes = w.changes(delay=0.01)
+        (tmp_path / "sub" / "a.png").touch()
+        changed = await asyncio.wait_for(anext(changes), 5)
+        assert tmp_path / "sub" / "a.png" in changed
+        (p,) = await idx.update(changed)
+        assert _names(p) == ["a.png", "c.jpg"]
+        await changes.aclose()
+        w.close()
+
+    asyncio.run(run())
+
+
+def test_watch_new_dir(tmp_path):
+    async def run():
+        w = Watcher()
+        await w.watch(tmp_path)
+        changes = w.changes(delay=0.01)
+        (tmp_path / "new").mkdir()
+        (tmp_path / "new" / "a.png").touch()
+        changed = set()
+        while tmp_path / "new" / "a.png" not in changed:
+            changed |= await asyncio.wait_for(anext(changes), 5)
+        # the new directory is watched too
+        (tmp_path / "new" / "b.png").touch()
+        changed = set()
+        while tmp_path / "new" / "b.png" not in changed:
+            changed |= await asyncio.wait_for(anext(changes), 5)
+        await changes.aclose()
+        w.close()
+
+    asyncio.run(run())
+
+
+def test_update_incremental(tmp_path, monkeypatch):
+    (tmp_path / "sub").mkdir()
+    for f in ["b.png", "c.jpg", "sub/a.png"]:
+        (tmp_path / f).touch()
+
+    def order(plist):
+        return [str(e.resource.relative_to(tmp_path)) for e in plist]
+
+    async def run():
+        idx = Index()
+        p = await idx.add(_spec(tmp_path))
+        assert order(p) == ["b.png", "sub/a.png", "c.jpg"]
+        # changes are applied without walking the directories
+        monkeypatch.setattr(url, "_walk", None)
+        (tmp_path / "a.png").touch()
+        (tmp_path / "d.txt").touch()
+        (p,) = await idx.update([tmp_path / "a.png", tmp_path / "d.txt"])
+        assert order(p) == ["a.png", "b.png", "sub/a.png", "c.jpg"]
+        (tmp_path / "b.png").unlink()
+        shutil.rmtree(tmp_path / "sub")
+        (p,) = await idx.update([tmp_path / "b.png", tmp_path / "sub"])
+        assert order(p) == ["a.png", "c.jpg"]
+        assert await idx.update([tmp_path / "d.txt"]) == []
+
+    asyncio.run(run())
+
+
+def test_rewatch(tmp_path, monkeypatch):
+    (tmp_path / "a").mkdir()
+    (tmp_path / "b").mkdir()
+    walks = []
+    add_tree = Watcher._add_tree
+    monkeypatch.setattr(
+        Watcher, "_add_tree", lambda self, d: walks.append(d) or add_tree(self, d)
+    )
+
+    async def run():
+        w = Watcher()
+        idx = Index(w)
+        await idx.add(_spec(tmp_path / "a"))
+        idx.clear()
+        await idx.add(_spec(tmp_path / "a"))
+        idx.unwatch_stale()
+        # the watches of unchanged specs are kept
+        assert walks == [tmp_path / "a"]
+        idx.clear()
+        await idx.add(_spec(tmp_path / "b"))
+        idx.unwatch_stale()
+        dirs = set(w._dirs.values())
+        w.close()
+        return dirs
+
+    assert asyncio.run(run()) == {tmp_path / "b"}
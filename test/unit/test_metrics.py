@@ -0,0 +1,65 @@
+import asyncio
+
+from mplayer import metrics
+from mplayer.core import make_core
+from mplayer.metrics import Registry
+
+
+def test_histogram():
+    reg = Registry()
+    h = reg.histogram("h_seconds", "help", buckets=(0.1, 1.0))
+    for v in (0.05, 0.1, 0.5, 2.0):
+        h.observe(v)
+    assert h.count == 4
+    snap = reg.snapshot()["h_seconds"]
+    assert snap["sum"] == 2.65
+    assert snap["max"] == 2.0
+    assert snap["p50"] == 0.1
+    assert snap["p99"] == 2.0
+    assert reg.prometheus().splitlines()[2:] == [
+        'h_seconds_bucket{le="0.1"} 2',
+        'h_seconds_bucket{le="1.0"} 3',
+        'h_seconds_bucket{le="+Inf"} 4',
+        "h_seconds_sum 2.65",
+        "h_seconds_count 4",
+    ]
+
+
+def test_write(tmp_path):
+    reg = Registry()
+    c = reg.counter("c_total", "help")
+    c.inc(3)
+    reg.write(tmp_path / "m.prom")
+    assert (tmp_path / "m.prom").read_text().splitlines()[-1] == "c_total 3"
+    assert list(tmp_path.iterdir()) == [tmp_path / "m.prom"]
+    assert reg.snapshot() == {"c_total": 3}
+
+
+def test_rescan_metrics(tmp_path):
+    f = tmp_path / "a.png"
+    f.touch()
+
+    async def run():
+        core = await make_core([f], None)
+        before = metrics.RESCAN_SECONDS.count, metrics.RESCANS.snapshot()
+        core.request_rescan()
+        core.request_rescan(immediate=True)
+        await core.rescan_now()
+        core.close()
+        return before
+
+    count, rescans = asyncio.run(run())
+    assert metrics.RESCAN_SECONDS.count > count
+    assert metrics.RESCANS.snapshot() == rescans + 1
+
+
+def test_forward():
+    src, dst = Registry(), Registry()
+    c = src.counter("c_total", "help")
+    h = src.histogram("h_seconds", "help")
+    dst.counter("c_total", "help")
+    dst.histogram("h_seconds", "help")
+    src.forward(dst.record)
+    c.inc(2)
+    h.observe(0.5)
+    assert dst.snapshot() == src.snapshot()
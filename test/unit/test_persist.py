@@ -0,0 +1,75 @@
+import asyncio
+import os
+
+from pathlib import Path
+
+import pytest
+
+from mplayer import persist as persist_mod
+from mplayer.persist import persist, pin
+
+
+async def _read_after_unlink(path: Path):
+    async with persist(path) as p:
+        path.unlink()
+        return p.read_bytes()
+
+
+def test_persist(tmp_path):
+    f = tmp_path / "a.png"
+    f.write_bytes(b"asdf")
+    assert asyncio.run(_read_after_unlink(f)) == b"asdf"
+
+
+def test_persist_missing(tmp_path):
+    with pytest.raises(FileNotFoundError):
+        asyncio.run(_read_after_unlink(tmp_path / "missing.png"))
+
+
+def test_persist_fd(tmp_path, monkeypatch):
+    monkeypatch.setattr(persist_mod, "_hardlink", lambda s, d: False)
+    monkeypatch.setattr(persist_mod, "_reflink", lambda s, d: False)
+    f = tmp_path / "a.png"
+    f.write_bytes(b"asdf")
+    assert asyncio.run(_read_after_unlink(f)) == b"asdf"
+
+
+def test_persist_copy(tmp_path, monkeypatch):
+    monkeypatch.setattr(persist_mod, "_hardlink", lambda s, d: False)
+    monkeypatch.setattr(persist_mod, "_reflink", lambda s, d: False)
+    monkeypatch.setattr(persist_mod, "_PROC_FD", tmp_path / "nonexistent")
+    f = tmp_path / "a.png"
+    f.write_bytes(b"asdf")
+    assert asyncio.run(_read_after_unlink(f)) == b"asdf"
+
+
+def test_pin_same_filesystem(tmp_path, cache_dir, monkeypatch):
+    monkeypatch.setattr(persist_mod, "_roots", {})
+    f = tmp_path / "a.png"
+    f.write_bytes(b"asdf")
+
+    async def run():
+        async with pin(f) as (p, how):
+            return p, how
+
+    p, how = asyncio.run(run())
+    # staged next to the cache, without copying
+    assert how == "hardlink"
+    assert p.parent.parent == cache_dir / "staging"
+
+
+def test_pin_other_filesystem(tmp_path, monkeypatch):
+    monkeypatch.setattr(persist_mod, "_roots", {})
+    # nothing is staged on filesystems without the cache or temp directory
+    assert persist_mod._staging_root(-1) is None
+    (tmp_path / "media").mkdir()
+    f = tmp_path / "media" / "a.png"
+    f.write_bytes(b"asdf")
+    persist_mod._roots[os.stat(f).st_dev] = None
+
+    async def run():
+        async with pin(f) as (p, how):
+            return p.read_bytes(), how
+
+    assert asyncio.run(run()) == (b"asdf", "fd")
+    assert list(f.parent.iterdir()) == [f]
@@ -1,4 +1,18 @@
-from mplayer.playlist import PlaylistSpec, Playlist, Entry
+import pickle
+
+from pathlib import Path
+
+import pytest
+
+from mplayer import playlist
+from mplayer.playlist import (
+    Entry,
+    Excluding,
+    Playlist,
+    PlaylistSpec,
+    SpecCache,
+    is_playlist,
+)
 
 
 def test_spec_default():
@@ -23,3 +37,115 @@ def test_spec_with_filters():
     filters = p[100].filters
     assert len(filters) == 1
     assert filters[0].name == "newest"
+
+
+def test_spec_with_filter_chain():
+    obj = {
+        "name": "test",
+        "media": [{"url": "a", "filters": [{"extension": "png"}, {"sample": 2}]}],
+    }
+    (p,) = PlaylistSpec.from_yaml([obj])
+    assert [f.name for f in p[0].filters] == ["extension", "sample"]
+
+
+def test_is_playlist(tmp_path):
+    png = tmp_path / "a"
+    png.write_bytes(b"\x89PNG\r\n\x1a\n")
+    txt = tmp_path / "b"
+    txt.write_text("name: b\n")
+    assert not is_playlist(png)
+    assert is_playlist(txt)
+    assert is_playlist(tmp_path / "c.yaml")
+    assert not is_playlist(tmp_path / "c.mp4")
+    with pytest.raises(ValueError):
+        PlaylistSpec.from_file(png)
+
+
+def test_spec_cache(tmp_path, monkeypatch):
+    f = tmp_path / "p.yaml"
+    f.write_text("name: p\nmedia: [a]\n")
+    (tmp_path / "a.png").touch()
+    calls = 0
+    read_docs = playlist._read_docs
+
+    def counting(path):
+        nonlocal calls
+        calls += 1
+        return read_docs(path)
+
+    monkeypatch.setattr(playlist, "_read_docs", counting)
+    c = SpecCache(tmp_path / "cache")
+    (p,) = c.load(f)
+    assert p.name == "p"
+    with pytest.raises(ValueError):
+        c.load(tmp_path / "a.png")
+    c.save()
+    c = SpecCache(tmp_path / "cache")
+    (p,) = c.load(f)
+    assert p.name == "p" and p.root == tmp_path
+    with pytest.raises(ValueError):
+        c.load(tmp_path / "a.png")
+    assert calls == 2
+    f.write_text("name: q\nmedia: [a, b]\n")
+    (p,) = c.load(f)
+    assert p.name == "q"
+    assert calls == 3
+
+
+def test_playlist_compact():
+    paths = [Path("/a/1.png"), Path("/b/1.png"), Path("/a/11.png"), Path("/a/x/1.png")]
+    p = Playlist([Entry(resource=r) for r in paths], name="p")
+    assert p.name == "p"
+    assert len(p) == 4
+    assert [e.resource for e in p] == paths
+    assert list(p.resources()) == paths
+    assert p[-1].resource == paths[-1]
+    assert p[1] == Entry(resource=paths[1])
+    assert list(p[1:3].resources()) == paths[1:3]
+    with pytest.raises(IndexError):
+        p[4]
+    assert p.index(Path("/a/1.png")) == 0
+    assert p.index(Path("/a/11.png")) == 2
+    assert p.index(Path("/a/x/1.png")) == 3
+    assert Path("/b/1.png") in p
+    assert Path("/b/11.png") not in p
+    with pytest.raises(ValueError):
+        p.index(Path("/c/1.png"))
+
+
+def test_playlist_eq_pickle():
+    a = Playlist.from_paths([Path("/a/1.png"), Path("/b/2.png")], name="p")
+    b = Playlist.from_paths([Path("/b/2.png")], name="p")
+    b_first = Playlist.from_paths([Path("/b/0.png"), Path("/a/1.png")])
+    assert a != b
+    assert a != b_first
+    b = Playlist([Entry(resource=Path("/a/1.png"))], name="p")
+    b.add(Path("/b/2.png"))
+    assert a == b
+    assert a == [Entry(resource=Path("/a/1.png")), Entry(resource=Path("/b/2.png"))]
+    c = pickle.loads(pickle.dumps(a))
+    assert c == a and c.name == "p"
+    c.add(Path("/a/3.png"))
+    assert c.index(Path("/a/3.png")) == 2
+
+
+def test_excluding():
+    paths = [Path(f"/a/{i}.png") for i in range(6)] + [Path("/a/1.png")]
+    p = Playlist.from_paths(paths, name="p")
+    assert Excluding.without(p, {Path("/b/1.png")}) is p
+    for pending in ({Path("/a/1.png"), Path("/a/4.png")}, set(paths)):
+        ex = Excluding.without(p, pending)
+        kept = [r for r in paths if r not in pending]
+        assert ex.name == "p"
+        assert len(ex) == len(kept)
+        assert list(ex.resources()) == kept
+        assert [ex[i].resource for i in range(len(ex))] == kept
+        assert ex == Playlist.from_paths(kept)
+    ex = Excluding.without(p, {Path("/a/1.png"), Path("/a/4.png")})
+    assert ex[-1].resource == Path("/a/5.png")
+    assert ex.index(Path("/a/5.png")) == 3
+    assert Path("/a/1.png") not in ex
+    with pytest.raises(IndexError):
+        ex[4]
+    c = pickle.loads(pickle.dumps(ex))
+    assert c == ex and c.name == "p"
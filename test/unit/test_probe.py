@@ -0,0 +1,54 @@
+import asyncio
+import os
+
+from concurrent.futures import ThreadPoolExecutor
+
+from mplayer import probe
+from mplayer.filters import MaxDuration
+from mplayer.probe import Metadata, MetadataCache, Prober
+from mplayer.statcache import StatCache
+
+
+def _fake_probe(path: str) -> Metadata:
+    return Metadata(duration=os.path.getsize(path), fingerprint=probe.fingerprint(path))
+
+
+def test_fingerprint(tmp_path):
+    f = tmp_path / "a.mp4"
+    f.write_bytes(b"a" * 300_000)
+    fp = probe.fingerprint(f)
+    assert fp == probe.fingerprint(f)
+    f.write_bytes(b"a" * 299_999 + b"b")
+    assert fp != probe.fingerprint(f)
+
+
+def test_cache(tmp_path):
+    f = tmp_path / "a.mp4"
+    f.write_bytes(b"a")
+    c = MetadataCache(tmp_path / "meta.sqlite")
+    assert c.get(f, f.stat()) is None
+    c.put(f, f.stat(), Metadata(duration=1.5, width=640, height=480, codec="H264"))
+    c.close()
+    c = MetadataCache(tmp_path / "meta.sqlite")
+    assert c.get(f, f.stat()) == Metadata(1.5, 640, 480, "H264")
+    f.write_bytes(b"ab")
+    assert c.get(f, f.stat()) is None
+
+
+def test_prober(tmp_path):
+    files = []
+    for i in range(1, 4):
+        files.append(tmp_path / f"{i}.mp4")
+        files[-1].write_bytes(b"a" * i)
+    cache = MetadataCache()
+
+    async def run():
+        p = Prober(cache, 2, probe=_fake_probe, executor=ThreadPoolExecutor(2))
+        p.submit(files + [tmp_path / "missing.mp4"])
+        await p.join()
+        p.close()
+
+    asyncio.run(run())
+    stats = StatCache(metadata=cache)
+    assert [stats.metadata(f).duration for f in files] == [1, 2, 3]
+    assert list(MaxDuration("2s")(files, stats)) == files[:2]
@@ -0,0 +1,95 @@
+import asyncio
+import os
+import time
+
+from mplayer.rescan import RescanScheduler, Settler
+
+
+def test_coalesce():
+    scans = []
+
+    async def scan():
+        scans.append(time.monotonic())
+
+    async def run():
+        s = RescanScheduler(scan, debounce=0.05, max_latency=1.0)
+        for _ in range(10):
+            s.request()
+            await asyncio.sleep(0.01)
+        await s.join()
+        return s
+
+    s = asyncio.run(run())
+    assert len(scans) == 1
+    assert list(s.merged) == [10]
+
+
+def test_max_latency():
+    scans = []
+
+    async def scan():
+        scans.append(time.monotonic())
+
+    async def run():
+        s = RescanScheduler(scan, debounce=0.05, max_latency=0.1)
+        start = time.monotonic()
+        # requests keep arriving within the debounce period
+        while time.monotonic() - start < 0.3:
+            s.request()
+            await asyncio.sleep(0.01)
+        await s.join()
+        return start
+
+    start = asyncio.run(run())
+    assert len(scans) >= 2
+    assert scans[0] - start < 0.2
+
+
+def test_request_during_scan():
+    scans = []
+
+    async def run():
+        async def scan():
+            scans.append(len(scans))
+            if len(scans) == 1:
+                s.request()
+                s.request()
+            await asyncio.sleep(0.01)
+
+        s = RescanScheduler(scan, debounce=0.0)
+        s.request(immediate=True)
+        await s.join()
+        return s
+
+    s = asyncio.run(run())
+    assert scans == [0, 1]
+    assert list(s.merged) == [1, 2]
+
+
+def test_settler(tmp_path):
+    f = tmp_path / "upload.mp4"
+    old = tmp_path / "old.mp4"
+    old.write_bytes(b"x")
+    # not modified recently
+    t = time.time() - 60
+    os.utime(old, (t, t))
+
+    async def run():
+        s = Settler(interval=0.05)
+        f.write_bytes(b"x")
+        s.check([f, old])
+        assert s.pending == {f}
+        settled = s.settled()
+        task = asyncio.ensure_future(anext(settled))
+        for _ in range(5):
+            with open(f, "ab") as fh:
+                fh.write(b"x")
+            await asyncio.sleep(0.03)
+            assert not task.done()
+        res = await asyncio.wait_for(task, 1)
+        await settled.aclose()
+        return res, s
+
+    res, s = asyncio.run(run())
+    assert res == {f}
+    assert not s.pending
@@ -1,8 +1,11 @@
-from datetime import datetime, timedelta
+import itertools
 
+from datetime import datetime, time, timedelta, timezone
+
+import pytest
 import yaml
 
-from mplayer.schedule import Schedule, Event
+from mplayer.schedule import Schedule, Event, Rule
 
 
 def _mk_datetime(stamp: int):
@@ -90,3 +93,119 @@ def test_parse_abs():
 """
     s = Schedule.from_yaml(yaml.safe_load(yml), now)
     assert s == Schedule([Event(when=now, playlist="asdf")])
+
+
+def test_non_expired_future():
+    s = Schedule([_mk_event(3), _mk_event(4)])
+    assert s.non_expired(now=_mk_datetime(2)) == [_mk_event(3), _mk_event(4)]
+
+
+def test_current_before_first():
+    s = Schedule([_mk_event(3), _mk_event(4)])
+    assert s.current(now=_mk_datetime(2)) is None
+
+
+def test_rule_daily():
+    r = Rule(playlist="a", at=(time(8), time(20)))
+    now = datetime(2024, 1, 1, 12)
+    assert r.last(now) == Event(datetime(2024, 1, 1, 8), "a")
+    assert r.first(now) == Event(datetime(2024, 1, 1, 20), "a")
+    assert r.last(datetime(2024, 1, 1, 7)) == Event(datetime(2023, 12, 31, 20), "a")
+
+
+def test_rule_weekdays():
+    r = Rule.from_yaml({"at": "08:00", "days": "mon-fri", "playlist": "a"})
+    # Friday evening
+    now = datetime(2024, 1, 5, 12)
+    assert r.first(now) == Event(datetime(2024, 1, 8, 8), "a")
+    assert r.last(datetime(2024, 1, 7)) == Event(datetime(2024, 1, 5, 8), "a")
+
+
+def test_rule_days_wrap():
+    r = Rule.from_yaml({"at": "08:00", "days": ["sat-mon"], "playlist": "a"})
+    assert r.days == {5, 6, 0}
+
+
+def test_rule_interval_window():
+    start = datetime(2024, 1, 1)
+    r = Rule(
+        playlist="a",
+        interval=timedelta(hours=2),
+        start=start,
+        until=datetime(2024, 1, 2),
+    )
+    assert r.last(start - timedelta(seconds=1)) is None
+    assert r.first(start - timedelta(days=1)) == Event(start, "a")
+    assert r.last(datetime(2024, 1, 1, 5)) == Event(datetime(2024, 1, 1, 4), "a")
+    assert r.last(datetime(2024, 3, 1)) == Event(datetime(2024, 1, 1, 22), "a")
+    assert r.first(datetime(2024, 1, 1, 22)) is None
+    assert len(list(r.occurrences(start - timedelta(seconds=1)))) == 12
+
+
+def test_rule_invalid():
+    with pytest.raises(ValueError):
+        Rule(playlist="a")
+    with pytest.raises(ValueError):
+        Rule.from_yaml({"at": "08:00", "days": "someday", "playlist": "a"})
+    # an interval does not follow weekdays
+    with pytest.raises(ValueError):
+        Rule.from_yaml({"every": "2h", "days": "mon-fri", "playlist": "a"})
+
+
+def test_parse_rules():
+    yml = """
+- after: 2024-01-01 06:00
+  playlist: once
+- at: ["08:00", "18:30"]
+  playlist: daily
+- every: 1d
+  from: 2024-01-01 07:00
+  until: 2024-01-03 00:00
+  playlist: interval
+"""
+    s = Schedule.from_yaml(yaml.safe_load(yml))
+    assert len(s) == 1
+    assert len(s.rules) == 2
+    assert s.playlists() == {"once", "daily", "interval"}
+    assert s.rules[0].at == (time(8), time(18, 30))
+    now = datetime(2024, 1, 1, 7, 30)
+    assert s.current(now) == Event(datetime(2024, 1, 1, 7), "interval")
+    assert s.next(now) == Event(datetime(2024, 1, 1, 8), "daily")
+    evs = list(itertools.islice(s.events(datetime(2024, 1, 1)), 6))
+    assert [(e.when.day, e.when.hour, e.playlist) for e in evs] == [
+        (1, 6, "once"),
+        (1, 7, "interval"),
+        (1, 8, "daily"),
+        (1, 18, "daily"),
+        (2, 7, "interval"),
+        (2, 8, "daily"),
+    ]
+
+
+def test_long_schedule():
+    start = datetime(2020, 1, 1)
+    s = Schedule(
+        (Event(start + timedelta(hours=i), str(i % 3)) for i in range(24 * 365 * 3)),
+        [Rule(playlist="r", at=(time(0, 30),))],
+    )
+    now = datetime(2021, 6, 1, 12, 15)
+    assert s.current(now) == Event(datetime(2021, 6, 1, 12), str((517 * 24 + 12) % 3))
+    assert s.next(datetime(2021, 6, 1, 0, 10)) == Event(
+        datetime(2021, 6, 1, 0, 30), "r"
+    )
+
+
+def test_equality_rules():
+    a = Schedule(rules=[Rule(playlist="a", at=(time(8),))])
+    assert a != Schedule()
+    assert a == Schedule(rules=[Rule(playlist="a", at=(time(8),))])
+
+
+def test_aware_times():
+    when = datetime(2024, 6, 1, 12, tzinfo=timezone.utc)
+    local = when.astimezone().replace(tzinfo=None)
+    s = Schedule([Event(when, "a")])
+    assert s == [Event(local, "a")]
+    assert s.current(when) == Event(local, "a")
+    s = Schedule.from_yaml([{"after": "2024-06-01T12:00+00:00", "playlist": "a"}])
+    assert s == [Event(local, "a")]
@@ -0,0 +1,50 @@
+import asyncio
+import os
+
+from datetime import datetime
+from pathlib import Path
+
+from mplayer import snapshot
+from mplayer.core import make_core
+from mplayer.playlist import Playlist, Entry
+from mplayer.schedule import Schedule, Event
+
+
+def test_roundtrip(tmp_path):
+    plists = [
+        Playlist([Entry(Path("/a/1.png")), Entry(Path("/a/2.png"))], name="a"),
+        Playlist([Entry(Path("/b/1.png")), Entry(Path("/a/3.png"))], name="b"),
+    ]
+    sched = Schedule([Event(when=datetime.fromtimestamp(0), playlist="a")])
+    files = [Path("/p.yaml")]
+    snapshot.save(tmp_path / "snap", files, plists, sched)
+    res = snapshot.load(tmp_path / "snap", files)
+    assert res is not None
+    loaded, loaded_sched = res
+    assert [p.name for p in loaded] == ["a", "b"]
+    assert loaded == plists
+    assert loaded_sched == sched
+    assert snapshot.load(tmp_path / "snap", [Path("/q.yaml")]) is None
+    assert snapshot.load(tmp_path / "missing", files) is None
+
+
+def test_warm_start(tmp_path):
+    plist = tmp_path / "p.yaml"
+    plist.write_text("name: p\nmedia: [glob://*.png]\n")
+    (tmp_path / "a.png").touch()
+
+    async def run():
+        c = await make_core([plist], None, warm_start=True)
+        c.close()
+        (tmp_path / "b.png").touch()
+        # not held back as still being written
+        for f in tmp_path.glob("*.png"):
+            os.utime(f, (1000, 1000))
+        c = await make_core([plist], None, warm_start=True)
+        # served from the snapshot before the rescan finishes
+        assert [m.name async for m in c.medias(wait=False)] == ["a.png"]
+        await c._rescans.join()
+        res = sorted([m.name async for m in c.medias(wait=False)])
+        assert res == ["a.png", "b.png"]
+
+    asyncio.run(run())
@@ -0,0 +1,167 @@
+import asyncio
+import glob
+import os
+
+from pathlib import Path
+
+import pytest
+
+from mplayer import url
+from mplayer.statcache import ListingCache, StatCache
+
+
+@pytest.fixture
+def tree(tmp_path):
+    for f in [
+        "a.png",
+        "b.jpg",
+        ".hidden.png",
+        "sub/c.png",
+        "sub/deeper/d.png",
+        "sub/deeper/e.mp4",
+        ".hdir/f.png",
+        "other/g.png",
+    ]:
+        (tmp_path / f).parent.mkdir(parents=True, exist_ok=True)
+        (tmp_path / f).touch()
+    return tmp_path
+
+
+def _resolve_async(u: str, root: Path | None = None):
+    async def run():
+        return {p async for p in url.resolve_async(u, root=root)}
+
+    return asyncio.run(run())
+
+
+@pytest.mark.parametrize(
+    "pattern", ["*.png", "**/*.png", "sub/**/*.png", "s*/*.png", "**", "*/deeper/*"]
+)
+def test_resolve_async_abs(tree, pattern):
+    expected = set(url.resolve(f"glob://{tree}/{pattern}"))
+    assert _resolve_async(f"glob://{tree}/{pattern}") == expected
+
+
+@pytest.mark.parametrize("pattern", ["*.png", "deeper/*.png", "*", "sub"])
+def test_resolve_async_rel(tree, pattern):
+    expected = set(url.resolve(f"glob://{pattern}", root=tree))
+    assert _resolve_async(f"glob://{pattern}", root=tree) == expected
+
+
+@pytest.mark.parametrize("pattern", ["*.png", "**/*.png", "**", "*/deeper/*", "sub"])
+def test_matches(tree, pattern):
+    paths = set(tree.rglob("*")) | {tree}
+    for u, root in [(f"glob://{tree}/{pattern}", None), (f"glob://{pattern}", tree)]:
+        expected = _resolve_async(u, root)
+        assert {p for p in paths if url.matches(u, p, root=root)} == expected
+
+
+def test_resolve_async_order(tmp_path):
+    for i in range(30):
+        for f in ["b.png", "a.png", "sub/c.png"]:
+            (tmp_path / f"d{i}" / f).parent.mkdir(parents=True, exist_ok=True)
+            (tmp_path / f"d{i}" / f).touch()
+
+    async def run():
+        return [p async for p in url.resolve_async(f"glob://{tmp_path}/**/*.png")]
+
+    # depth-first with each directory sorted, regardless of scan timing
+    expected = sorted(asyncio.run(run()), key=lambda p: p.parts)
+    for _ in range(5):
+        assert asyncio.run(run()) == expected
+
+
+def test_resolve_async_file(tree):
+    assert _resolve_async("a.png", root=tree) == {tree / "a.png"}
+    assert _resolve_async(f"glob://{tree}/a.png") == {tree / "a.png"}
+    assert _resolve_async(f"glob://{tree}/x.png") == set()
+
+
+def test_base(tree):
+    assert url.base("glob://*.png", root=tree) == (tree, True)
+    assert url.base(f"glob://{tree}/sub/*/x.png") == (tree / "sub", True)
+    assert url.base("a.png", root=tree) == (tree, False)
+
+
+def test_listing_cache(tree):
+    listings = ListingCache()
+
+    def resolve():
+        async def run():
+            stats = StatCache(listings=listings)
+            return {
+                p
+                async for p in url.resolve_async(f"glob://{tree}/**/*.png", stats=stats)
+            }
+
+        return asyncio.run(run())
+
+    def age(d: Path):
+        os.utime(d, (1000, 1000))
+
+    for d in [tree, tree / "sub", tree / "sub/deeper", tree / "other"]:
+        age(d)
+    first = resolve()
+    assert len(listings) == 4
+    # not noticed while the directory looks unchanged
+    (tree / "sub/new.png").touch()
+    age(tree / "sub")
+    assert resolve() == first
+    listings.invalidate([tree / "sub/new.png"])
+    assert resolve() == first | {tree / "sub/new.png"}
+    # adding a file changes the mtime of the directory
+    (tree / "other/new.png").touch()
+    assert tree / "other/new.png" in resolve()
+
+
+def test_listing_cache_stats(tree):
+    listings = ListingCache()
+
+    def sizes():
+        async def run():
+            stats = StatCache(listings=listings)
+            return {
+                p: stats.stat(p).st_size
+                async for p in url.resolve_async(f"glob://{tree}/**/*.png", stats=stats)
+            }
+
+        return asyncio.run(run())
+
+    for d in [tree, tree / "sub", tree / "sub/deeper", tree / "other"]:
+        os.utime(d, (1000, 1000))
+    assert sizes()[tree / "a.png"] == 0
+    # rewriting a file in place does not change the mtime of its directory
+    (tree / "a.png").write_bytes(b"xyz")
+    os.utime(tree, (1000, 1000))
+    assert sizes()[tree / "a.png"] == 3
+    # listings of removed directories are dropped
+    for f in (tree / "sub/deeper").iterdir():
+        f.unlink()
+    (tree / "sub/deeper").rmdir()
+    os.utime(tree / "sub", (2000, 2000))
+    sizes()
+    assert len(listings) == 3
+
+
+def test_listing_cache_warm(tree, monkeypatch):
+    listings = ListingCache()
+    dirs = [tree, tree / "sub", tree / "sub/deeper", tree / "other"]
+    for d in dirs:
+        os.utime(d, (1000, 1000))
+
+    async def run():
+        stats = StatCache(listings=listings)
+        async for _ in url.resolve_async(f"glob://{tree}/**/*.png", stats=stats):
+            pass
+        return stats
+
+    assert asyncio.run(run()).relisted
+    calls = []
+    stat = os.stat
+    monkeypatch.setattr(
+        os, "stat", lambda p, *a, **kw: calls.append(p) or stat(p, *a, **kw)
+    )
+    stats = asyncio.run(run())
+    # one stat per directory and none per file
+    assert sorted(calls) == sorted(str(d) for d in dirs)
+    assert not stats and not stats.relisted
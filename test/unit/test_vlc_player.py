@@ -0,0 +1,165 @@
+import asyncio
+import sys
+import threading
+import types
+
+import pytest
+
+
+class _Media:
+    def __init__(self, path):
+        self.path = path
+        self.parsed = False
+
+    def add_option(self, opt):
+        pass
+
+    def parse_with_options(self, flags, timeout):
+        self.parsed = True
+
+
+class _MediaPlayer:
+    def __init__(self):
+        self.media = None
+        # media passed to play() in order
+        self.started = []
+        self._events = {}
+
+    def event_manager(self):
+        return self
+
+    def event_attach(self, kind, cb):
+        self._events[kind] = cb
+
+    def fire(self, kind):
+        self._events[kind](None)
+
+    def set_media(self, media):
+        self.media = media
+
+    def play(self):
+        self.started.append(self.media)
+
+    def stop(self):
+        pass
+
+    def set_pause(self, val):
+        pass
+
+    def get_time(self):
+        return 0
+
+
+class _Instance:
+    def __init__(self, *args):
+        pass
+
+    def media_player_new(self):
+        return _MediaPlayer()
+
+    def media_new(self, path):
+        return _Media(path)
+
+
+@pytest.fixture
+def vlc_player(monkeypatch):
+    vlc = types.ModuleType("vlc")
+    vlc.Instance = _Instance
+    vlc.Media = _Media
+    vlc.EventType = types.SimpleNamespace(
+        MediaPlayerEndReached="end",
+        MediaPlayerVout="vout",
+        MediaPlayerPlaying="playing",
+        MediaPlayerEncounteredError="error",
+    )
+    vlc.MediaParseFlag = types.SimpleNamespace(local=0)
+    monkeypatch.setitem(sys.modules, "vlc", vlc)
+    monkeypatch.delitem(sys.modules, "mplayer.vlc_player", raising=False)
+    from mplayer import vlc_player
+
+    return vlc_player
+
+
+def _files(tmp_path, *names):
+    out = []
+    for n in names:
+        (tmp_path / n).touch()
+        out.append(tmp_path / n)
+    return out
+
+
+async def _until(cond):
+    while not cond():
+        await asyncio.sleep(0.01)
+
+
+def test_on_playing(tmp_path, vlc_player):
+    (a,) = _files(tmp_path, "a.mp4")
+
+    async def run():
+        p = vlc_player.VlcPlayer()
+        playing = []
+        p.on_playing = playing.append
+        task = asyncio.create_task(p.play(a))
+        await _until(lambda: p._player.started)
+        p._player.fire("playing")
+        p._player.fire("end")
+        await task
+        return playing
+
+    assert asyncio.run(asyncio.wait_for(run(), 5)) == [a]
+
+
+def test_handover(tmp_path, vlc_player):
+    a, b = _files(tmp_path, "a.mp4", "b.mp4")
+
+    async def run():
+        p = vlc_player.VlcPlayer()
+        vp = p._player
+        task = asyncio.create_task(p.play(a))
+        await _until(lambda: vp.started)
+        await p.stage(b)
+        vp.fire("end")
+        await task
+        # started from the end-of-media event, play() does not start it again
+        await _until(lambda: len(vp.started) == 2)
+        task = asyncio.create_task(p.play(b))
+        await asyncio.sleep(0.05)
+        vp.fire("vout")
+        vp.fire("end")
+        await task
+        return p, vp
+
+    p, vp = asyncio.run(asyncio.wait_for(run(), 5))
+    assert len(vp.started) == 2
+    assert vp.started[1].parsed
+    assert p._current == b
+    assert p.last_gap is not None
+
+
+def test_stale_advance(tmp_path, vlc_player):
+    a, b, c = _files(tmp_path, "a.mp4", "b.mp4", "c.mp4")
+
+    async def run():
+        p = vlc_player.VlcPlayer()
+        vp = p._player
+        task = asyncio.create_task(p.play(a))
+        await _until(lambda: vp.started)
+        await p.stage(b)
+        # hold the switcher so the handover runs after play(c)
+        release = threading.Event()
+        p._switcher.submit(release.wait)
+        vp.fire("end")
+        await task
+        task = asyncio.create_task(p.play(c))
+        await _until(lambda: len(vp.started) == 2)
+        release.set()
+        await asyncio.to_thread(p._switcher.submit(lambda: None).result)
+        vp.fire("end")
+        await task
+        return p, vp
+
+    p, vp = asyncio.run(asyncio.wait_for(run(), 5))
+    # the staged media was dropped, not started over the wanted one
+    assert len(vp.started) == 2
+    assert p._current == c
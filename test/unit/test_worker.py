@@ -0,0 +1,94 @@
+import asyncio
+import os
+import signal
+
+import pytest
+
+from mplayer import worker
+from mplayer.worker import WorkerError, WorkerPlayer
+
+
+def test_play(tmp_path):
+    f = tmp_path / "a.png"
+    f.touch()
+
+    async def run():
+        p = WorkerPlayer("sim")
+        playing = []
+        p.on_playing = playing.append
+        try:
+            await p.stage(f)
+            await p.play(f)
+        finally:
+            await p.close()
+        return playing
+
+    assert asyncio.run(asyncio.wait_for(run(), 10)) == [f]
+
+
+def test_missing_file(tmp_path):
+    async def run():
+        p = WorkerPlayer("sim")
+        try:
+            await p.play(tmp_path / "nope.png")
+        finally:
+            await p.close()
+
+    with pytest.raises(FileNotFoundError):
+        asyncio.run(asyncio.wait_for(run(), 10))
+
+
+def test_restart(tmp_path):
+    f = tmp_path / "a.png"
+    f.touch()
+
+    async def run():
+        p = WorkerPlayer("sim", timeout=0.5, heartbeat=0.1)
+        errors = []
+        p.on_error = lambda file, err: errors.append((file, err))
+        try:
+            await p.play(f)
+            # a crashed worker is replaced on the next request
+            crashed = p.pid
+            os.kill(crashed, signal.SIGKILL)
+            while p.pid is not None:
+                await asyncio.sleep(0.01)
+            await p.play(f)
+            assert p.pid != crashed
+            # a hung worker is killed and the media skipped
+            os.kill(p.pid, signal.SIGSTOP)
+            await p.play(f)
+            assert p.pid is None
+            await p.play(f)
+        finally:
+            await p.close()
+        return errors
+
+    errors = asyncio.run(asyncio.wait_for(run(), 10))
+    assert errors == [(f, "player worker not responding")]
+
+
+def test_start_failures(tmp_path, monkeypatch):
+    monkeypatch.setattr(worker, "_BACKOFF", 0.05)
+    f = tmp_path / "a.png"
+    f.touch()
+
+    async def run():
+        # the worker exits right away on the unknown backend
+        p = WorkerPlayer("nope")
+        errors = []
+        p.on_error = lambda file, err: errors.append(file)
+        try:
+            with pytest.raises(WorkerError):
+                for _ in range(worker._MAX_START_FAILURES + 1):
+                    await p.play(f)
+            # no more workers are started
+            with pytest.raises(WorkerError):
+                await p.play(f)
+            assert p.pid is None
+        finally:
+            await p.close()
+        return errors
+
+    errors = asyncio.run(asyncio.wait_for(run(), 10))
+    assert len(errors) < worker._MAX_START_FAILURES